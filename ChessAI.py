@@ -4,7 +4,23 @@
 # In[ ]:
 
 
+import argparse
+import contextlib
+import hashlib
+import json
+import mmap
+import multiprocessing
 import os
+import random
+import sqlite3
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy
+except ImportError: # only needed by BatchEvaluator
+    numpy = None
 
 class HeuristicScores:
     CHECKMATE = 100000000
@@ -14,6 +30,63 @@ class HeuristicScores:
     SCORES = {'Q' : 5, 'R' : 4, 'B' : 3, 'N' : 3, 'P' : 1, 'K' : 0}
     
     OPPORTUNITIES_COEF = 0.05
+    
+    # piece-square terms are added to the utility multiplied by this coefficient (0 disables them)
+    # 0.01 makes the tables below worth up to about half a pawn per piece
+    PIECE_SQUARE_COEF = 0
+    
+    # bonus of a piece for standing on each position, from white's view
+    # listed row by row starting from row 1 (index y * 8 + x), black uses them mirrored
+    PIECE_SQUARE_TABLES = {
+        'P': [  0,   0,   0,   0,   0,   0,   0,   0,
+                5,  10,  10, -20, -20,  10,  10,   5,
+                5,  -5, -10,   0,   0, -10,  -5,   5,
+                0,   0,   0,  20,  20,   0,   0,   0,
+                5,   5,  10,  25,  25,  10,   5,   5,
+               10,  10,  20,  30,  30,  20,  10,  10,
+               50,  50,  50,  50,  50,  50,  50,  50,
+                0,   0,   0,   0,   0,   0,   0,   0],
+        'N': [-50, -40, -30, -30, -30, -30, -40, -50,
+              -40, -20,   0,   5,   5,   0, -20, -40,
+              -30,   5,  10,  15,  15,  10,   5, -30,
+              -30,   0,  15,  20,  20,  15,   0, -30,
+              -30,   5,  15,  20,  20,  15,   5, -30,
+              -30,   0,  10,  15,  15,  10,   0, -30,
+              -40, -20,   0,   0,   0,   0, -20, -40,
+              -50, -40, -30, -30, -30, -30, -40, -50],
+        'B': [-20, -10, -10, -10, -10, -10, -10, -20,
+              -10,   5,   0,   0,   0,   0,   5, -10,
+              -10,  10,  10,  10,  10,  10,  10, -10,
+              -10,   0,  10,  10,  10,  10,   0, -10,
+              -10,   5,   5,  10,  10,   5,   5, -10,
+              -10,   0,   5,  10,  10,   5,   0, -10,
+              -10,   0,   0,   0,   0,   0,   0, -10,
+              -20, -10, -10, -10, -10, -10, -10, -20],
+        'R': [  0,   0,   0,   5,   5,   0,   0,   0,
+               -5,   0,   0,   0,   0,   0,   0,  -5,
+               -5,   0,   0,   0,   0,   0,   0,  -5,
+               -5,   0,   0,   0,   0,   0,   0,  -5,
+               -5,   0,   0,   0,   0,   0,   0,  -5,
+               -5,   0,   0,   0,   0,   0,   0,  -5,
+                5,  10,  10,  10,  10,  10,  10,   5,
+                0,   0,   0,   0,   0,   0,   0,   0],
+        'Q': [-20, -10, -10,  -5,  -5, -10, -10, -20,
+              -10,   0,   5,   0,   0,   0,   0, -10,
+              -10,   5,   5,   5,   5,   5,   0, -10,
+                0,   0,   5,   5,   5,   5,   0,  -5,
+               -5,   0,   5,   5,   5,   5,   0,  -5,
+              -10,   0,   5,   5,   5,   5,   0, -10,
+              -10,   0,   0,   0,   0,   0,   0, -10,
+              -20, -10, -10,  -5,  -5, -10, -10, -20],
+        'K': [ 20,  30,  10,   0,   0,  10,  30,  20,
+               20,  20,   0,   0,   0,   0,  20,  20,
+              -10, -20, -20, -20, -20, -20, -20, -10,
+              -20, -30, -30, -40, -40, -30, -30, -20,
+              -30, -40, -40, -50, -50, -40, -40, -30,
+              -30, -40, -40, -50, -50, -40, -40, -30,
+              -30, -40, -40, -50, -50, -40, -40, -30,
+              -30, -40, -40, -50, -50, -40, -40, -30],
+    }
 
 
 class GameStatus:
@@ -28,6 +101,76 @@ class GameStatus:
     CHECKMATE = 'CHECKMATE'
     STALEMATE = 'STALEMATE'
 
+
+# precomputed move tables, indexed by board position [y][x]
+# (y is the row index, x is the column index, same as ChessBoard.board)
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+# for every position, the list of positions reachable by a single jump
+def build_jump_table(offsets):
+    table = [[[] for x in range(8)] for y in range(8)]
+    for y in range(8):
+        for x in range(8):
+            for dy, dx in offsets:
+                if 0 <= y + dy < 8 and 0 <= x + dx < 8:
+                    table[y][x].append((y + dy, x + dx))
+    return table
+
+# for every position, the list of rays (one per direction) a sliding piece can move along
+# each ray lists the positions in order of distance, so it can be cut at the first blocker
+def build_ray_table(directions):
+    table = [[[] for x in range(8)] for y in range(8)]
+    for y in range(8):
+        for x in range(8):
+            for dy, dx in directions:
+                ray = []
+                ty, tx = y + dy, x + dx
+                while 0 <= ty < 8 and 0 <= tx < 8:
+                    ray.append((ty, tx))
+                    ty, tx = ty + dy, tx + dx
+                if ray:
+                    table[y][x].append(ray)
+    return table
+
+KNIGHT_TARGETS = build_jump_table(KNIGHT_OFFSETS)
+KING_TARGETS = build_jump_table(KING_OFFSETS)
+ROOK_RAYS = build_ray_table(ROOK_DIRECTIONS)
+BISHOP_RAYS = build_ray_table(BISHOP_DIRECTIONS)
+QUEEN_RAYS = [[ROOK_RAYS[y][x] + BISHOP_RAYS[y][x] for x in range(8)] for y in range(8)]
+SLIDING_RAYS = {'R': ROOK_RAYS, 'B': BISHOP_RAYS, 'Q': QUEEN_RAYS}
+
+# chess notation of every position, e.g. POSITION_NAMES[0][0] == 'A1'
+POSITION_NAMES = [[chr(x + ord('A')) + str(y + 1) for x in range(8)] for y in range(8)]
+
+# piece-square bonus of every piece at every position, from white's view (black's bonuses are negative)
+PIECE_SQUARE_VALUES = {}
+for piece_type, table in HeuristicScores.PIECE_SQUARE_TABLES.items():
+    PIECE_SQUARE_VALUES['w' + piece_type] = table[:]
+    PIECE_SQUARE_VALUES['b' + piece_type] = [-table[(7 - (sq >> 3)) * 8 + (sq & 7)] for sq in range(64)]
+
+# integer codes of the pieces (0 for an empty position), for boards written as arrays of 64 codes
+PIECE_CODES = ['.'] + [color + piece for color in 'wb' for piece in 'PNBRQK']
+PIECE_CODE = {piece: code for code, piece in enumerate(PIECE_CODES)}
+
+# pawn promotion replacements, in the order they are encoded in packed moves
+PROMOTION_PIECES = [None, 'N', 'B', 'R', 'Q']
+
+# Zobrist keys: a position's key is the xor of the keys of its pieces (per position),
+# the side to move and the castling flags, so a move updates it with a few xors
+# generated from a fixed seed so keys (and files keyed by them) are the same in every process
+zobrist_random = random.Random(20231)
+ZOBRIST_PIECES = {color + piece: [zobrist_random.getrandbits(64) for i in range(64)]
+                  for color in 'wb' for piece in 'PNBRQK'}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+# [king_ever_moved, left_rook_ever_moved, right_rook_ever_moved] of each color
+ZOBRIST_CASTLING = {color: [zobrist_random.getrandbits(64) for i in range(3)] for color in 'wb'}
+# xored into transposition table keys of the searches maximizing each player's utility
+ZOBRIST_MAX_PLAYER = {'w': 0, 'b': zobrist_random.getrandbits(64)}
+
+
 class ChessBoard():
     def __init__(self, orig=None):
         if orig is None:
@@ -54,15 +197,34 @@ class ChessBoard():
         self.right_rook_ever_moved = {'b': False, 'w': False}
         self.left_rook_ever_moved = {'b': False, 'w': False}
         
-        # information to help sort successor outcomes in alpha-beta pruning:
+        # kings' positions, kept up to date so king safety doesn't need a board scan:
+        self.king_position = self.__find_kings()
+        
+        # information to help sort successor outcomes in alpha-beta pruning
+        # (score of the piece captured by the last move, 0 if it captured nothing):
         self.last_move_score = 0
         
+        # (move, undo information, zobrist key, material and position balance) of the moves
+        # played on this board, used by pop:
+        self.__history = []
+        
+        # the legal moves of the position, see __position_moves:
+        self.__moves_cache = None
+        
+        # functions called with (board, packed move) after every move completed by play or apply_promotion
+        # (e.g. GameRecordWriter's), the moves of the search (push) aren't observed:
+        self.observers = []
+        
+        # Zobrist key of the position, updated incrementally by every move:
+        self.zobrist_key = self.compute_zobrist_key()
+        
+        # white's minus black's material (HeuristicScores.SCORES) and piece-square bonuses,
+        # updated incrementally by every move:
+        self.refresh_evaluation()
+        
     # copy existing board:
     def __copy_constructor(self, orig):
-        self.board = [['']*8 for i in range(8)]
-        for y, row in enumerate(orig.board):
-            for x, piece in enumerate(row):
-                self.board[y][x] = piece
+        self._copy_position(orig)
                 
         self.turn = orig.turn
         self.status = orig.status
@@ -71,8 +233,137 @@ class ChessBoard():
         self.right_rook_ever_moved = orig.right_rook_ever_moved.copy()
         self.left_rook_ever_moved = orig.left_rook_ever_moved.copy()
         
+        self.king_position = orig.king_position.copy()
+        
         self.last_move_score = orig.last_move_score
         
+        # a copied board starts with its own (empty) list of moves to take back:
+        self.__history = []
+        # but shares the legal moves already generated for the position (e.g. the game board's with a search):
+        self.__moves_cache = orig.__moves_cache
+        # copies (e.g. the search's) don't notify the game's observers:
+        self.observers = []
+        
+        self.zobrist_key = orig.zobrist_key
+        self.material_balance = orig.material_balance
+        self.position_balance = orig.position_balance
+        
+    # copies the pieces' placement of another board
+    # the position is stored as a list of 8 rows of pieces such as 'wP', '.' for an empty position
+    # other board backends (see BitboardChessBoard) override the methods touching self.board directly
+    def _copy_position(self, orig):
+        self.board = [row[:] for row in orig.board]
+        
+    # returns the piece at position [y][x], '.' if there is no piece
+    def piece_at(self, y, x):
+        return self.board[y][x]
+    
+    # replaces whatever is at position [y][x] with piece
+    def _put_piece(self, y, x, piece):
+        self.board[y][x] = piece
+        
+    # returns the position as a list of 64 PIECE_CODES indexes (index y * 8 + x)
+    def piece_codes(self):
+        return [PIECE_CODE[piece] for row in self.board for piece in row]
+        
+    # returns the kings' positions by scanning the board
+    def __find_kings(self):
+        king_position = {}
+        for y, row in enumerate(self.board):
+            for x, piece in enumerate(row):
+                if piece != '.' and piece[1] == 'K':
+                    king_position[piece[0]] = (y, x)
+        return king_position
+        
+    # creates a board (of the class it is called on) with the position of a FEN record
+    @classmethod
+    def from_fen(cls, fen):
+        chess_board = cls()
+        chess_board.set_fen(fen)
+        return chess_board
+    
+    # sets up the position of a FEN record, e.g. 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+    # (an EPD position, the first 4 fields of a FEN record, is accepted too)
+    # the castling rights set king_ever_moved and the rooks' flags (the left rook is the one of column A, 'Q')
+    # the en passant and move counter fields are ignored, since the game has no en passant and doesn't count moves
+    def set_fen(self, fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise Exception('ERROR: invalid FEN, the pieces and the side to move are required: ' + fen)
+        
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise Exception('ERROR: invalid FEN, 8 ranks are required: ' + fen)
+        board = []
+        for rank in reversed(ranks): # from rank 1
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row += ['.'] * int(char)
+                elif char.upper() in 'PNBRQK':
+                    row.append(('w' if char.isupper() else 'b') + char.upper())
+                else:
+                    raise Exception('ERROR: invalid FEN, unknown piece ' + char + ': ' + fen)
+            if len(row) != 8:
+                raise Exception('ERROR: invalid FEN, a rank must have 8 positions: ' + fen)
+            board.append(row)
+        for color in 'wb':
+            if sum(row.count(color + 'K') for row in board) != 1:
+                raise Exception('ERROR: invalid FEN, each player needs a king: ' + fen)
+                
+        if fields[1] not in ('w', 'b'):
+            raise Exception('ERROR: invalid FEN, the side to move must be w or b: ' + fen)
+        castling = fields[2] if len(fields) > 2 else '-'
+        if castling != '-' and any(char not in 'KQkq' for char in castling):
+            raise Exception('ERROR: invalid FEN castling rights: ' + fen)
+        
+        self.board = board
+        self.turn = fields[1]
+        self.status = GameStatus.VALID_MOVE
+        for color, right, left in (('w', 'K', 'Q'), ('b', 'k', 'q')):
+            self.right_rook_ever_moved[color] = right not in castling
+            self.left_rook_ever_moved[color] = left not in castling
+            self.king_ever_moved[color] = right not in castling and left not in castling
+        
+        self.king_position = self.__find_kings()
+        self.last_move_score = 0
+        self.__history = []
+        self.__moves_cache = None
+        self.zobrist_key = self.compute_zobrist_key()
+        self.refresh_evaluation()
+        
+    # returns the FEN record of the position
+    # castling rights are written only while the king and the rook stand on their initial positions,
+    # the en passant field is always '-' and the move counters '0 1'
+    def to_fen(self):
+        ranks = []
+        for y in range(7, -1, -1):
+            rank = ''
+            empty = 0
+            for x in range(8):
+                piece = self.piece_at(y, x)
+                if piece == '.':
+                    empty += 1
+                    continue
+                if empty > 0:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+            if empty > 0:
+                rank += str(empty)
+            ranks.append(rank)
+            
+        castling = ''
+        for color, row, right, left in (('w', 0, 'K', 'Q'), ('b', 7, 'k', 'q')):
+            if self.king_ever_moved[color] or self.piece_at(row, 4) != color + 'K':
+                continue
+            if not self.right_rook_ever_moved[color] and self.piece_at(row, 7) == color + 'R':
+                castling += right
+            if not self.left_rook_ever_moved[color] and self.piece_at(row, 0) == color + 'R':
+                castling += left
+                
+        return ' '.join(['/'.join(ranks), self.turn, castling if castling else '-', '-', '0', '1'])
+    
     def print_board(self):
         for index, row in enumerate(self.board):
             print(index + 1, end='\t')
@@ -133,57 +424,44 @@ class ChessBoard():
         start = ChessBoard.chess_pos_to_index(start)
         target = ChessBoard.chess_pos_to_index(target)
         
-        if not self.__check_move_legal(start, target):
+        # a move among the legal moves already generated for the position needs no verification:
+        cache = self.__moves_cache
+        if cache is not None and cache[0] == self.zobrist_key:
+            if cache[3] is None:
+                cache[3] = {move & 0xFFF for move in cache[1]}
+            if (start[0] * 8 + start[1]) | ((target[0] * 8 + target[1]) << 6) in cache[3]:
+                return self.__apply_move(start, target, verified=True)
+        
+        if not self._check_move_legal(start, target):
             self.status = GameStatus.INVALID_MOVE
             return self.status
-        
+
+        return self.__apply_move(start, target)
+
+    # applies a move that is known to follow the piece's movement rules and returns status
+    # (verified if it is known to be legal)
+    # status can be: VALID_MOVE, INVALID_MOVE_DUE_TO_CHECK or AWAITING_PROMOTION
+    def __apply_move(self, start, target, verified=False):
         # possibly valid move, but still need to check if player's king gets in danger
-        # so what we do is: temporarily apply the move, check for king being checked
-        # if king is safe, confirm the move otherwise restore board and let user 
-        # make a different move
-        
-        # save game state to restore:
-        orig_board = ChessBoard(self)
-        
-        # valid action, apply the move:
-        piece = self.board[start[0]][start[1]]
-        self.board[start[0]][start[1]] = '.'
-        if self.board[target[0]][target[1]] != '.':
-            self.last_move_score = HeuristicScores.SCORES[self.board[target[0]][target[1]][1]]
-        self.board[target[0]][target[1]] = piece
-        
-        # update castling validation information:
-        row = 7 if self.turn == 'b' else 0
-        if piece[1] == 'K':
-            self.king_ever_moved[self.turn] = True
-        if piece[1] == 'R':
-            if start == [row, 0]:
-                self.left_rook_ever_moved[self.turn] = True
-            elif start == [row, 7]:
-                self.right_rook_ever_moved[self.turn] = True
-        
-        # check if movement is castling:
-        if piece[1] == 'K' and abs(target[1] - start[1]) == 2:
-            if target[1] > start[1]: # moving the right Rook:
-                self.board[row][7] = '.'
-                self.board[row][5] = self.turn + 'R'
-            else: # moving the left Rook:
-                self.board[row][0] = '.'
-                self.board[row][3] = self.turn + 'R'
-                
         # pawn promotion has no effect on player's king getting checked or not
         # so we check and apply it after move verification
         
-        # if player's king is threatened (move verification)
-        if self.__check_check():
-            # restore original board:
-            self.__copy_constructor(orig_board)
-            
+        # if player's king would be threatened (move verification)
+        if not verified and not self._move_safe(self._king_safety(), start, target):
             self.status = GameStatus.INVALID_MOVE_DUE_TO_CHECK
             return self.status
         
+        # the position changes, so do its legal moves:
+        self.__moves_cache = None
+        
         # now we made sure that the move is valid and verified
         # so the movement is confirmed
+        piece = self.piece_at(start[0], start[1])
+        undo = self._make(start, target)
+        self.__history.append((ChessBoard.encode_move(start, target), undo, self.zobrist_key,
+                               self.material_balance, self.position_balance))
+        self.__update_zobrist_key(undo)
+        self.__update_evaluation(undo)
                 
         # check if movement is promotion:
         if piece[1] == 'P' and (target[0] == 0 or target[0] == 7):
@@ -193,7 +471,220 @@ class ChessBoard():
         # successful move, now it's opponent's turn
         self.status = GameStatus.VALID_MOVE
         self.turn = ChessBoard.__opposite_turn(self.turn)
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        self.__notify_observers()
         return self.status
+    
+    # calls the observers with the move just completed
+    def __notify_observers(self):
+        move = self.__history[-1][0]
+        for observer in self.observers:
+            observer(self, move)
+            
+    # boards are pickled (e.g. for worker processes) without their observers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['observers'] = []
+        return state
+
+    # moves the piece at position(start) to position(target) without any verification
+    # the turn is not changed, returns the information needed by _unmake to take the move back
+    # the undo information starts with (sy, sx, ty, tx, moved piece, captured piece, placed piece, castled corner)
+    # followed by the previous castling flags of the player
+    def _make(self, start, target, promotion=None):
+        sy, sx = start
+        ty, tx = target
+        turn = self.turn
+        piece = self.board[sy][sx]
+        captured = self.board[ty][tx]
+        undo_flags = (self.king_ever_moved[turn], self.left_rook_ever_moved[turn],
+                      self.right_rook_ever_moved[turn], self.last_move_score, self.status)
+        
+        # apply the move:
+        self.board[sy][sx] = '.'
+        self.last_move_score = HeuristicScores.SCORES[captured[1]] if captured != '.' else 0
+        placed = piece if promotion is None else turn + promotion
+        self.board[ty][tx] = placed
+        
+        # update castling validation information:
+        row = 7 if turn == 'b' else 0
+        corner = None
+        if piece[1] == 'K':
+            self.king_ever_moved[turn] = True
+            self.king_position[turn] = (ty, tx)
+            
+            # check if movement is castling:
+            if abs(tx - sx) == 2:
+                if tx > sx: # moving the right Rook:
+                    corner = self.board[row][7]
+                    self.board[row][7] = '.'
+                    self.board[row][5] = turn + 'R'
+                else: # moving the left Rook:
+                    corner = self.board[row][0]
+                    self.board[row][0] = '.'
+                    self.board[row][3] = turn + 'R'
+        elif piece[1] == 'R' and sy == row:
+            if sx == 0:
+                self.left_rook_ever_moved[turn] = True
+            elif sx == 7:
+                self.right_rook_ever_moved[turn] = True
+                
+        return (sy, sx, ty, tx, piece, captured, placed, corner) + undo_flags
+    
+    # takes back a move applied by _make
+    def _unmake(self, undo):
+        sy, sx, ty, tx, piece, captured, placed, corner, king_moved, left_moved, right_moved, last_move_score, status = undo
+        turn = piece[0]
+        
+        self.board[sy][sx] = piece
+        self.board[ty][tx] = captured
+        if piece[1] == 'K':
+            self.king_position[turn] = (sy, sx)
+        if corner is not None: # put the castled Rook back:
+            row = 7 if turn == 'b' else 0
+            if tx > sx:
+                self.board[row][7] = corner
+                self.board[row][5] = '.'
+            else:
+                self.board[row][0] = corner
+                self.board[row][3] = '.'
+        
+        self.king_ever_moved[turn] = king_moved
+        self.left_rook_ever_moved[turn] = left_moved
+        self.right_rook_ever_moved[turn] = right_moved
+        self.last_move_score = last_move_score
+        self.status = status
+        self.turn = turn
+        
+    # plays a legal move (packed int, as returned by legal_moves) and remembers how to take it back
+    def push(self, move):
+        start, target, promotion = ChessBoard.decode_move(move)
+        undo = self._make(start, target, promotion)
+        self.__history.append((move, undo, self.zobrist_key, self.material_balance, self.position_balance))
+        self.__update_zobrist_key(undo)
+        self.__update_evaluation(undo)
+        
+        self.status = GameStatus.VALID_MOVE
+        self.turn = ChessBoard.__opposite_turn(self.turn)
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        
+    # passes the turn to the opponent without moving (a null move, see MinMax's null-move pruning)
+    # taken back by pop like other moves
+    def push_null_move(self):
+        self.__history.append((None, self.status, self.zobrist_key, self.material_balance, self.position_balance))
+        self.status = GameStatus.VALID_MOVE
+        self.turn = ChessBoard.__opposite_turn(self.turn)
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        
+    # takes back the last move played by push or play and returns it (None for a null move)
+    def pop(self):
+        move, undo, self.zobrist_key, self.material_balance, self.position_balance = self.__history.pop()
+        if move is None: # null move, undo is the previous status
+            self.status = undo
+            self.turn = ChessBoard.__opposite_turn(self.turn)
+        else:
+            self._unmake(undo)
+        return move
+    
+    def last_move_is_null(self):
+        return len(self.__history) > 0 and self.__history[-1][0] is None
+    
+    # number of moves played on this board (since it was created or copied) that pop can take back
+    # e.g. the distance from the root of a search played on a copied board
+    def moves_played(self):
+        return len(self.__history)
+    
+    # computes the Zobrist key of the position from scratch
+    def compute_zobrist_key(self):
+        key = 0
+        for y in range(8):
+            for x in range(8):
+                piece = self.piece_at(y, x)
+                if piece != '.':
+                    key ^= ZOBRIST_PIECES[piece][y * 8 + x]
+        if self.turn == 'b':
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        for color in 'wb':
+            flags = (self.king_ever_moved[color], self.left_rook_ever_moved[color], self.right_rook_ever_moved[color])
+            for flag, flag_key in zip(flags, ZOBRIST_CASTLING[color]):
+                if flag:
+                    key ^= flag_key
+        return key
+    
+    # updates the Zobrist key for a move just applied by _make (the turn is not changed yet)
+    def __update_zobrist_key(self, undo):
+        sy, sx, ty, tx, piece, captured, placed, corner, king_moved, left_moved, right_moved = undo[:11]
+        turn = piece[0]
+        
+        key = self.zobrist_key ^ ZOBRIST_PIECES[piece][sy * 8 + sx] ^ ZOBRIST_PIECES[placed][ty * 8 + tx]
+        if captured != '.':
+            key ^= ZOBRIST_PIECES[captured][ty * 8 + tx]
+        if corner is not None: # castling
+            row = 7 if turn == 'b' else 0
+            corner_x, rook_x = (7, 5) if tx > sx else (0, 3)
+            if corner != '.':
+                key ^= ZOBRIST_PIECES[corner][row * 8 + corner_x]
+            key ^= ZOBRIST_PIECES[turn + 'R'][row * 8 + rook_x]
+            
+        flags = (self.king_ever_moved[turn], self.left_rook_ever_moved[turn], self.right_rook_ever_moved[turn])
+        for flag, old_flag, flag_key in zip(flags, (king_moved, left_moved, right_moved), ZOBRIST_CASTLING[turn]):
+            if flag != old_flag:
+                key ^= flag_key
+        self.zobrist_key = key
+        
+    # computes material_balance and position_balance from scratch
+    # (needed after changing HeuristicScores.SCORES)
+    def refresh_evaluation(self):
+        scores = self._material_scores()
+        self.material_balance = scores['w'] - scores['b']
+        self.position_balance = 0
+        for y in range(8):
+            for x in range(8):
+                piece = self.piece_at(y, x)
+                if piece != '.':
+                    self.position_balance += PIECE_SQUARE_VALUES[piece][y * 8 + x]
+        
+    # updates material_balance and position_balance for a move just applied by _make
+    def __update_evaluation(self, undo):
+        sy, sx, ty, tx, piece, captured, placed, corner = undo[:8]
+        scores = HeuristicScores.SCORES
+        sign = 1 if piece[0] == 'w' else -1
+        
+        material = sign * (scores[placed[1]] - scores[piece[1]])
+        position = PIECE_SQUARE_VALUES[placed][ty * 8 + tx] - PIECE_SQUARE_VALUES[piece][sy * 8 + sx]
+        if captured != '.':
+            material += sign * scores[captured[1]]
+            position -= PIECE_SQUARE_VALUES[captured][ty * 8 + tx]
+        if corner is not None: # castling
+            row = 7 if piece[0] == 'b' else 0
+            corner_x, rook_x = (7, 5) if tx > sx else (0, 3)
+            if corner != '.':
+                material -= scores[corner[1]] if corner[0] == 'w' else -scores[corner[1]]
+                position -= PIECE_SQUARE_VALUES[corner][row * 8 + corner_x]
+            material += sign * scores['R']
+            position += PIECE_SQUARE_VALUES[piece[0] + 'R'][row * 8 + rook_x]
+            
+        self.material_balance += material
+        self.position_balance += position
+    
+    # moves are packed into small ints: start + (target << 6) + (promotion << 12)
+    # where positions are numbered y * 8 + x and promotion indexes PROMOTION_PIECES
+    @staticmethod
+    def encode_move(start, target, promotion=None):
+        return (start[0] * 8 + start[1]) | ((target[0] * 8 + target[1]) << 6) | (PROMOTION_PIECES.index(promotion) << 12)
+    
+    # returns (start, target, promotion) of a packed move
+    @staticmethod
+    def decode_move(move):
+        start = move & 63
+        target = (move >> 6) & 63
+        return [start >> 3, start & 7], [target >> 3, target & 7], PROMOTION_PIECES[move >> 12]
+    
+    # converts a packed move to an action tuple: (piece to move, target position, pawn promotion replacement)
+    @staticmethod
+    def move_to_action(move):
+        start, target, promotion = ChessBoard.decode_move(move)
+        return (POSITION_NAMES[start[0]][start[1]], POSITION_NAMES[target[0]][target[1]], promotion)
         
     # replaces the pawn with another piece and returns status
     # status can be: VALID_MOVE or INVALID_PROMOTION
@@ -208,49 +699,163 @@ class ChessBoard():
         row = 0 if self.turn == 'b' else 7
         
         for i in range(8):
-            if self.board[row][i] == (self.turn + 'P'):
-                self.board[row][i] = (self.turn + replacement)
+            if self.piece_at(row, i) == (self.turn + 'P'):
+                self._put_piece(row, i, self.turn + replacement)
+                self.zobrist_key ^= ZOBRIST_PIECES[self.turn + 'P'][row * 8 + i]
+                self.zobrist_key ^= ZOBRIST_PIECES[self.turn + replacement][row * 8 + i]
+                
+                sign = 1 if self.turn == 'w' else -1
+                self.material_balance += sign * (HeuristicScores.SCORES[replacement] - HeuristicScores.SCORES['P'])
+                self.position_balance += (PIECE_SQUARE_VALUES[self.turn + replacement][row * 8 + i]
+                                          - PIECE_SQUARE_VALUES[self.turn + 'P'][row * 8 + i])
                 break
         
+        # remember the replacement in the played move:
+        if self.__history:
+            entry = self.__history[-1]
+            self.__history[-1] = (entry[0] | (PROMOTION_PIECES.index(replacement) << 12),) + entry[1:]
+        
         # successful move, now it's opponent's turn
         self.status = GameStatus.VALID_MOVE
         self.turn = ChessBoard.__opposite_turn(self.turn)
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        self.__moves_cache = None
+        if self.__history:
+            self.__notify_observers()
         return self.status
        
     # checks if the king is in check
     # returns True if the king is in check
     # returns False if the king is not threatened
     def __check_check(self):
-        # find player's king:
-        king = None
-        for y, row in enumerate(self.board):
-            for x, piece in enumerate(row):
-                if piece == self.turn + 'K':
-                    king = [y, x]
-                    break
-            if king is not None:
-                break
+        king = self.king_position[self.turn]
+        return self._square_attacked(king, ChessBoard.__opposite_turn(self.turn))
+    
+    # returns True if the king of the player to move is in check
+    def in_check(self):
+        return self.__check_check()
+    
+    # checks if any piece of color(attacker) can attack position(target)
+    # by scanning outward from the target instead of trying every piece on the board
+    def _square_attacked(self, target, attacker):
+        y, x = target
+        board = self.board
+        
+        for ty, tx in KNIGHT_TARGETS[y][x]:
+            if board[ty][tx] == attacker + 'N':
+                return True
+        for ty, tx in KING_TARGETS[y][x]:
+            if board[ty][tx] == attacker + 'K':
+                return True
+            
+        # pawns attack diagonally forward, so look one row backward (from the attacker's view):
+        pawn_y = y - 1 if attacker == 'w' else y + 1
+        if 0 <= pawn_y < 8:
+            for pawn_x in (x - 1, x + 1):
+                if 0 <= pawn_x < 8 and board[pawn_y][pawn_x] == attacker + 'P':
+                    return True
                 
-        # temporarily change the turn:
-        self.turn = ChessBoard.__opposite_turn(self.turn)
+        for rays, sliders in ((ROOK_RAYS, 'RQ'), (BISHOP_RAYS, 'BQ')):
+            for ray in rays[y][x]:
+                for ty, tx in ray:
+                    piece = board[ty][tx]
+                    if piece != '.':
+                        if piece[0] == attacker and piece[1] in sliders:
+                            return True
+                        break
+                    
+        return False
+    
+    # computes the safety information of the king of the player to move, once per position
+    # by scanning outward from the king
+    # returns (king, checkers, evasions, pinned):
+    # king is the king's position, checkers are the positions of the pieces giving check,
+    # evasions are the positions (y * 8 + x) a piece other than the king can move to
+    # to resolve a single check (capturing the checker or blocking it)
+    # pinned maps the position (y * 8 + x) of every pinned piece to the positions it can still move to
+    def _king_safety(self):
+        turn = self.turn
+        opponent = ChessBoard.__opposite_turn(turn)
+        king = self.king_position[turn]
+        y, x = king
+        board = self.board
         
-        # check if anyone can attack player's king
-        attack_found = False
-        for y, row in enumerate(self.board):
-            for x, piece in enumerate(row):
-                if self.__check_move_legal([y, x], king):
-                    attack_found = True # king is in check
+        checkers = []
+        evasions = set()
+        pinned = {}
+        
+        for rays, sliders in ((ROOK_RAYS, 'RQ'), (BISHOP_RAYS, 'BQ')):
+            for ray in rays[y][x]:
+                blocker = None # the first own piece on the ray
+                for i, (ty, tx) in enumerate(ray):
+                    piece = board[ty][tx]
+                    if piece == '.':
+                        continue
+                    if piece[0] == turn:
+                        if blocker is not None: # two own pieces, nothing is pinned
+                            break
+                        blocker = ty * 8 + tx
+                        continue
+                    if piece[1] in sliders:
+                        line = {ry * 8 + rx for ry, rx in ray[:i + 1]}
+                        if blocker is None:
+                            checkers.append((ty, tx))
+                            evasions |= line
+                        else:
+                            pinned[blocker] = line
                     break
-            if attack_found:
-                break
+                
+        for ty, tx in KNIGHT_TARGETS[y][x]:
+            if board[ty][tx] == opponent + 'N':
+                checkers.append((ty, tx))
+                evasions.add(ty * 8 + tx)
+                
+        pawn_y = y + 1 if turn == 'w' else y - 1
+        if 0 <= pawn_y < 8:
+            for pawn_x in (x - 1, x + 1):
+                if 0 <= pawn_x < 8 and board[pawn_y][pawn_x] == opponent + 'P':
+                    checkers.append((pawn_y, pawn_x))
+                    evasions.add(pawn_y * 8 + pawn_x)
+                    
+        return king, checkers, evasions, pinned
+    
+    # checks if moving from start to target (following the piece's movement rules)
+    # leaves the player's king safe, given the position's king safety information
+    def _move_safe(self, safety, start, target):
+        king, checkers, evasions, pinned = safety
+        sy, sx = start
+        ty, tx = target
+        
+        if (sy, sx) == king:
+            if abs(tx - sx) == 2:
+                # castling also moves a Rook, verify it by temporarily applying the move:
+                undo = self._make(start, target)
+                checks = self.__check_check()
+                self._unmake(undo)
+                return not checks
             
-        # restore turn change:
-        self.turn = ChessBoard.__opposite_turn(self.turn)
+            # the king can't step on an attacked position
+            # (the king is lifted so it doesn't hide the position behind it from sliding pieces)
+            piece = self.board[sy][sx]
+            self.board[sy][sx] = '.'
+            attacked = self._square_attacked(target, ChessBoard.__opposite_turn(self.turn))
+            self.board[sy][sx] = piece
+            return not attacked
+        
+        # only the king can move out of a double check
+        if len(checkers) > 1:
+            return False
         
-        return attack_found
+        target_index = ty * 8 + tx
+        pin = pinned.get(sy * 8 + sx)
+        if pin is not None and target_index not in pin:
+            return False
+        if checkers and target_index not in evasions:
+            return False
+        return True
         
     # checks if moving a piece from start to target is legal, given self.turn
-    def __check_move_legal(self, start, target):
+    def _check_move_legal(self, start, target):
         if self.board[start[0]][start[1]] == '.': # no piece to move
             return False
         if self.board[start[0]][start[1]][0] != self.turn: # moving the wrong color
@@ -345,19 +950,84 @@ class ChessBoard():
             elif target[1] < start[1] and not self.left_rook_ever_moved[self.turn]:
                 if self.board[row][1] == '.' and self.board[row][2] == '.' and self.board[row][3] == '.':
                     return True
-            
+
         return False
+
+    # returns the target positions the piece at position(start) can move to, given self.turn
+    # follows the same movement rules as __check_move_legal, but only visits reachable targets
+    # the king's safety is not verified here
+    def __pseudo_legal_targets(self, start):
+        y, x = start
+        piece = self.board[y][x]
+        targets = []
+
+        if piece[1] == 'P':
+            base = 6 if self.turn == 'b' else 1
+            direction = -1 if self.turn == 'b' else 1
+            ahead = y + direction
+            if 0 <= ahead < 8:
+                if self.board[ahead][x] == '.':
+                    targets.append((ahead, x))
+                    if y == base and self.board[y + 2 * direction][x] == '.':
+                        targets.append((y + 2 * direction, x))
+                for tx in (x - 1, x + 1):
+                    if 0 <= tx < 8 and self.board[ahead][tx] != '.' and self.board[ahead][tx][0] != self.turn:
+                        targets.append((ahead, tx))
+
+        elif piece[1] == 'N' or piece[1] == 'K':
+            table = KNIGHT_TARGETS if piece[1] == 'N' else KING_TARGETS
+            for ty, tx in table[y][x]:
+                if self.board[ty][tx][0] != self.turn:
+                    targets.append((ty, tx))
+
+            # castling:
+            if piece[1] == 'K' and not self.king_ever_moved[self.turn]:
+                row = 7 if self.turn == 'b' else 0
+                if x + 2 < 8 and self.board[y][x + 2][0] != self.turn and not self.right_rook_ever_moved[self.turn]:
+                    if self.board[row][5] == '.' and self.board[row][6] == '.':
+                        targets.append((y, x + 2))
+                if x - 2 >= 0 and self.board[y][x - 2][0] != self.turn and not self.left_rook_ever_moved[self.turn]:
+                    if self.board[row][1] == '.' and self.board[row][2] == '.' and self.board[row][3] == '.':
+                        targets.append((y, x - 2))
+
+        else: # sliding pieces (R, B, Q):
+            for ray in SLIDING_RAYS[piece[1]][y][x]:
+                for ty, tx in ray:
+                    target_piece = self.board[ty][tx]
+                    if target_piece == '.':
+                        targets.append((ty, tx))
+                        continue
+                    if target_piece[0] != self.turn:
+                        targets.append((ty, tx))
+                    break
+
+        # keep the same (row by row) order as a scan over the whole board
+        targets.sort()
+        return targets
+
+    # returns [Zobrist key, legal moves, whether the player to move is in check, None] of the position
+    # generated by the first caller needing them (get_game_status after a move, the search's root, legal_moves)
+    # and kept until the position changes, so the others reuse them
+    # (the last item is filled by play with the set of the moves without promotions, to verify moves)
+    # the cache is checked against the Zobrist key, so it stays right with moves pushed and popped, and
+    # cleared by play and apply_promotion
+    def __position_moves(self):
+        cache = self.__moves_cache
+        if cache is None or cache[0] != self.zobrist_key:
+            safety = self._king_safety()
+            cache = [self.zobrist_key, self._legal_moves(safety), len(safety[1]) > 0, None]
+            self.__moves_cache = cache
+        return cache
     
     # returns CHECK, CHECKMATE, STALEMATE or None
     def get_game_status(self):
-        checks = self.__check_check()
-        action_outcomes = self.forcast_actions()
+        key, moves, checks, playable = self.__position_moves()
         
         # the player is in check and has no valid moves
-        if len(action_outcomes) == 0 and checks:
+        if len(moves) == 0 and checks:
             return GameStatus.CHECKMATE
         # the player is not check but has no valid moves
-        if len(action_outcomes) == 0 and not checks:
+        if len(moves) == 0 and not checks:
             return GameStatus.STALEMATE
         # the player is in check but has valid moves
         if checks:
@@ -365,64 +1035,131 @@ class ChessBoard():
         # the player is not in check and has valid moves
         return None
     
-    # returns possible (action, outcome) pairs for the next move
-    # by moving a specific piece at position(start)
-    # action is tuple: (piece to move, target position, pawn promotion replacement)
-    def __forcast_by_piece(self, start):
-        start = chr(start[1] + ord('A')) + str(start[0] + 1)
-        action_outcomes = []
+    # returns the legal moves for the next move as packed ints (see encode_move)
+    # pawn promotions are generated for Queen and Knight only
+    # as there is no point in promotion with Bishop or Rook rather than Queen
+    def legal_moves(self):
+        return list(self.__position_moves()[1])
+    
+    # returns the legal moves given the position's king safety information (see __king_safety)
+    def _legal_moves(self, safety):
+        # only the king can move out of a double check
+        king_only = len(safety[1]) > 1
         
-        # create a new board for for forcast testing so the original game board is untouched
-        test_board = ChessBoard(self)
+        moves = []
+        for y, row in enumerate(self.board):
+            for x, piece in enumerate(row):
+                # if there is a piece and the piece is ours:
+                if piece == '.' or piece[0] != self.turn:
+                    continue
+                if king_only and piece[1] != 'K':
+                    continue
+                for target in self.__pseudo_legal_targets((y, x)):
+                    # verify player's king is not threatened:
+                    if not self._move_safe(safety, (y, x), target):
+                        continue
+                    
+                    move = (y * 8 + x) | ((target[0] * 8 + target[1]) << 6)
+                    if piece[1] == 'P' and (target[0] == 0 or target[0] == 7):
+                        moves.append(move | (PROMOTION_PIECES.index('N') << 12))
+                        moves.append(move | (PROMOTION_PIECES.index('Q') << 12))
+                    else:
+                        moves.append(move)
         
-        # for every target position, check if player can play (start, target) move:
+        return moves
+    
+    # returns the moves following the pieces' movement rules (king safety not verified)
+    # as two lists of packed moves: (captures and promotions, quiet moves)
+    def _pseudo_legal_moves(self):
+        captures = []
+        quiets = []
+        promotion_row = 0 if self.turn == 'b' else 7
         for y, row in enumerate(self.board):
             for x, piece in enumerate(row):
-                target = chr(x + ord('A')) + str(y + 1)
-                
-                # play the action
-                play_result = test_board.play(start, target)
+                if piece == '.' or piece[0] != self.turn:
+                    continue
+                for ty, tx in self.__pseudo_legal_targets((y, x)):
+                    move = (y * 8 + x) | ((ty * 8 + tx) << 6)
+                    if piece[1] == 'P' and ty == promotion_row:
+                        captures.append(move | (PROMOTION_PIECES.index('N') << 12))
+                        captures.append(move | (PROMOTION_PIECES.index('Q') << 12))
+                    elif self.board[ty][tx] != '.':
+                        captures.append(move)
+                    else:
+                        quiets.append(move)
+        return captures, quiets
+    
+    # checks if a packed move (e.g. remembered from another visit of the position) follows
+    # the pieces' movement rules here, with a promotion replacement exactly when a pawn promotes
+    def __move_playable(self, move):
+        if (move >> 12) >= len(PROMOTION_PIECES):
+            return False
+        start, target, promotion = ChessBoard.decode_move(move)
+        if not self._check_move_legal(start, target):
+            return False
+        if self.piece_at(start[0], start[1])[1] == 'P' and (target[0] == 0 or target[0] == 7):
+            return promotion == 'N' or promotion == 'Q'
+        return promotion is None
+    
+    # yields the legal moves lazily, in stages:
+    # hash_move (if it is legal here), then captures and promotions, then the killers (quiet moves
+    # remembered from other positions, if they are legal here), then the rest of the quiet moves
+    # captures and quiet moves are generated and ordered (by sort_captures/sort_quiets(chess_board, moves),
+    # if given) only when the first of them is reached,
+    # and each move's legality is checked only right before it is yielded
+    # the caller may play the yielded move on this board, as long as it is taken back before the next one
+    def staged_moves(self, hash_move=None, killers=(), sort_captures=None, sort_quiets=None):
+        safety = self._king_safety()
+        
+        if hash_move is not None and self.__move_playable(hash_move):
+            start, target, promotion = ChessBoard.decode_move(hash_move)
+            if self._move_safe(safety, start, target):
+                yield hash_move
+        
+        captures, quiets = self._pseudo_legal_moves()
+        if sort_captures is not None:
+            captures = sort_captures(self, captures)
+        for move in captures:
+            if move == hash_move:
+                continue
+            start, target, promotion = ChessBoard.decode_move(move)
+            if self._move_safe(safety, start, target):
+                yield move
                 
-                # if valid action
-                if play_result == GameStatus.VALID_MOVE:
-                    # valid move, store the (action, outcome) pair:
-                    action_outcomes.append(((start, target, None), test_board))
-                    
-                    # now create another test board for other possible moves:
-                    test_board = ChessBoard(self)
+        tried = [hash_move]
+        for move in killers:
+            if move is None or move in tried or not self.__move_playable(move):
+                continue
+            start, target, promotion = ChessBoard.decode_move(move)
+            if promotion is None and self.piece_at(target[0], target[1]) == '.' and self._move_safe(safety, start, target):
+                tried.append(move)
+                yield move
                 
-                # if valid but needs pawn promotion
-                elif play_result == GameStatus.AWAITING_PROMOTION:
-                    # we assign Queen or Knight for promotion
-                    # as there is no point in promotion with Bishop or Rook rather than Queen
-                    
-                    # fork board for alternative promotion
-                    promotion_fork = ChessBoard(test_board)
+        if sort_quiets is not None:
+            quiets = sort_quiets(self, quiets)
+        for move in quiets:
+            if move in tried:
+                continue
+            start, target, promotion = ChessBoard.decode_move(move)
+            if self._move_safe(safety, start, target):
+                yield move
                     
-                    # promote to Knight
-                    promotion_fork.apply_promotion('N')
-                    action_outcomes.append(((start, target, 'N'), promotion_fork))
-                    
-                    # promote to Queen
-                    test_board.apply_promotion('Q')
-                    action_outcomes.append(((start, target, 'Q'), test_board))
-                    
-                    test_board = ChessBoard(self)
-
-        return action_outcomes
+    # returns the utility for player when the player to move has no legal moves (checkmate or stalemate)
+    def no_moves_utility(self, player):
+        return self.__terminal_utility(player, self.in_check(), 0)[1]
     
     # returns possible (action, outcome) pairs for the next move
     # given the current state of the game (self)
+    # action is tuple: (piece to move, target position, pawn promotion replacement)
     def forcast_actions(self):
+        return self.__forcast_actions(self.__position_moves()[1])
+    
+    def __forcast_actions(self, moves):
         action_outcomes = []
-        # for every position
-        for y, row in enumerate(self.board):
-            for x, piece in enumerate(row):
-                # if there is a piece and the piece is ours:
-                if self.board[y][x] != '.' and self.board[y][x][0] == self.turn:
-                    # get possible (action, outcome)s by
-                    # moving a special piece at position(y,x):
-                    action_outcomes += self.__forcast_by_piece([y,x])
+        for move in moves:
+            outcome = type(self)(self)
+            outcome.push(move)
+            action_outcomes.append((ChessBoard.move_to_action(move), outcome))
             
         return action_outcomes
     
@@ -433,18 +1170,32 @@ class ChessBoard():
     # utility is the chess board's heuristic score for player('w' or 'b')
     # merged into a single function to avoid forcasting multiple times
     def forcast_terminal_utility(self, player):
-        # check if player is in check
-        checks = self.__check_check()
+        # legal moves and whether player is in check
+        key, moves, checks, playable = self.__position_moves()
         
         # get all possible outcomes for the next move:
-        action_outcomes = self.forcast_actions()
+        action_outcomes = self.__forcast_actions(moves)
+        
+        terminal_state, utility = self.__terminal_utility(player, checks, len(action_outcomes))
+        return action_outcomes, terminal_state, utility
+    
+    # same as forcast_terminal_utility, but returns the legal moves as packed ints
+    # instead of copying a board for every possible outcome
+    def moves_terminal_utility(self, player):
+        key, moves, checks, playable = self.__position_moves()
         
+        terminal_state, utility = self.__terminal_utility(player, checks, len(moves))
+        return list(moves), terminal_state, utility
+    
+    # returns (terminal_state, utility) given whether the player to move is in check
+    # and the number of moves they can play
+    def __terminal_utility(self, player, checks, moves_count):
         # determine game_status and terminal state:
         terminal_state = False
-        if len(action_outcomes) == 0 and checks:
+        if moves_count == 0 and checks:
             game_status = GameStatus.CHECKMATE
             terminal_state = True
-        elif len(action_outcomes) == 0 and not checks:
+        elif moves_count == 0 and not checks:
             game_status = GameStatus.STALEMATE
             terminal_state = True
         elif checks:
@@ -455,20 +1206,20 @@ class ChessBoard():
         
         if game_status == GameStatus.CHECKMATE:
             if self.turn == player: # player got checkmated
-                return action_outcomes, terminal_state, -HeuristicScores.CHECKMATE
+                return terminal_state, -HeuristicScores.CHECKMATE
             
             # opponent got checkmated
-            return action_outcomes, terminal_state, HeuristicScores.CHECKMATE
+            return terminal_state, HeuristicScores.CHECKMATE
         
         if game_status == GameStatus.STALEMATE:
-            return action_outcomes, terminal_state, HeuristicScores.STALEMATE
+            return terminal_state, HeuristicScores.STALEMATE
         
         utility = 0
         
         if self.turn == player:
-            utility += len(action_outcomes) * HeuristicScores.OPPORTUNITIES_COEF
+            utility += moves_count * HeuristicScores.OPPORTUNITIES_COEF
         else:
-            utility -= len(action_outcomes) * HeuristicScores.OPPORTUNITIES_COEF
+            utility -= moves_count * HeuristicScores.OPPORTUNITIES_COEF
         
         if game_status == GameStatus.CHECK:
             if self.turn == player: # player got checked
@@ -476,117 +1227,2201 @@ class ChessBoard():
             else: # opponent got checked
                 utility += HeuristicScores.CHECK
                 
+        balance = self.static_balance()
+        utility += balance if player == 'w' else -balance
+        
+        return terminal_state, utility
+    
+    # material and piece-square part of the utility, from white's view
+    # (BatchEvaluator computes it for many positions at once)
+    def static_balance(self):
+        balance = self.material_balance
+        if HeuristicScores.PIECE_SQUARE_COEF:
+            balance += HeuristicScores.PIECE_SQUARE_COEF * self.position_balance
+        return balance
+    
+    # heuristic utility of the position for player, cheap enough for the search's leaves
+    # same terms as forcast_terminal_utility, except the player's opportunities are counted as
+    # the moves following the pieces' movement rules (the king's safety is not verified),
+    # and legal moves are only looked for until one is found, to detect checkmate and stalemate
+    def evaluate(self, player):
+        safety = self._king_safety()
+        captures, quiets = self._pseudo_legal_moves()
+        
+        moves_count = len(captures) + len(quiets)
+        if not (self.__any_move_safe(safety, captures) or self.__any_move_safe(safety, quiets)):
+            moves_count = 0
+            
+        return self.__terminal_utility(player, len(safety[1]) > 0, moves_count)[1]
+    
+    # returns True if the player to move has at least one legal move
+    def has_legal_move(self):
+        cache = self.__moves_cache
+        if cache is not None and cache[0] == self.zobrist_key:
+            return len(cache[1]) > 0
+        safety = self._king_safety()
+        captures, quiets = self._pseudo_legal_moves()
+        return self.__any_move_safe(safety, captures) or self.__any_move_safe(safety, quiets)
+    
+    def __any_move_safe(self, safety, moves):
+        for move in moves:
+            start, target, promotion = ChessBoard.decode_move(move)
+            if self._move_safe(safety, start, target):
+                return True
+        return False
+    
+    # returns the number of pieces on the board, the kings included
+    def pieces_count(self):
+        return 64 - sum(row.count('.') for row in self.board)
+    
+    # checks if color has pieces other than pawns and the king
+    # (positions without them are where passing the turn could be better than any move)
+    def has_non_pawn_material(self, color):
+        for row in self.board:
+            for piece in row:
+                if piece[0] == color and piece[1] != 'P' and piece[1] != 'K':
+                    return True
+        return False
+    
+    # returns the sum of HeuristicScores.SCORES of each player's pieces
+    def _material_scores(self):
         scores = {'b': 0, 'w': 0}
         for y, row in enumerate(self.board):
             for x, piece in enumerate(row):
                 if piece != '.':
                     scores[piece[0]] += HeuristicScores.SCORES[piece[1]]
-                    
-        utility += scores[player]
-        utility -= scores[ChessBoard.__opposite_turn(player)]
-        
-        return action_outcomes, terminal_state, utility
+        return scores
         
 
-class MinMax():
-    INFINITY = 1000000000
+# precomputed bitboard tables, bit (y * 8 + x) stands for position [y][x]
+KNIGHT_MASKS = [sum(1 << (ty * 8 + tx) for ty, tx in KNIGHT_TARGETS[sq >> 3][sq & 7]) for sq in range(64)]
+KING_MASKS = [sum(1 << (ty * 8 + tx) for ty, tx in KING_TARGETS[sq >> 3][sq & 7]) for sq in range(64)]
+
+# positions attacked by a pawn of each color standing at a position
+def build_pawn_attack_masks(direction):
+    masks = []
+    for sq in range(64):
+        mask = 0
+        for ty, tx in KING_TARGETS[sq >> 3][sq & 7]:
+            if ty == (sq >> 3) + direction and tx != (sq & 7):
+                mask |= 1 << (ty * 8 + tx)
+        masks.append(mask)
+    return masks
+
+PAWN_ATTACK_MASKS = {'w': build_pawn_attack_masks(1), 'b': build_pawn_attack_masks(-1)}
+
+# for every direction: (ray masks per position, whether positions grow along the ray)
+# the nearest blocker on a growing ray is its lowest bit, otherwise its highest bit
+def build_ray_masks(directions):
+    ray_masks = []
+    for dy, dx in directions:
+        masks = []
+        for sq in range(64):
+            mask = 0
+            ty, tx = (sq >> 3) + dy, (sq & 7) + dx
+            while 0 <= ty < 8 and 0 <= tx < 8:
+                mask |= 1 << (ty * 8 + tx)
+                ty, tx = ty + dy, tx + dx
+            masks.append(mask)
+        ray_masks.append((masks, dy * 8 + dx > 0))
+    return ray_masks
+
+ROOK_RAY_MASKS = build_ray_masks(ROOK_DIRECTIONS)
+BISHOP_RAY_MASKS = build_ray_masks(BISHOP_DIRECTIONS)
+
+# positions a sliding piece at position(sq) attacks along the given rays, given the occupied positions
+def sliding_attacks(sq, occupied, ray_masks):
+    attacks = 0
+    for masks, growing in ray_masks:
+        ray = masks[sq]
+        blockers = ray & occupied
+        if blockers:
+            nearest = (blockers & -blockers).bit_length() - 1 if growing else blockers.bit_length() - 1
+            ray ^= masks[nearest]
+        attacks |= ray
+    return attacks
+
+
+# same game as ChessBoard, but the position is stored as 12 bitboards (python ints)
+# one per piece type and color, plus one occupancy mask per color
+# select it with new_chess_board('bitboard') to compare it with the list backend
+class BitboardChessBoard(ChessBoard):
+    PIECE_TYPES = 'PNBRQK'
+    OPPONENT = {'w': 'b', 'b': 'w'}
     
-    # sort for a more efficient alpha-beta pruning:
-    def sort_forcast(forcast):
-        if len(forcast) == 0:
-            return forcast
-        
-        forcast_utility_sorted = []
-        for action, outcome in forcast:
-            start = ChessBoard.chess_pos_to_index(action[0])
-            target = ChessBoard.chess_pos_to_index(action[1])
-            target_piece = outcome.board[target[0]][target[1]]
-            utility = 0
-            
-            # a little score for longer moves (to break even cases)
-            utility += max(abs(target[0] - start[0]), abs(target[1] - start[1])) / 40
-            # score for the move's oponent pick
-            utility += outcome.last_move_score
-            # prioritize higher score piece moves 
-            utility += HeuristicScores.SCORES[target_piece[1]] / 10
+    # ChessBoard.board is rebuilt from the bitboards when read, and parsed into them when assigned
+    @property
+    def board(self):
+        return [[self.piece_at(y, x) for x in range(8)] for y in range(8)]
+    
+    @board.setter
+    def board(self, board):
+        self.bitboards = {color + piece: 0 for color in 'wb' for piece in BitboardChessBoard.PIECE_TYPES}
+        self.occupancy = {'w': 0, 'b': 0}
+        for y, row in enumerate(board):
+            for x, piece in enumerate(row):
+                if piece != '.':
+                    self.bitboards[piece] |= 1 << (y * 8 + x)
+                    self.occupancy[piece[0]] |= 1 << (y * 8 + x)
+    
+    def _copy_position(self, orig):
+        if isinstance(orig, BitboardChessBoard):
+            self.bitboards = orig.bitboards.copy()
+            self.occupancy = orig.occupancy.copy()
+        else:
+            self.board = orig.board
             
-            forcast_utility_sorted.append((utility, (action, outcome)))
+    def piece_at(self, y, x):
+        bit = 1 << (y * 8 + x)
+        if self.occupancy['w'] & bit:
+            color = 'w'
+        elif self.occupancy['b'] & bit:
+            color = 'b'
+        else:
+            return '.'
+        for piece in BitboardChessBoard.PIECE_TYPES:
+            if self.bitboards[color + piece] & bit:
+                return color + piece
             
-        forcast_utility_sorted.sort(key=lambda tup: tup[0], reverse=True)
+    def piece_codes(self):
+        codes = [0] * 64
+        for piece, bitboard in self.bitboards.items():
+            code = PIECE_CODE[piece]
+            while bitboard:
+                low_bit = bitboard & -bitboard
+                codes[low_bit.bit_length() - 1] = code
+                bitboard ^= low_bit
+        return codes
         
-        forcast_sorted = []
-        for utility, element in forcast_utility_sorted:
-            forcast_sorted.append(element)
-            
-        return forcast_sorted
+    def _put_piece(self, y, x, piece):
+        bit = 1 << (y * 8 + x)
+        old_piece = self.piece_at(y, x)
+        if old_piece != '.':
+            self.bitboards[old_piece] ^= bit
+            self.occupancy[old_piece[0]] ^= bit
+        if piece != '.':
+            self.bitboards[piece] |= bit
+            self.occupancy[piece[0]] |= bit
     
-    @staticmethod # max_player is requred for proper heuristic utility calculation
-    def alpha_beta_decision(chess_board, max_depth, max_player):
-        forcast = chess_board.forcast_actions()
+    def _make(self, start, target, promotion=None):
+        sy, sx = start
+        ty, tx = target
+        turn = self.turn
+        start_bit = 1 << (sy * 8 + sx)
+        target_bit = 1 << (ty * 8 + tx)
+        piece = self.piece_at(sy, sx)
+        captured = self.piece_at(ty, tx)
+        placed = piece if promotion is None else turn + promotion
+        undo_flags = (self.king_ever_moved[turn], self.left_rook_ever_moved[turn],
+                      self.right_rook_ever_moved[turn], self.last_move_score, self.status)
         
-        forcast = MinMax.sort_forcast(forcast)
+        bitboards = self.bitboards
+        if captured != '.':
+            bitboards[captured] ^= target_bit
+            self.occupancy[captured[0]] ^= target_bit
+        self.last_move_score = HeuristicScores.SCORES[captured[1]] if captured != '.' else 0
+        bitboards[piece] ^= start_bit
+        bitboards[placed] |= target_bit
+        self.occupancy[turn] ^= start_bit | target_bit
         
-        value = -MinMax.INFINITY
-        best_action = None
-        for action, outcome in forcast:
-            tmp = MinMax.min_value(outcome, max_depth - 1, -MinMax.INFINITY, MinMax.INFINITY, max_player)
-            if tmp > value:
-                value = tmp
-                best_action = action
+        row = 7 if turn == 'b' else 0
+        corner = None
+        if piece[1] == 'K':
+            self.king_ever_moved[turn] = True
+            self.king_position[turn] = (ty, tx)
+            
+            # castling, whatever is on the corner is replaced by the Rook next to the king:
+            if abs(tx - sx) == 2:
+                corner_x, rook_x = (7, 5) if tx > sx else (0, 3)
+                corner = self.piece_at(row, corner_x)
+                self._put_piece(row, corner_x, '.')
+                self._put_piece(row, rook_x, turn + 'R')
+        elif piece[1] == 'R' and sy == row:
+            if sx == 0:
+                self.left_rook_ever_moved[turn] = True
+            elif sx == 7:
+                self.right_rook_ever_moved[turn] = True
                 
-        return best_action
+        return (sy, sx, ty, tx, piece, captured, placed, corner) + undo_flags
     
-    @staticmethod
-    def max_value(chess_board, max_depth, alpha, beta, max_player):
-        # get forcast, terminal and utility of chess_board
-        forcast, terminal, utility = chess_board.forcast_terminal_utility(max_player)
+    def _unmake(self, undo):
+        sy, sx, ty, tx, piece, captured, placed, corner, king_moved, left_moved, right_moved, last_move_score, status = undo
+        turn = piece[0]
+        start_bit = 1 << (sy * 8 + sx)
+        target_bit = 1 << (ty * 8 + tx)
         
-        forcast = MinMax.sort_forcast(forcast)
+        bitboards = self.bitboards
+        # the placed piece may have been replaced by apply_promotion since, remove whatever is there:
+        bitboards[self.piece_at(ty, tx)] ^= target_bit
+        bitboards[piece] |= start_bit
+        self.occupancy[turn] ^= start_bit | target_bit
+        if captured != '.':
+            bitboards[captured] |= target_bit
+            self.occupancy[captured[0]] |= target_bit
+        if piece[1] == 'K':
+            self.king_position[turn] = (sy, sx)
+        if corner is not None: # put the castled Rook back:
+            row = 7 if turn == 'b' else 0
+            corner_x, rook_x = (7, 5) if tx > sx else (0, 3)
+            self._put_piece(row, rook_x, '.')
+            self._put_piece(row, corner_x, corner)
         
-        # check terminal 
-        if max_depth == 0 or terminal:
-            return utility
+        self.king_ever_moved[turn] = king_moved
+        self.left_rook_ever_moved[turn] = left_moved
+        self.right_rook_ever_moved[turn] = right_moved
+        self.last_move_score = last_move_score
+        self.status = status
+        self.turn = turn
         
-        value = -MinMax.INFINITY
+    # checks if any piece of color(attacker) attacks position(sq), given the occupied positions
+    def __attacked(self, sq, attacker, occupied):
+        bitboards = self.bitboards
+        if KNIGHT_MASKS[sq] & bitboards[attacker + 'N']:
+            return True
+        if KING_MASKS[sq] & bitboards[attacker + 'K']:
+            return True
+        # an attacker's pawn attacks sq if a defender's pawn on sq would attack it:
+        if PAWN_ATTACK_MASKS[BitboardChessBoard.OPPONENT[attacker]][sq] & bitboards[attacker + 'P']:
+            return True
+        rooks = bitboards[attacker + 'R'] | bitboards[attacker + 'Q']
+        if rooks and sliding_attacks(sq, occupied, ROOK_RAY_MASKS) & rooks:
+            return True
+        bishops = bitboards[attacker + 'B'] | bitboards[attacker + 'Q']
+        if bishops and sliding_attacks(sq, occupied, BISHOP_RAY_MASKS) & bishops:
+            return True
+        return False
+    
+    def _square_attacked(self, target, attacker):
+        return self.__attacked(target[0] * 8 + target[1], attacker, self.occupancy['w'] | self.occupancy['b'])
+    
+    # same information as ChessBoard._king_safety, with evasions and pin lines as bitboards
+    # and the king as a bit index
+    def _king_safety(self):
+        turn = self.turn
+        opponent = BitboardChessBoard.OPPONENT[turn]
+        bitboards = self.bitboards
+        own = self.occupancy[turn]
+        occupied = own | self.occupancy[opponent]
+        king = bitboards[turn + 'K'].bit_length() - 1
         
-        for action, outcome in forcast:
-            value = max(value, MinMax.min_value(outcome, max_depth - 1, alpha, beta, max_player))
-            alpha = max(alpha, value)
-            if value >= beta:
-                break
+        checkers = []
+        evasions = 0
+        pinned = {}
         
-        return value
+        for ray_masks, sliders in ((ROOK_RAY_MASKS, bitboards[opponent + 'R'] | bitboards[opponent + 'Q']),
+                                   (BISHOP_RAY_MASKS, bitboards[opponent + 'B'] | bitboards[opponent + 'Q'])):
+            for masks, growing in ray_masks:
+                ray = masks[king]
+                blockers = ray & occupied
+                if not blockers:
+                    continue
+                nearest = (blockers & -blockers).bit_length() - 1 if growing else blockers.bit_length() - 1
+                if not (own >> nearest) & 1:
+                    if (sliders >> nearest) & 1:
+                        checkers.append(nearest)
+                        evasions |= ray ^ masks[nearest]
+                    continue
+                # an own piece, check if an attacker is right behind it:
+                blockers &= masks[nearest]
+                if not blockers:
+                    continue
+                behind = (blockers & -blockers).bit_length() - 1 if growing else blockers.bit_length() - 1
+                if (sliders >> behind) & 1:
+                    pinned[nearest] = ray ^ masks[behind]
+                    
+        knights = KNIGHT_MASKS[king] & bitboards[opponent + 'N']
+        pawns = PAWN_ATTACK_MASKS[turn][king] & bitboards[opponent + 'P']
+        for attackers in (knights, pawns):
+            while attackers:
+                bit = attackers & -attackers
+                attackers ^= bit
+                checkers.append(bit.bit_length() - 1)
+                evasions |= bit
+                
+        return king, checkers, evasions, pinned
     
-    @staticmethod
-    def min_value(chess_board, max_depth, alpha, beta, max_player):
-        # get forcast, terminal and utility of chess_board
-        forcast, terminal, utility = chess_board.forcast_terminal_utility(max_player)
+    # returns the positions (as a bitboard) the piece at position(sq) can move to,
+    # following the same movement rules as ChessBoard._check_move_legal
+    # the king's safety is not verified here
+    def __pseudo_legal_targets(self, sq, piece):
+        turn = self.turn
+        own = self.occupancy[turn]
+        occupied = own | self.occupancy[BitboardChessBoard.OPPONENT[turn]]
+        kind = piece[1]
         
-        forcast = MinMax.sort_forcast(forcast)
+        if kind == 'P':
+            y = sq >> 3
+            direction = -8 if turn == 'b' else 8
+            base = 6 if turn == 'b' else 1
+            targets = PAWN_ATTACK_MASKS[turn][sq] & occupied & ~own
+            ahead = sq + direction
+            if 0 <= ahead < 64 and not (occupied >> ahead) & 1:
+                targets |= 1 << ahead
+                if y == base and not (occupied >> (ahead + direction)) & 1:
+                    targets |= 1 << (ahead + direction)
+            return targets
+        if kind == 'N':
+            return KNIGHT_MASKS[sq] & ~own
+        if kind == 'K':
+            targets = KING_MASKS[sq] & ~own
+            
+            # castling:
+            if not self.king_ever_moved[turn]:
+                x = sq & 7
+                row = (7 if turn == 'b' else 0) * 8
+                if x + 2 < 8 and not (own >> (sq + 2)) & 1 and not self.right_rook_ever_moved[turn]:
+                    if not occupied & ((1 << (row + 5)) | (1 << (row + 6))):
+                        targets |= 1 << (sq + 2)
+                if x - 2 >= 0 and not (own >> (sq - 2)) & 1 and not self.left_rook_ever_moved[turn]:
+                    if not occupied & ((1 << (row + 1)) | (1 << (row + 2)) | (1 << (row + 3))):
+                        targets |= 1 << (sq - 2)
+            return targets
         
-        # check terminal 
-        if max_depth == 0 or terminal:
-            return utility
+        targets = 0
+        if kind == 'R' or kind == 'Q':
+            targets |= sliding_attacks(sq, occupied, ROOK_RAY_MASKS)
+        if kind == 'B' or kind == 'Q':
+            targets |= sliding_attacks(sq, occupied, BISHOP_RAY_MASKS)
+        return targets & ~own
+    
+    # returns the positions (as a bitboard) the piece at position(sq) can legally move to
+    def __legal_targets(self, sq, piece, safety):
+        king, checkers, evasions, pinned = safety
+        targets = self.__pseudo_legal_targets(sq, piece)
         
-        value = MinMax.INFINITY
+        if sq != king:
+            # only the king can move out of a double check
+            if len(checkers) > 1:
+                return 0
+            if sq in pinned:
+                targets &= pinned[sq]
+            if checkers:
+                targets &= evasions
+            return targets
         
-        for action, outcome in forcast:
-            value = min(value, MinMax.max_value(outcome, max_depth - 1, alpha, beta, max_player))
-            beta = min(beta, value)
-            if value <= alpha:
-                break
+        opponent = BitboardChessBoard.OPPONENT[self.turn]
+        # the king is lifted so it doesn't hide the positions behind it from sliding pieces
+        occupied = (self.occupancy['w'] | self.occupancy['b']) ^ (1 << sq)
+        legal = 0
+        remaining = targets
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            target = bit.bit_length() - 1
+            if abs((target & 7) - (sq & 7)) == 2:
+                # castling also moves a Rook, verify it by temporarily applying the move:
+                undo = self._make((sq >> 3, sq & 7), (target >> 3, target & 7))
+                checks = self.in_check()
+                self._unmake(undo)
+                if not checks:
+                    legal |= bit
+            elif not self.__attacked(target, opponent, occupied):
+                legal |= bit
+        return legal
+    
+    def _check_move_legal(self, start, target):
+        piece = self.piece_at(start[0], start[1])
+        if piece == '.' or piece[0] != self.turn:
+            return False
+        return bool((self.__pseudo_legal_targets(start[0] * 8 + start[1], piece) >> (target[0] * 8 + target[1])) & 1)
+    
+    def _move_safe(self, safety, start, target):
+        sq = start[0] * 8 + start[1]
+        return bool((self.__legal_targets(sq, self.piece_at(start[0], start[1]), safety) >> (target[0] * 8 + target[1])) & 1)
+    
+    def _legal_moves(self, safety):
+        turn = self.turn
+        bitboards = self.bitboards
+        promotion_row = 0 if turn == 'b' else 7
         
-        return value
+        moves = []
+        # own pieces, in the same (position by position) order as the list backend:
+        pieces = self.occupancy[turn]
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            for kind in BitboardChessBoard.PIECE_TYPES:
+                if bitboards[turn + kind] & bit:
+                    break
+            targets = self.__legal_targets(sq, turn + kind, safety)
+            while targets:
+                target_bit = targets & -targets
+                targets ^= target_bit
+                target = target_bit.bit_length() - 1
+                move = sq | (target << 6)
+                if kind == 'P' and (target >> 3) == promotion_row:
+                    moves.append(move | (PROMOTION_PIECES.index('N') << 12))
+                    moves.append(move | (PROMOTION_PIECES.index('Q') << 12))
+                else:
+                    moves.append(move)
+        return moves
     
-def AI_play(chess_board, max_depth, max_player):
-    start, target, promotion = MinMax.alpha_beta_decision(chess_board, max_depth, max_player)
-    status = chess_board.play(start, target)
-    if status == GameStatus.AWAITING_PROMOTION:
-        chess_board.apply_promotion(promotion)
-
-# clear terminal
-def clear_terminal():
-    os.system('cls' if os.name=='nt' else 'clear')
+    def _pseudo_legal_moves(self):
+        turn = self.turn
+        bitboards = self.bitboards
+        enemy = self.occupancy[BitboardChessBoard.OPPONENT[turn]]
+        promotion_row = 0 if turn == 'b' else 7
+        
+        captures = []
+        quiets = []
+        pieces = self.occupancy[turn]
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            for kind in BitboardChessBoard.PIECE_TYPES:
+                if bitboards[turn + kind] & bit:
+                    break
+            targets = self.__pseudo_legal_targets(sq, turn + kind)
+            while targets:
+                target_bit = targets & -targets
+                targets ^= target_bit
+                target = target_bit.bit_length() - 1
+                move = sq | (target << 6)
+                if kind == 'P' and (target >> 3) == promotion_row:
+                    captures.append(move | (PROMOTION_PIECES.index('N') << 12))
+                    captures.append(move | (PROMOTION_PIECES.index('Q') << 12))
+                elif enemy & target_bit:
+                    captures.append(move)
+                else:
+                    quiets.append(move)
+        return captures, quiets
+    
+    def pieces_count(self):
+        return (self.occupancy['w'] | self.occupancy['b']).bit_count()
+    
+    # any knight, bishop, rook or queen of color
+    def has_non_pawn_material(self, color):
+        bitboards = self.bitboards
+        return (bitboards[color + 'N'] | bitboards[color + 'B'] | bitboards[color + 'R'] | bitboards[color + 'Q']) != 0
+    
+    # popcount based material sum
+    def _material_scores(self):
+        scores = {'b': 0, 'w': 0}
+        for piece, bitboard in self.bitboards.items():
+            if bitboard:
+                scores[piece[0]] += HeuristicScores.SCORES[piece[1]] * bitboard.bit_count()
+        return scores
+    
+    
+# board backends, selected by name with new_chess_board
+BOARD_BACKENDS = {'list': ChessBoard, 'bitboard': BitboardChessBoard}
+
+# creates a new game with the given board backend, from the position of a FEN record if given
+def new_chess_board(backend='list', fen=None):
+    if backend not in BOARD_BACKENDS:
+        raise Exception('ERROR: unknown board backend')
+    if fen is not None:
+        return BOARD_BACKENDS[backend].from_fen(fen)
+    return BOARD_BACKENDS[backend]()
+
+
+# evaluates many positions at once with NumPy: the positions are rows of an N x 64 array of PIECE_CODES
+# (see ChessBoard.piece_codes), and their material and piece-square sums are looked up and added up per row
+# the balances are the same as ChessBoard.static_balance of the positions (exactly, with integer piece scores)
+# the tables are taken from HeuristicScores when created, a new evaluator is needed after changing them
+class BatchEvaluator():
+    def __init__(self):
+        if numpy is None:
+            raise Exception('ERROR: batch evaluation needs NumPy')
+        scores = [0] + [HeuristicScores.SCORES[piece[1]] * (1 if piece[0] == 'w' else -1) for piece in PIECE_CODES[1:]]
+        integral = all(isinstance(score, int) for score in scores)
+        # material[code]: the piece's score (negative for black), position[code, sq]: its piece-square bonus
+        self.material = numpy.array(scores, dtype=numpy.int64 if integral else numpy.float64)
+        self.position = numpy.zeros((len(PIECE_CODES), 64), dtype=numpy.int64)
+        for code, piece in enumerate(PIECE_CODES[1:], 1):
+            self.position[code] = PIECE_SQUARE_VALUES[piece]
+        self.squares = numpy.arange(64)
+    
+    # N x 64 array of the positions of chess_boards
+    @staticmethod
+    def encode(chess_boards):
+        return numpy.array([chess_board.piece_codes() for chess_board in chess_boards], dtype=numpy.int8).reshape(-1, 64)
+    
+    # N x 64 array of the positions after each of moves (packed) from chess_board, the sibling leaves of a search
+    @staticmethod
+    def encode_children(chess_board, moves):
+        codes = numpy.empty((len(moves), 64), dtype=numpy.int8)
+        for index, move in enumerate(moves):
+            chess_board.push(move)
+            codes[index] = chess_board.piece_codes()
+            chess_board.pop()
+        return codes
+    
+    # (material balances, piece-square balances) of the rows of codes, from white's view
+    def balances(self, codes):
+        return self.material[codes].sum(axis=1), self.position[codes, self.squares].sum(axis=1)
+    
+    # static balances (material + PIECE_SQUARE_COEF * piece-square) of the rows of codes for player
+    def static_balances(self, codes, player='w'):
+        material, position = self.balances(codes)
+        balance = material
+        if HeuristicScores.PIECE_SQUARE_COEF:
+            balance = material + HeuristicScores.PIECE_SQUARE_COEF * position
+        return balance if player == 'w' else -balance
+
+
+# fixed-size table of search results keyed by Zobrist keys
+# entries are tuples: (key, depth, bound, value, best move, search generation)
+class TranspositionTable():
+    EXACT = 0
+    LOWER_BOUND = 1 # the value is at least the stored value
+    UPPER_BOUND = 2 # the value is at most the stored value
+    
+    DEFAULT_MEGABYTES = 16
+    # approximate memory of one stored entry in CPython (tuple, key, value and slot)
+    ENTRY_BYTES = 184
+    
+    # with exact_depth, values are only reused at the depth they were searched, so the search returns the same
+    # values with or without the table (and in any order of searches), at the cost of most of its cutoffs
+    def __init__(self, megabytes=DEFAULT_MEGABYTES, exact_depth=False):
+        self.exact_depth = exact_depth
+        # the largest power of two number of entries that fits the memory cap:
+        size = 1
+        while size * 2 * TranspositionTable.ENTRY_BYTES <= megabytes * 1024 * 1024:
+            size *= 2
+        self.size = size
+        self.entries = [None] * size
+        self.generation = 0
+        
+    def clear(self):
+        self.entries = [None] * self.size
+        
+    # entries stored by older searches are replaced first
+    def new_search(self):
+        self.generation += 1
+        
+    # returns the bound type of a value searched with the (alpha, beta) window
+    @staticmethod
+    def bound(value, alpha, beta):
+        if value <= alpha:
+            return TranspositionTable.UPPER_BOUND
+        if value >= beta:
+            return TranspositionTable.LOWER_BOUND
+        return TranspositionTable.EXACT
+    
+    # replacement policy: an entry is kept over a shallower result of another position
+    # unless it was stored by an older search
+    def store(self, key, depth, bound, value, move):
+        index = key & (self.size - 1)
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, bound, value, move, self.generation)
+            
+    # returns (value, best move) stored for a position
+    # value is None unless the stored result, searched at least depth deep (exactly depth deep with exact_depth),
+    # decides the (alpha, beta) window
+    def lookup(self, key, depth, alpha, beta):
+        entry = self.entries[key & (self.size - 1)]
+        if entry is None or entry[0] != key:
+            return None, None
+        
+        stored_key, stored_depth, bound, value, move, generation = entry
+        if stored_depth == depth or (stored_depth > depth and not self.exact_depth):
+            if bound == TranspositionTable.EXACT:
+                return value, move
+            if bound == TranspositionTable.LOWER_BOUND and value >= beta:
+                return value, move
+            if bound == TranspositionTable.UPPER_BOUND and value <= alpha:
+                return value, move
+        return None, move
+    
+
+# the order in which the search tries moves, learned from the beta cutoffs of a player's searches:
+# captures go first, the most valuable victim first and then the least valuable attacker (MVV-LVA),
+# then two killer moves per ply (quiet moves that caused a cutoff at the same distance from the root),
+# then the other quiet moves, by the cutoffs caused by the same piece moving to the same position (history)
+class MoveOrdering():
+    # piece values for ordering captures (the king is the least welcome attacker):
+    PIECE_ORDER = {'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+    
+    KILLER_SLOTS = 2
+    
+    def __init__(self):
+        self.clear()
+        
+    def clear(self):
+        # killers[ply] lists up to KILLER_SLOTS moves, the latest first:
+        self.killers = []
+        # history[piece][target position index] is increased by every cutoff of a quiet move:
+        self.history = {color + piece: [0] * 64 for color in 'wb' for piece in MoveOrdering.PIECE_ORDER}
+        
+    # halves the history scores, so a new search mostly trusts what it learns itself
+    def new_search(self):
+        for scores in self.history.values():
+            for i in range(64):
+                scores[i] >>= 1
+                
+    # MVV-LVA score of a move on chess_board, 0 for quiet moves
+    # promotions are scored like capturing the piece they promote to
+    @staticmethod
+    def capture_score(chess_board, move):
+        target = (move >> 6) & 63
+        captured = chess_board.piece_at(target >> 3, target & 7)
+        score = 0
+        if captured != '.':
+            start = move & 63
+            attacker = chess_board.piece_at(start >> 3, start & 7)
+            score += MoveOrdering.PIECE_ORDER[captured[1]] * 8 - MoveOrdering.PIECE_ORDER[attacker[1]]
+        if move >> 12:
+            score += MoveOrdering.PIECE_ORDER[PROMOTION_PIECES[move >> 12]] * 8
+        return score
+    
+    @staticmethod
+    def sort_captures(chess_board, moves):
+        return sorted(moves, key=lambda move: MoveOrdering.capture_score(chess_board, move), reverse=True)
+    
+    def sort_quiets(self, chess_board, moves):
+        history = self.history
+        return sorted(moves, key=lambda move: history[chess_board.piece_at((move & 63) >> 3, move & 7)][(move >> 6) & 63],
+                      reverse=True)
+    
+    def killer_moves(self, ply):
+        return self.killers[ply] if ply < len(self.killers) else ()
+    
+    # remembers a move that caused a beta cutoff, searched max_depth deep at ply
+    # (chess_board is the position the move was played on), only quiet moves are remembered
+    def record_cutoff(self, chess_board, move, max_depth, ply):
+        target = (move >> 6) & 63
+        if move >> 12 or chess_board.piece_at(target >> 3, target & 7) != '.':
+            return
+        
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move in killers:
+            killers.remove(move)
+        killers.insert(0, move)
+        del killers[MoveOrdering.KILLER_SLOTS:]
+        
+        start = move & 63
+        self.history[chess_board.piece_at(start >> 3, start & 7)][target] += max_depth * max_depth
+        
+        
+# raised inside the search when its time or node budget runs out, or a stop is requested
+class SearchInterrupted(Exception):
+    pass
+
+
+# optional search features, all off by default
+# (without them the search returns exact minimax values, the same with or without the transposition table
+# unless it holds deeper results of earlier searches, see TranspositionTable.exact_depth)
+# pvs: principal variation search, moves after the first are searched with a null window first
+# aspiration_windows: every iteration of iterative deepening first searches a window around the previous value
+# null_move: null-move pruning, the side to move passes the turn for a shallower search first
+# late_move_reductions: quiet moves tried late are searched shallower first
+class SearchFeatures():
+    NAMES = ('pvs', 'aspiration_windows', 'null_move', 'late_move_reductions')
+    
+    # width of null windows, smaller than the difference of any two utilities:
+    SCOUT_WINDOW = 0.000001
+    # half width of aspiration windows (HeuristicScores.SCORES units, a pawn is 1):
+    ASPIRATION_WINDOW = 0.5
+    NULL_MOVE_REDUCTION = 2
+    # moves searched to full depth before reducing the late ones, and the minimal depth to reduce at:
+    LMR_FULL_DEPTH_MOVES = 3
+    LMR_MIN_DEPTH = 3
+    LMR_REDUCTION = 1
+    
+    def __init__(self, pvs=False, aspiration_windows=False, null_move=False, late_move_reductions=False):
+        self.pvs = pvs
+        self.aspiration_windows = aspiration_windows
+        self.null_move = null_move
+        self.late_move_reductions = late_move_reductions
+        
+    # features enabled by name, e.g. SearchFeatures.from_names(['pvs', 'null_move'])
+    @staticmethod
+    def from_names(names):
+        for name in names:
+            if name not in SearchFeatures.NAMES:
+                raise Exception('ERROR: unknown search feature ' + str(name))
+        return SearchFeatures(**{name: True for name in names})
+    
+    def enabled(self):
+        return [name for name in SearchFeatures.NAMES if getattr(self, name)]
+    
+
+# statistics of the searches run with SearchContext(statistics=SearchStatistics()), for finding where they spend
+# their nodes and time: per ply (distance from the root) counts of the visited nodes, leaves (evaluated at the
+# depth limit), transposition table hits, beta cutoffs and cutoffs by the first move tried, and within timing(),
+# the seconds spent in move generation, king safety, move ordering and evaluation
+# every search (alpha_beta_decision, so every iteration of iterative_deepening) is a record of report()
+# the counters cost a few operations per node, the timers a few microseconds per timed call
+class SearchStatistics():
+    # the timed methods of each category as (class, name), None for the searched board's class:
+    TIMED = {'move_generation': [(None, '_pseudo_legal_moves'), (None, '_legal_moves')],
+             'king_safety': [(None, '_king_safety'), (None, '_move_safe')],
+             'ordering': [(MoveOrdering, 'sort_captures'), (MoveOrdering, 'sort_quiets')],
+             'evaluation': [(None, 'evaluate'), (None, 'no_moves_utility')]}
+    
+    def __init__(self):
+        self.searches = []
+        self.current = None
+        # {category: [seconds, calls]} of all the searches:
+        self.timers = {category: [0.0, 0] for category in SearchStatistics.TIMED}
+        self.__timed_category = None
+        self.__timed_since = 0
+        
+    def start_search(self, chess_board, max_depth):
+        self.current = {'fen': chess_board.to_fen(), 'depth': max_depth, 'interrupted': False,
+                        'plies': [], 'start': time.perf_counter(),
+                        'timers_start': {category: timer[:] for category, timer in self.timers.items()}}
+        self.__ply(0)['nodes'] = 1 # the root
+        
+    def __ply(self, ply):
+        plies = self.current['plies']
+        while len(plies) <= ply:
+            plies.append({'nodes': 0, 'leaves': 0, 'hash_hits': 0, 'cutoffs': 0, 'first_move_cutoffs': 0})
+        return plies[ply]
+    
+    def node(self, ply):
+        self.__ply(ply)['nodes'] += 1
+        
+    def leaf(self, ply):
+        self.current['plies'][ply]['leaves'] += 1
+        
+    def hash_hit(self, ply):
+        self.current['plies'][ply]['hash_hits'] += 1
+        
+    # a beta cutoff by the index-th move tried at a node
+    def cutoff(self, ply, index):
+        counters = self.current['plies'][ply]
+        counters['cutoffs'] += 1
+        if index == 0:
+            counters['first_move_cutoffs'] += 1
+            
+    # completes the record of the current search (interrupted if its budget ran out)
+    def finish_search(self, interrupted=False):
+        record = self.current
+        if record is None:
+            return
+        self.current = None
+        record['seconds'] = time.perf_counter() - record.pop('start')
+        record['interrupted'] = interrupted
+        plies = record['plies']
+        record['nodes'] = sum(counters['nodes'] for counters in plies)
+        record['cutoffs'] = sum(counters['cutoffs'] for counters in plies)
+        first_move_cutoffs = sum(counters['first_move_cutoffs'] for counters in plies)
+        record['first_move_cutoff_rate'] = first_move_cutoffs / record['cutoffs'] if record['cutoffs'] else None
+        for ply, counters in enumerate(plies):
+            counters['ply'] = ply
+            # nodes of the next ply per node of this one:
+            counters['branching_factor'] = plies[ply + 1]['nodes'] / counters['nodes'] if ply + 1 < len(plies) else 0
+            counters['first_move_cutoff_rate'] = counters['first_move_cutoffs'] / counters['cutoffs'] if counters['cutoffs'] else None
+        # the branching factor of a uniform tree of the same depth and nodes:
+        record['effective_branching_factor'] = record['nodes'] ** (1 / record['depth']) if record['depth'] > 0 else 0
+        
+        timers_start = record.pop('timers_start')
+        record['timers'] = {category: {'seconds': timer[0] - timers_start[category][0],
+                                       'calls': timer[1] - timers_start[category][1]}
+                            for category, timer in self.timers.items()}
+        self.searches.append(record)
+        
+    # {'searches': records, 'timers': totals, 'nodes', 'seconds', 'cutoffs', 'first_move_cutoff_rate'}
+    # searches one ply deeper than the previous record of the same position get the ratio of their nodes
+    # (the growth of iterative deepening's iterations) as 'iteration_branching_factor'
+    def report(self):
+        previous = None
+        for record in self.searches:
+            if previous is not None and previous['fen'] == record['fen'] and previous['depth'] == record['depth'] - 1 \
+                    and not record['interrupted']:
+                record['iteration_branching_factor'] = record['nodes'] / previous['nodes']
+            previous = record
+        cutoffs = sum(record['cutoffs'] for record in self.searches)
+        first_move_cutoffs = sum(counters['first_move_cutoffs'] for record in self.searches for counters in record['plies'])
+        return {'searches': self.searches,
+                'nodes': sum(record['nodes'] for record in self.searches),
+                'seconds': sum(record['seconds'] for record in self.searches),
+                'cutoffs': cutoffs,
+                'first_move_cutoff_rate': first_move_cutoffs / cutoffs if cutoffs else None,
+                'timers': {category: {'seconds': timer[0], 'calls': timer[1]} for category, timer in self.timers.items()}}
+    
+    # times the methods of TIMED while in the with block, for searches of boards of board_class
+    # the time of a timed method called by another (e.g. king safety by evaluate) is counted in its own category
+    @contextlib.contextmanager
+    def timing(self, board_class):
+        patched = []
+        for category, methods in SearchStatistics.TIMED.items():
+            for owner, name in methods:
+                owner = owner if owner is not None else board_class
+                original = owner.__dict__.get(name) # None if inherited
+                timed = self.__timed(category, getattr(owner, name))
+                setattr(owner, name, staticmethod(timed) if isinstance(original, staticmethod) else timed)
+                patched.append((owner, name, original))
+        try:
+            yield self
+        finally:
+            for owner, name, original in reversed(patched):
+                if original is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, original)
+                    
+    def __timed(self, category, function):
+        timers = self.timers
+        
+        def timed(*args):
+            start = time.perf_counter()
+            outer = self.__timed_category
+            if outer is not None: # the calling timed method's clock pauses
+                timers[outer][0] += start - self.__timed_since
+            self.__timed_category = category
+            self.__timed_since = start
+            try:
+                return function(*args)
+            finally:
+                end = time.perf_counter()
+                timers[category][0] += end - self.__timed_since
+                timers[category][1] += 1
+                self.__timed_category = outer
+                self.__timed_since = end
+        return timed
+    
+    
+# the state kept by an AI player between its searches
+class SearchContext():
+    def __init__(self, transposition_table_megabytes=TranspositionTable.DEFAULT_MEGABYTES, features=None,
+                 opening_book=None, tablebases=None, statistics=None, analysis_cache=None, exact_depth=False):
+        self.transposition_table = TranspositionTable(transposition_table_megabytes, exact_depth)
+        self.move_ordering = MoveOrdering()
+        self.features = features if features is not None else SearchFeatures()
+        # OpeningBook consulted by AI_play before searching, None for no book:
+        self.opening_book = opening_book
+        # Tablebases probed by the search, None for no tablebases:
+        self.tablebases = tablebases
+        # SearchStatistics collecting the searches' counters, None for no statistics:
+        self.statistics = statistics
+        # AnalysisCache consulted by AI_play before searching and storing its results, None for no cache:
+        self.analysis_cache = analysis_cache
+        
+        # budget of the running search (see start_search):
+        self.deadline = None
+        self.node_limit = None
+        # searches are numbered, a stop is for the search running (or prepared) when it is asked for (see stop):
+        self.searching = False
+        self.search_number = 0
+        self.stopped_search = None
+        
+        # progress of the running search:
+        self.nodes = 0
+        self.completed_depth = 0
+        # (best move, value) of the root moves searched so far in the current iteration:
+        self.root_best = None
+        
+    # announces a search that another thread is about to start, so a stop asked for before it calls start_search
+    # still stops it
+    def prepare_search(self):
+        self.searching = True
+        
+    # starts counting a new search's budget
+    # time_limit is in seconds, node_limit counts max_value/min_value calls, None means unlimited
+    def start_search(self, time_limit=None, node_limit=None):
+        self.searching = True
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.completed_depth = 0
+        self.root_best = None
+        
+    # ends the budget of the search started by start_search, so later searches of the context (like fixed-depth
+    # ones, which don't start a budget) aren't interrupted by its limits
+    # (a stop asked for later is for the next search, if it has been prepared or started)
+    def finish_search(self):
+        self.deadline = None
+        self.node_limit = None
+        self.searching = False
+        self.search_number += 1
+        
+    # asks the running search (possibly on another thread) to return as soon as possible
+    # only searches with a budget (iterative_deepening) are stopped, and nothing is stopped without a running one
+    # (the number is read before the state, as finish_search changes them the other way round)
+    def stop(self):
+        number = self.search_number
+        if self.searching:
+            self.stopped_search = number
+        
+    # counts a visited node and interrupts the search once its budget runs out
+    def count_node(self):
+        self.nodes += 1
+        if self.stopped_search == self.search_number:
+            raise SearchInterrupted()
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchInterrupted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchInterrupted()
+        
+    # the key of a position in the transposition table
+    # utilities depend on max_player, so each player's results are kept apart
+    @staticmethod
+    def position_key(chess_board, max_player):
+        return chess_board.zobrist_key ^ ZOBRIST_MAX_PLAYER[max_player]
+    
+    
+class MinMax():
+    INFINITY = 1000000000
+    
+    # number of positions visited by max_value and min_value, for measuring search speed
+    nodes = 0
+    
+    # sort for a more efficient alpha-beta pruning:
+    def sort_forcast(forcast):
+        forcast_utility_sorted = []
+        for action, outcome in forcast:
+            target = ChessBoard.chess_pos_to_index(action[1])
+            moved_piece = outcome.piece_at(target[0], target[1])
+            
+            # captures of more valuable pieces first (last_move_score is 0 if nothing was captured),
+            # by less valuable pieces first
+            utility = outcome.last_move_score * 8 - HeuristicScores.SCORES[moved_piece[1]]
+            
+            forcast_utility_sorted.append((utility, (action, outcome)))
+            
+        forcast_utility_sorted.sort(key=lambda tup: tup[0], reverse=True)
+        return [element for utility, element in forcast_utility_sorted]
+    
+    # sorts packed moves played on chess_board: captures and promotions by MVV-LVA, then quiet moves
+    # hash_move (the best move found by a previous search) is moved to the front
+    @staticmethod
+    def sort_moves(chess_board, moves, hash_move=None):
+        moves = MoveOrdering.sort_captures(chess_board, moves)
+        if hash_move is not None and hash_move in moves:
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+        return moves
+    
+    # the moves of chess_board in the order the search tries them (see ChessBoard.staged_moves)
+    # ordering (MoveOrdering) adds the killer moves and the history of the searched player, if given
+    @staticmethod
+    def ordered_moves(chess_board, hash_move, ordering):
+        if ordering is None:
+            return chess_board.staged_moves(hash_move, (), MoveOrdering.sort_captures)
+        return chess_board.staged_moves(hash_move, ordering.killer_moves(chess_board.moves_played()),
+                                        MoveOrdering.sort_captures, ordering.sort_quiets)
+    
+    # the search plays and takes back moves on a single board (see ChessBoard.push and pop)
+    # instead of copying a board for every successor
+    # context (SearchContext) holds the transposition table, shared by the searches of a player,
+    # and the search features it uses
+    # previous_value is the value of an earlier (shallower) search of the position, for aspiration windows
+    @staticmethod # max_player is requred for proper heuristic utility calculation
+    def alpha_beta_decision(chess_board, max_depth, max_player, context=None, previous_value=None):
+        # search on a private copy (of the same board backend), so the game board is untouched
+        chess_board = type(chess_board)(chess_board)
+        
+        action = MinMax.tablebase_decision(chess_board, max_player, context)
+        if action is not None:
+            return action
+        
+        hash_move = None
+        if context is not None:
+            context.transposition_table.new_search()
+            context.move_ordering.new_search()
+            context.root_best = None
+            # the best move of an earlier search of this position (e.g. the previous iteration) goes first:
+            key = SearchContext.position_key(chess_board, max_player)
+            hash_move = context.transposition_table.lookup(key, max_depth, -MinMax.INFINITY, MinMax.INFINITY)[1]
+            if context.statistics is not None:
+                context.statistics.start_search(chess_board, max_depth)
+        
+        moves = MinMax.sort_moves(chess_board, chess_board.legal_moves(), hash_move)
+        
+        # with aspiration windows, the moves are searched in a window around the previous value first,
+        # and searched again with the full window if the value turns out to be outside of it
+        full_window = (-MinMax.INFINITY, MinMax.INFINITY)
+        window = full_window
+        if context is not None and context.features.aspiration_windows and previous_value is not None:
+            window = (previous_value - SearchFeatures.ASPIRATION_WINDOW, previous_value + SearchFeatures.ASPIRATION_WINDOW)
+        
+        best_move, value = MinMax.__search_root(chess_board, moves, max_depth, window, max_player, context)
+        if window != full_window and (value <= window[0] or value >= window[1]):
+            best_move, value = MinMax.__search_root(chess_board, moves, max_depth, full_window, max_player, context)
+                
+        if context is not None and context.statistics is not None:
+            context.statistics.finish_search()
+        if best_move is None:
+            return None
+        if context is not None:
+            context.transposition_table.store(key, max_depth, TranspositionTable.EXACT, value, best_move)
+        return ChessBoard.move_to_action(best_move)
+    
+    # returns the action of the tablebases of context (see Tablebases.best_move), without searching,
+    # and sets root_best like a search does, returns None if the position is not in the tablebases
+    @staticmethod
+    def tablebase_decision(chess_board, max_player, context):
+        if context is None or context.tablebases is None:
+            return None
+        decision = context.tablebases.best_move(chess_board)
+        if decision is None:
+            return None
+        move, value = decision
+        context.root_best = (move, value if chess_board.turn == max_player else -value)
+        return ChessBoard.move_to_action(move)
+    
+    # searches the root moves with the window (alpha, beta), returns (best move, value)
+    # later moves are searched against the best value so far: a move that can't beat it returns early
+    # (with a value <= the best) and the first move of the highest value is still the one chosen
+    @staticmethod
+    def __search_root(chess_board, moves, max_depth, window, max_player, context):
+        pvs = context is not None and context.features.pvs
+        alpha, beta = window
+        value = -MinMax.INFINITY
+        best_move = None
+        for index, move in enumerate(moves):
+            chess_board.push(move)
+            tmp = MinMax.__search_move(chess_board, max_depth, alpha, beta, max_player, context, True, pvs and index > 0)
+            chess_board.pop()
+            if tmp > value:
+                value = tmp
+                best_move = move
+                if context is not None and value > alpha:
+                    context.root_best = (best_move, value)
+            alpha = max(alpha, value)
+            if value >= beta:
+                break
+            
+        return best_move, value
+    
+    # searches the position after a move (already pushed on chess_board) of a max node (maximizing) or a
+    # min node searched max_depth deep with the window (alpha, beta)
+    # with scout, the move is searched with a null window first, which only tells if it can change the node's
+    # value, with a reduction it is searched that much shallower first, and again only if it can
+    @staticmethod
+    def __search_move(chess_board, max_depth, alpha, beta, max_player, context, maximizing, scout=False, reduction=0):
+        if maximizing:
+            child = MinMax.min_value
+            scout_window = (alpha, alpha + SearchFeatures.SCOUT_WINDOW)
+        else:
+            child = MinMax.max_value
+            scout_window = (beta - SearchFeatures.SCOUT_WINDOW, beta)
+            
+        if reduction > 0:
+            tmp = child(chess_board, max_depth - 1 - reduction, scout_window[0], scout_window[1], max_player, context)
+            if (maximizing and tmp <= alpha) or (not maximizing and tmp >= beta):
+                return tmp
+        if scout:
+            tmp = child(chess_board, max_depth - 1, scout_window[0], scout_window[1], max_player, context)
+            if tmp <= alpha or tmp >= beta:
+                return tmp
+        return child(chess_board, max_depth - 1, alpha, beta, max_player, context)
+    
+    # checks if the side to move on chess_board may pass the turn for null-move pruning:
+    # not in check, not right after another null move, deep enough for the reduced search,
+    # and not left with pawns and the king only, where passing could be better than any move
+    @staticmethod
+    def __null_move_allowed(chess_board, max_depth, in_check):
+        return (max_depth > SearchFeatures.NULL_MOVE_REDUCTION and not in_check and not chess_board.last_move_is_null()
+                and chess_board.has_non_pawn_material(chess_board.turn))
+    
+    # the reduction of a move (not played yet) tried index-th at a node of chess_board:
+    # quiet moves tried late, other than the killers, are searched shallower first, unless in check
+    @staticmethod
+    def __late_move_reduction(chess_board, move, index, max_depth, in_check, ordering):
+        if index < SearchFeatures.LMR_FULL_DEPTH_MOVES or max_depth < SearchFeatures.LMR_MIN_DEPTH or in_check:
+            return 0
+        target = (move >> 6) & 63
+        if move >> 12 or chess_board.piece_at(target >> 3, target & 7) != '.':
+            return 0
+        if ordering is not None and move in ordering.killer_moves(chess_board.moves_played()):
+            return 0
+        return SearchFeatures.LMR_REDUCTION
+    
+    # searches with increasing depth (1, 2, 3...) until max_depth is done or the budget runs out
+    # time_limit is in seconds and node_limit counts visited nodes, None means unlimited
+    # every iteration starts with the best move of the previous one, so when the budget runs out
+    # the best move of the interrupted iteration (or else the last finished one) is returned
+    @staticmethod
+    def iterative_deepening(chess_board, max_player, max_depth=None, time_limit=None, node_limit=None, context=None):
+        if context is None:
+            context = SearchContext()
+        if max_depth is None and time_limit is None and node_limit is None:
+            raise Exception('ERROR: iterative deepening needs a depth, time or node limit')
+        context.start_search(time_limit, node_limit)
+        try:
+            return MinMax.__deepen(chess_board, max_player, max_depth, context)
+        finally:
+            context.finish_search()
+            
+    # the iterations of iterative_deepening, within the budget of context's search
+    @staticmethod
+    def __deepen(chess_board, max_player, max_depth, context):
+        # positions of the tablebases are decided without searching:
+        action = MinMax.tablebase_decision(chess_board, max_player, context)
+        if action is not None:
+            return action
+        
+        best_action = None
+        previous_value = None
+        depth = 1
+        while max_depth is None or depth <= max_depth:
+            try:
+                action = MinMax.alpha_beta_decision(chess_board, depth, max_player, context, previous_value)
+            except SearchInterrupted:
+                if context.statistics is not None:
+                    context.statistics.finish_search(interrupted=True)
+                # the previous best move is searched first, so a move that beat it is better
+                if context.root_best is not None:
+                    best_action = ChessBoard.move_to_action(context.root_best[0])
+                break
+            
+            if action is None: # no legal moves
+                return None
+            best_action = action
+            previous_value = context.root_best[1]
+            context.completed_depth = depth
+            depth += 1
+            
+        # the budget ran out before any move was searched:
+        if best_action is None:
+            moves = MinMax.sort_moves(chess_board, chess_board.legal_moves())
+            if moves:
+                best_action = ChessBoard.move_to_action(moves[0])
+                
+        return best_action
+    
+    @staticmethod
+    def max_value(chess_board, max_depth, alpha, beta, max_player, context=None):
+        MinMax.nodes += 1
+        statistics = None
+        if context is not None:
+            context.count_node()
+            statistics = context.statistics
+            if statistics is not None:
+                statistics.node(chess_board.moves_played())
+            # positions of the tablebases have exact utilities:
+            if context.tablebases is not None:
+                utility = context.tablebases.value(chess_board, max_player)
+                if utility is not None:
+                    return utility
+        
+        # reuse the result of an earlier visit of the same position:
+        table = context.transposition_table if context is not None else None
+        hash_move = None
+        if table is not None:
+            key = SearchContext.position_key(chess_board, max_player)
+            stored_value, hash_move = table.lookup(key, max_depth, alpha, beta)
+            if stored_value is not None:
+                if statistics is not None:
+                    statistics.hash_hit(chess_board.moves_played())
+                return stored_value
+        
+        # check depth limit (terminal positions are found below, when there are no moves)
+        if max_depth == 0:
+            if statistics is not None:
+                statistics.leaf(chess_board.moves_played())
+            utility = chess_board.evaluate(max_player)
+            if table is not None:
+                table.store(key, max_depth, TranspositionTable.EXACT, utility, None)
+            return utility
+        
+        features = context.features if context is not None else None
+        pruning = features is not None and (features.null_move or features.late_move_reductions)
+        in_check = pruning and chess_board.in_check()
+        
+        # null-move pruning: if the value stays >= beta even when this side passes the turn,
+        # a real move is expected to fail high too
+        if pruning and features.null_move and beta < MinMax.INFINITY and MinMax.__null_move_allowed(chess_board, max_depth, in_check):
+            chess_board.push_null_move()
+            tmp = MinMax.min_value(chess_board, max_depth - 1 - SearchFeatures.NULL_MOVE_REDUCTION,
+                                   beta - SearchFeatures.SCOUT_WINDOW, beta, max_player, context)
+            chess_board.pop()
+            if tmp >= beta:
+                if table is not None:
+                    table.store(key, max_depth, TranspositionTable.LOWER_BOUND, tmp, hash_move)
+                return tmp
+        
+        value = -MinMax.INFINITY
+        best_move = None
+        window = (alpha, beta)
+        pvs = features is not None and features.pvs
+        reductions = pruning and features.late_move_reductions
+        
+        # moves are generated in stages, so a cutoff skips generating and verifying the rest:
+        ordering = context.move_ordering if context is not None else None
+        for index, move in enumerate(MinMax.ordered_moves(chess_board, hash_move, ordering)):
+            reduction = 0
+            if reductions:
+                reduction = MinMax.__late_move_reduction(chess_board, move, index, max_depth, in_check, ordering)
+            chess_board.push(move)
+            if reduction > 0 and chess_board.in_check(): # moves giving check are not reduced
+                reduction = 0
+            tmp = MinMax.__search_move(chess_board, max_depth, alpha, beta, max_player, context, True,
+                                       pvs and index > 0, reduction)
+            chess_board.pop()
+            if tmp > value:
+                value = tmp
+                best_move = move
+            alpha = max(alpha, value)
+            if value >= beta:
+                if ordering is not None:
+                    ordering.record_cutoff(chess_board, move, max_depth, chess_board.moves_played())
+                if statistics is not None:
+                    statistics.cutoff(chess_board.moves_played(), index)
+                break
+            
+        # check terminal (checkmate or stalemate)
+        if best_move is None:
+            value = chess_board.no_moves_utility(max_player)
+            
+        if table is not None:
+            table.store(key, max_depth, TranspositionTable.bound(value, *window), value, best_move)
+        
+        return value
+    
+    @staticmethod
+    def min_value(chess_board, max_depth, alpha, beta, max_player, context=None):
+        MinMax.nodes += 1
+        statistics = None
+        if context is not None:
+            context.count_node()
+            statistics = context.statistics
+            if statistics is not None:
+                statistics.node(chess_board.moves_played())
+            # positions of the tablebases have exact utilities:
+            if context.tablebases is not None:
+                utility = context.tablebases.value(chess_board, max_player)
+                if utility is not None:
+                    return utility
+        
+        # reuse the result of an earlier visit of the same position:
+        table = context.transposition_table if context is not None else None
+        hash_move = None
+        if table is not None:
+            key = SearchContext.position_key(chess_board, max_player)
+            stored_value, hash_move = table.lookup(key, max_depth, alpha, beta)
+            if stored_value is not None:
+                if statistics is not None:
+                    statistics.hash_hit(chess_board.moves_played())
+                return stored_value
+        
+        # check depth limit (terminal positions are found below, when there are no moves)
+        if max_depth == 0:
+            if statistics is not None:
+                statistics.leaf(chess_board.moves_played())
+            utility = chess_board.evaluate(max_player)
+            if table is not None:
+                table.store(key, max_depth, TranspositionTable.EXACT, utility, None)
+            return utility
+        
+        features = context.features if context is not None else None
+        pruning = features is not None and (features.null_move or features.late_move_reductions)
+        in_check = pruning and chess_board.in_check()
+        
+        # null-move pruning: if the value stays <= alpha even when this side passes the turn,
+        # a real move is expected to fail low too
+        if pruning and features.null_move and alpha > -MinMax.INFINITY and MinMax.__null_move_allowed(chess_board, max_depth, in_check):
+            chess_board.push_null_move()
+            tmp = MinMax.max_value(chess_board, max_depth - 1 - SearchFeatures.NULL_MOVE_REDUCTION,
+                                   alpha, alpha + SearchFeatures.SCOUT_WINDOW, max_player, context)
+            chess_board.pop()
+            if tmp <= alpha:
+                if table is not None:
+                    table.store(key, max_depth, TranspositionTable.UPPER_BOUND, tmp, hash_move)
+                return tmp
+        
+        value = MinMax.INFINITY
+        best_move = None
+        window = (alpha, beta)
+        pvs = features is not None and features.pvs
+        reductions = pruning and features.late_move_reductions
+        
+        # moves are generated in stages, so a cutoff skips generating and verifying the rest:
+        ordering = context.move_ordering if context is not None else None
+        for index, move in enumerate(MinMax.ordered_moves(chess_board, hash_move, ordering)):
+            reduction = 0
+            if reductions:
+                reduction = MinMax.__late_move_reduction(chess_board, move, index, max_depth, in_check, ordering)
+            chess_board.push(move)
+            if reduction > 0 and chess_board.in_check(): # moves giving check are not reduced
+                reduction = 0
+            tmp = MinMax.__search_move(chess_board, max_depth, alpha, beta, max_player, context, False,
+                                       pvs and index > 0, reduction)
+            chess_board.pop()
+            if tmp < value:
+                value = tmp
+                best_move = move
+            beta = min(beta, value)
+            if value <= alpha:
+                if ordering is not None:
+                    ordering.record_cutoff(chess_board, move, max_depth, chess_board.moves_played())
+                if statistics is not None:
+                    statistics.cutoff(chess_board.moves_played(), index)
+                break
+            
+        # check terminal (checkmate or stalemate)
+        if best_move is None:
+            value = chess_board.no_moves_utility(max_player)
+            
+        if table is not None:
+            table.store(key, max_depth, TranspositionTable.bound(value, *window), value, best_move)
+        
+        return value
+    
+# the search state of a ParallelSearch worker process, set up by _init_parallel_worker:
+_worker_context = None
+_worker_alpha = None
+_worker_search_id = None
+
+def _init_parallel_worker(shared_alpha, transposition_table_megabytes, features, tablebases):
+    global _worker_context, _worker_alpha
+    _worker_context = SearchContext(transposition_table_megabytes, features, tablebases=tablebases)
+    _worker_alpha = shared_alpha
+    
+# searches a root move (packed) of chess_board in a worker process
+# against the best value any worker has found so far, lowered by a null window
+# so a move as good as the best one still gets its exact value
+# returns (value, exact, nodes), the value is only an upper bound below the best one if not exact
+def _search_root_move(search_id, chess_board, move, max_depth, max_player):
+    global _worker_search_id
+    context = _worker_context
+    if search_id != _worker_search_id:
+        _worker_search_id = search_id
+        context.transposition_table.new_search()
+        context.move_ordering.new_search()
+    context.start_search()
+    
+    alpha = _worker_alpha.value - SearchFeatures.SCOUT_WINDOW
+    chess_board.push(move)
+    value = MinMax.min_value(chess_board, max_depth - 1, alpha, MinMax.INFINITY, max_player, context)
+    exact = value > alpha
+    if exact:
+        with _worker_alpha.get_lock():
+            if value > _worker_alpha.value:
+                _worker_alpha.value = value
+    return value, exact, context.nodes
+
+
+# searches the root moves of alpha_beta_decision on worker processes
+# the first move is searched alone to find a value to prune the others with, then the rest are searched
+# in parallel, each against the best value found so far by any worker (shared between the processes)
+# the first move of the highest value in the serial search's order is chosen, so the move is the same as the
+# serial search's at the same depth (with search features that keep exact values, see SearchFeatures), up to the
+# deeper results the transposition tables reuse: the workers keep their tables between searches, and those hold
+# other results than the serial search's, so the values (and moves) may differ after earlier searches
+# every worker keeps its own transposition table between searches (and loads its own tablebases, if given)
+class ParallelSearch():
+    def __init__(self, workers=None, transposition_table_megabytes=TranspositionTable.DEFAULT_MEGABYTES, features=None,
+                 tablebases=None):
+        self.workers = workers if workers is not None else os.cpu_count()
+        if self.workers < 1:
+            raise Exception('ERROR: parallel search needs at least 1 worker')
+        
+        self.shared_alpha = multiprocessing.Value('d', -MinMax.INFINITY)
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_parallel_worker,
+                                            initargs=(self.shared_alpha, transposition_table_megabytes, features, tablebases))
+        self.search_id = 0
+        
+        # nodes visited by the workers and seconds taken by the last search:
+        self.nodes = 0
+        self.elapsed = 0
+        
+    def close(self):
+        self.executor.shutdown()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    # same as MinMax.alpha_beta_decision, the root moves are ordered by the hash move of context (if given)
+    # and the result is stored in its transposition table
+    def alpha_beta_decision(self, chess_board, max_depth, max_player, context=None):
+        start_time = time.perf_counter()
+        chess_board = type(chess_board)(chess_board)
+        
+        action = MinMax.tablebase_decision(chess_board, max_player, context)
+        if action is not None:
+            return action
+        
+        hash_move = None
+        if context is not None:
+            key = SearchContext.position_key(chess_board, max_player)
+            hash_move = context.transposition_table.lookup(key, max_depth, -MinMax.INFINITY, MinMax.INFINITY)[1]
+        
+        moves = MinMax.sort_moves(chess_board, chess_board.legal_moves(), hash_move)
+        if len(moves) == 0:
+            return None
+        
+        self.search_id += 1
+        self.shared_alpha.value = -MinMax.INFINITY
+        first = self.executor.submit(_search_root_move, self.search_id, chess_board, moves[0], max_depth, max_player)
+        results = [first.result()]
+        futures = [self.executor.submit(_search_root_move, self.search_id, chess_board, move, max_depth, max_player)
+                   for move in moves[1:]]
+        results += [future.result() for future in futures]
+        
+        value = -MinMax.INFINITY
+        best_move = None
+        self.nodes = 0
+        for move, (tmp, exact, nodes) in zip(moves, results):
+            self.nodes += nodes
+            if exact and tmp > value:
+                value = tmp
+                best_move = move
+        MinMax.nodes += self.nodes
+        self.elapsed = time.perf_counter() - start_time
+        
+        if context is not None:
+            context.transposition_table.store(key, max_depth, TranspositionTable.EXACT, value, best_move)
+        return ChessBoard.move_to_action(best_move)
+    
+    
+# an opening book file (written by opening_book.py), read through mmap, so opening it costs nothing
+# the file is a header (MAGIC and the number of entries) followed by entries sorted by Zobrist key,
+# every entry is (Zobrist key of a position, packed move, weight), fixed-width and little-endian
+# so a position's moves are found by a binary search of the entries
+# (the keys depend on the ZOBRIST_* tables, so a book only works with the tables it was built with)
+class OpeningBook():
+    MAGIC = b'CHESSAIB'
+    HEADER = struct.Struct('<8sI4x')
+    ENTRY = struct.Struct('<QHH')
+    
+    # with weighted, the moves are chosen at random in proportion to their weights (rng is a random.Random)
+    # otherwise the move of the highest weight is chosen
+    def __init__(self, path, weighted=True, rng=None):
+        self.weighted = weighted
+        self.rng = rng if rng is not None else random.Random()
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < OpeningBook.HEADER.size:
+            raise Exception('ERROR: ' + path + ' is not an opening book')
+        magic, self.size = OpeningBook.HEADER.unpack_from(self.data, 0)
+        if magic != OpeningBook.MAGIC or len(self.data) != OpeningBook.HEADER.size + self.size * OpeningBook.ENTRY.size:
+            raise Exception('ERROR: ' + path + ' is not an opening book')
+        
+    def close(self):
+        self.data.close()
+        
+    # writes entries ((key, move, weight) tuples) as a book file
+    @staticmethod
+    def write(path, entries):
+        entries = sorted(entries)
+        with open(path, 'wb') as file:
+            file.write(OpeningBook.HEADER.pack(OpeningBook.MAGIC, len(entries)))
+            for key, move, weight in entries:
+                file.write(OpeningBook.ENTRY.pack(key, move, min(weight, 0xFFFF)))
+                
+    def __key_at(self, index):
+        return OpeningBook.ENTRY.unpack_from(self.data, OpeningBook.HEADER.size + index * OpeningBook.ENTRY.size)[0]
+    
+    # returns [(packed move, weight)] of the position with the given Zobrist key
+    def entries(self, key):
+        # the first entry with a key >= key:
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.__key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+                
+        moves = []
+        for index in range(low, self.size):
+            entry_key, move, weight = OpeningBook.ENTRY.unpack_from(self.data, OpeningBook.HEADER.size + index * OpeningBook.ENTRY.size)
+            if entry_key != key:
+                break
+            moves.append((move, weight))
+        return moves
+    
+    # returns the book's action for chess_board, None if the position is not in the book
+    # (moves that are not legal in the position, from another position with the same key, are skipped)
+    def choose(self, chess_board):
+        legal_moves = chess_board.legal_moves()
+        moves = [(move, weight) for move, weight in self.entries(chess_board.zobrist_key) if move in legal_moves and weight > 0]
+        if len(moves) == 0:
+            return None
+        if self.weighted:
+            move = self.rng.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+        else:
+            move = max(moves, key=lambda entry: entry[1])[0]
+        return ChessBoard.move_to_action(move)
+    
+    
+# endgame tablebases (built by tablebase.py) of the material sets of the two kings and one more piece,
+# like KQK: the result (win, draw or loss) and distance to mate of every position with the best play of both
+# a table is a header and a byte per position (see index), the distance to mate in plies + 1, or 0 for a draw
+# (and for impossible positions), so the side to move wins when the distance is odd and loses when it is even
+# tables are built with white as the side with the piece, positions with a black piece are probed mirrored
+# the tables follow this engine's rules (no en passant, promotions to a knight or a queen, no draw by repetition)
+# and are only probed where neither player can castle
+class Tablebases():
+    MAGIC = b'CHESSAIT'
+    HEADER = struct.Struct('<8s4s4x')
+    # material sets that can be built, KPK needs KQK (for the promotions):
+    MATERIALS = ('KQK', 'KRK', 'KPK')
+    MAX_PIECES = 3
+    # positions of a table: side to move, white king, black king and the piece
+    SIZE = 2 * 64 * 64 * 64
+    
+    # loads the tables of the materials from directory (every table found there if materials is None)
+    # the tables are read through mmap, pages are read from the files as they are probed
+    def __init__(self, directory, materials=None):
+        self.directory = directory
+        self.tables = {}
+        self.__files = {}
+        for material in materials if materials is not None else Tablebases.MATERIALS:
+            path = Tablebases.path(directory, material)
+            if not os.path.exists(path):
+                if materials is None:
+                    continue
+                raise Exception('ERROR: no ' + material + ' table in ' + directory)
+            with open(path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, name = Tablebases.HEADER.unpack_from(data, 0)
+            if magic != Tablebases.MAGIC or name.rstrip(b'\0').decode() != material or \
+                    len(data) != Tablebases.HEADER.size + Tablebases.SIZE:
+                raise Exception('ERROR: ' + path + ' is not a ' + material + ' table')
+            self.tables[material] = data
+            
+    def close(self):
+        for data in self.tables.values():
+            data.close()
+        self.tables = {}
+        
+    # tables are loaded again from their files in other processes (see ParallelSearch)
+    def __getstate__(self):
+        return {'directory': self.directory, 'materials': list(self.tables)}
+    
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['materials'])
+        
+    @staticmethod
+    def path(directory, material):
+        return os.path.join(directory, material + '.tb')
+    
+    # writes a table (bytes of SIZE) of the material to its file in directory
+    @staticmethod
+    def write(directory, material, table):
+        with open(Tablebases.path(directory, material), 'wb') as file:
+            file.write(Tablebases.HEADER.pack(Tablebases.MAGIC, material.encode()))
+            file.write(table)
+            
+    # the position of a table, turn is 'w' or 'b' and the others are positions numbered y * 8 + x
+    @staticmethod
+    def index(turn, white_king, black_king, piece):
+        return (((turn == 'b') * 64 + white_king) * 64 + black_king) * 64 + piece
+    
+    # checks if a player can still castle (see ChessBoard.__king_move_legal), which the tables don't know about
+    @staticmethod
+    def __may_castle(chess_board):
+        for color in 'wb':
+            if not chess_board.king_ever_moved[color] and \
+                    not (chess_board.left_rook_ever_moved[color] and chess_board.right_rook_ever_moved[color]):
+                return True
+        return False
+    
+    # returns (result, plies) of the position for the side to move: result is 1 for a win, 0 for a draw and
+    # -1 for a loss, plies is the distance to mate (None for a draw)
+    # returns None if the position is not in the loaded tables
+    # positions with the kings only, or a knight or bishop more, are draws without a table
+    def probe(self, chess_board):
+        if chess_board.pieces_count() > Tablebases.MAX_PIECES or Tablebases.__may_castle(chess_board):
+            return None
+        
+        pieces = [(chess_board.piece_at(y, x), y * 8 + x) for y in range(8) for x in range(8)]
+        pieces = [(piece, sq) for piece, sq in pieces if piece != '.' and piece[1] != 'K']
+        if len(pieces) == 0 or pieces[0][0][1] in 'NB':
+            return 0, None
+        (piece, sq), = pieces
+        table = self.tables.get('K' + piece[1] + 'K')
+        if table is None:
+            return None
+        
+        white_king, black_king = [ky * 8 + kx for ky, kx in (chess_board.king_position['w'], chess_board.king_position['b'])]
+        turn = chess_board.turn
+        if piece[0] == 'b': # mirrored, so white has the piece
+            white_king, black_king, sq = black_king ^ 56, white_king ^ 56, sq ^ 56
+            turn = 'w' if turn == 'b' else 'b'
+        distance = table[Tablebases.HEADER.size + Tablebases.index(turn, white_king, black_king, sq)]
+        if distance == 0:
+            return 0, None
+        plies = distance - 1
+        return (1 if plies % 2 == 1 else -1), plies
+    
+    # the utility of the position for player, None if it is not in the tables
+    # won positions are worth a checkmate less their distance to mate, so shorter mates are preferred
+    def value(self, chess_board, player):
+        probe = self.probe(chess_board)
+        if probe is None:
+            return None
+        result, plies = probe
+        if result == 0:
+            return 0
+        value = result * (HeuristicScores.CHECKMATE - plies)
+        return value if chess_board.turn == player else -value
+    
+    # returns (best move, utility for the side to move) of the position, by probing the positions after every
+    # legal move: the shortest mate when winning, a drawing move when drawn and the longest defence when losing
+    # returns None if the position, or one after a move, is not in the tables
+    def best_move(self, chess_board):
+        if self.probe(chess_board) is None:
+            return None
+        best = None
+        for move in chess_board.legal_moves():
+            chess_board.push(move)
+            probe = self.probe(chess_board)
+            chess_board.pop()
+            if probe is None:
+                return None
+            result, plies = probe
+            value = 0 if result == 0 else -result * (HeuristicScores.CHECKMATE - plies - 1)
+            if best is None or value > best[1]:
+                best = (move, value)
+        return best
+    
+    
+# a persistent cache of search results on disk (an SQLite database), so positions searched again by later runs
+# (the openings of self-play series, positions files analyzed again) are not searched again: the best move,
+# value, depth and nodes of every position searched, by its key (SearchContext.position_key) and the settings
+# its value depends on (see settings)
+# a stored result is reused for a search of the same or a smaller depth (so a deeper result may be played
+# instead of the one the search would find), and a deeper result replaces a shallower one
+# the cache keeps at most max_entries results, the least recently used go first (checked every EVICTION_INTERVAL
+# stores), and many processes can use a file at once: each opens its own connection, readers don't wait for
+# the writer (write-ahead logging) and writers wait for each other up to BUSY_TIMEOUT seconds
+class AnalysisCache():
+    DEFAULT_MAX_ENTRIES = 1000000
+    EVICTION_INTERVAL = 100
+    # least recently used results removed at once when the cache is full (a fraction of max_entries):
+    EVICTION_FRACTION = 0.1
+    BUSY_TIMEOUT = 30
+    
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        if max_entries < 1:
+            raise Exception('ERROR: an analysis cache needs room for at least 1 result')
+        self.path = path
+        self.max_entries = max_entries
+        self.__stores = 0
+        # without isolation_level, every statement commits by itself unless within BEGIN ... COMMIT
+        self.connection = sqlite3.connect(path, timeout=AnalysisCache.BUSY_TIMEOUT, isolation_level=None)
+        try:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS analysis (settings TEXT NOT NULL, '
+                                    'key INTEGER NOT NULL, move INTEGER NOT NULL, value REAL NOT NULL, '
+                                    'depth INTEGER NOT NULL, nodes INTEGER NOT NULL, used REAL NOT NULL, '
+                                    'PRIMARY KEY (settings, key))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS analysis_used ON analysis (used)')
+        except sqlite3.DatabaseError as error:
+            self.connection.close()
+            raise Exception('ERROR: ' + path + ' is not an analysis cache (' + str(error) + ')')
+        self.evict()
+        
+    def close(self):
+        self.connection.close()
+        
+    # the cache is opened again from its file in other processes
+    def __getstate__(self):
+        return {'path': self.path, 'max_entries': self.max_entries}
+    
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['max_entries'])
+        
+    # the settings of context's searches that change their values: the search features, the evaluation's
+    # HeuristicScores and the tablebases (a short hash, results of other settings are never reused)
+    @staticmethod
+    def settings(context):
+        heuristics = {name: value for name, value in vars(HeuristicScores).items() if name.isupper()}
+        tablebases = sorted(context.tablebases.tables) if context.tablebases is not None else []
+        settings = json.dumps([context.features.enabled(), heuristics, tablebases], sort_keys=True)
+        return hashlib.sha1(settings.encode()).hexdigest()[:16]
+    
+    # SQLite integers are signed 64-bit
+    @staticmethod
+    def __signed(key):
+        return key - (1 << 64) if key >= 1 << 63 else key
+    
+    # returns (packed move, value for max_player, depth, nodes) stored for the position with settings, searched at
+    # least depth deep, None if there is none (or its move is not legal, from another position with the same key)
+    def lookup(self, chess_board, depth, max_player, settings):
+        key = AnalysisCache.__signed(SearchContext.position_key(chess_board, max_player))
+        row = self.connection.execute('SELECT move, value, depth, nodes FROM analysis WHERE settings = ? AND key = ? '
+                                      'AND depth >= ?', (settings, key, depth)).fetchone()
+        if row is None or row[0] not in chess_board.legal_moves():
+            return None
+        self.connection.execute('UPDATE analysis SET used = ? WHERE settings = ? AND key = ?',
+                                (time.time(), settings, key))
+        return row
+    
+    # stores the result of a search of the position (a shallower stored result is replaced, a deeper one is kept)
+    def store(self, chess_board, max_player, settings, move, value, depth, nodes):
+        key = AnalysisCache.__signed(SearchContext.position_key(chess_board, max_player))
+        self.connection.execute('INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (settings, key) '
+                                'DO UPDATE SET move = excluded.move, value = excluded.value, depth = excluded.depth, '
+                                'nodes = excluded.nodes, used = excluded.used WHERE excluded.depth >= analysis.depth',
+                                (settings, key, move, value, depth, nodes, time.time()))
+        self.__stores += 1
+        if self.__stores % AnalysisCache.EVICTION_INTERVAL == 0:
+            self.evict()
+            
+    # removes the least recently used results if there are more than max_entries
+    # (down to max_entries less EVICTION_FRACTION of it, so a full cache isn't evicted from at every store)
+    def evict(self):
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                count = cursor.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+                if count > self.max_entries:
+                    keep = self.max_entries - int(self.max_entries * AnalysisCache.EVICTION_FRACTION)
+                    cursor.execute('DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY used '
+                                   'LIMIT ?)', (count - keep,))
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+    
+    # returns the action of the result stored for a search of the position max_depth deep (None if there is none)
+    # and sets context's root_best like the search would
+    def decision(self, chess_board, max_depth, max_player, context):
+        entry = self.lookup(chess_board, max_depth, max_player, AnalysisCache.settings(context))
+        if entry is None:
+            return None
+        move, value, depth, nodes = entry
+        context.root_best = (move, value)
+        return ChessBoard.move_to_action(move)
+    
+    # stores the result of context's last search of the position (depth deep, visiting nodes), the exact value and
+    # best move stored in its transposition table at that depth (nothing if the search stored none, like decisions
+    # of the tablebases or iterative deepening stopped before finishing the first depth)
+    def store_search(self, chess_board, depth, max_player, context, nodes):
+        if depth is None or depth < 1:
+            return
+        key = SearchContext.position_key(chess_board, max_player)
+        value, move = context.transposition_table.lookup(key, depth, -MinMax.INFINITY, MinMax.INFINITY)
+        if value is not None and move is not None:
+            self.store(chess_board, max_player, AnalysisCache.settings(context), move, value, depth, nodes)
+    
+    
+# a game of a game record file (see GameRecordWriter): the starting position (a FEN record, '' for the initial
+# position), the packed moves, the result ('1-0', '0-1', '1/2-1/2' or '*' for unfinished games), the settings
+# (a dictionary, e.g. the players' names and engine settings) and the search score (from the view of the player
+# who moved, None if unknown) and nodes of every move
+class GameRecord():
+    RESULTS = ['*', '1-0', '0-1', '1/2-1/2']
+    
+    def __init__(self, moves=None, result='*', settings=None, fen='', scores=None, nodes=None):
+        self.moves = moves if moves is not None else []
+        self.result = result
+        self.settings = settings if settings is not None else {}
+        self.fen = fen
+        self.scores = scores
+        self.nodes = nodes
+        
+    def new_board(self, backend='list'):
+        return new_chess_board(backend, self.fen if self.fen else None)
+    
+    # replays the game on a new board, yields (board, packed move) before every move, and the final board with None
+    # (the same board every time, played on between the steps)
+    def replay(self, backend='list'):
+        chess_board = self.new_board(backend)
+        for move in self.moves:
+            yield chess_board, move
+            play_moves(chess_board, [action_name(ChessBoard.move_to_action(move))])
+        yield chess_board, None
+        
+    # the game in Portable Game Notation, the moves in standard algebraic notation
+    # (with the moves' search scores and nodes as comments, if recorded)
+    def pgn(self, backend='list'):
+        tags = [('Event', self.settings.get('event', '?')), ('Site', '?'), ('Date', '????.??.??'),
+                ('Round', str(self.settings.get('round', '?'))), ('White', self.settings.get('white', '?')),
+                ('Black', self.settings.get('black', '?')), ('Result', self.result)]
+        if self.fen:
+            tags += [('SetUp', '1'), ('FEN', self.fen)]
+        
+        tokens = []
+        number = int(self.fen.split()[5]) if self.fen else 1
+        for index, (chess_board, move) in enumerate(self.replay(backend)):
+            if move is None:
+                break
+            if chess_board.turn == 'w':
+                tokens.append('%d.' % number)
+            elif index == 0:
+                tokens.append('%d...' % number)
+            tokens.append(move_san(chess_board, move))
+            if self.scores is not None and (self.scores[index] is not None or self.nodes[index]):
+                tokens.append('{%s/%d}' % ('?' if self.scores[index] is None else '%+.2f' % self.scores[index],
+                                           self.nodes[index]))
+            if chess_board.turn == 'b':
+                number += 1
+        tokens.append(self.result)
+        
+        lines = ['[%s "%s"]' % (name, value.replace('\\', '\\\\').replace('"', '\\"')) for name, value in tags]
+        lines.append('')
+        line = ''
+        for token in tokens:
+            if line and len(line) + 1 + len(token) > 79:
+                lines.append(line)
+                line = token
+            else:
+                line = line + ' ' + token if line else token
+        lines.append(line)
+        return '\n'.join(lines) + '\n'
+    
+    
+# writes game records: a file of games, appended one after another as they are played
+# the file is a header (MAGIC and VERSION), then every game is a RECORD header (result, flags, lengths of the
+# settings and starting position, number of moves), the settings (JSON), the starting position (FEN), the moves
+# and END_OF_MOVES, all little-endian
+# a move is its packed int (see ChessBoard.encode_move) in 16 bits, followed (with the SEARCH_INFO flag) by its
+# search score (32-bit float, NaN if unknown) and nodes (32 bits)
+# a game is written while it is played (start_game, then the moves observed on the board, then finish_game):
+# its number of moves and result are only filled in when it is finished, an unfinished game ends at the end of
+# its moves (or of the file) and has the result '*'
+class GameRecordWriter():
+    MAGIC = b'CHESSAIG'
+    VERSION = 1
+    HEADER = struct.Struct('<8sI4x')
+    RECORD = struct.Struct('<BBHHI')
+    MOVE = struct.Struct('<H')
+    SEARCH = struct.Struct('<fI')
+    # RECORD flags:
+    SEARCH_INFO = 1
+    END_OF_MOVES = 0xFFFF
+    UNKNOWN_MOVES = 0xFFFFFFFF
+    
+    # appends games to the file at path (created if needed), a file is written by one writer at a time
+    def __init__(self, path):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        # a game left unfinished (e.g. by a crash) is finished first (with the result '*'):
+        unfinished = None
+        if exists:
+            reader = GameRecordReader(path)
+            unfinished = reader.unfinished_game()
+            reader.close()
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self.file.write(GameRecordWriter.HEADER.pack(GameRecordWriter.MAGIC, GameRecordWriter.VERSION))
+        elif unfinished is not None:
+            offset, count, end = unfinished
+            self.file.truncate(end)
+            self.file.seek(end)
+            self.file.write(GameRecordWriter.MOVE.pack(GameRecordWriter.END_OF_MOVES))
+            self.file.seek(offset + GameRecordWriter.RECORD.size - 4)
+            self.file.write(struct.pack('<I', count))
+        self.chess_board = None
+        self.game_offset = None
+        
+    def close(self):
+        if self.game_offset is not None:
+            self.finish_game()
+        self.file.close()
+        
+    # starts writing a game from the position of chess_board, whose moves (played by play and apply_promotion)
+    # are written as they are played, with search_info every move has a search score and nodes (see annotate)
+    # settings is a dictionary stored with the game (e.g. {'white': ..., 'black': ...}, see GameRecord.pgn)
+    def start_game(self, chess_board, settings=None, search_info=False):
+        fen = chess_board.to_fen()
+        self.__start(fen if fen != ChessBoard().to_fen() else '', settings, search_info)
+        self.chess_board = chess_board
+        chess_board.observers.append(self.__observe)
+        
+    def __start(self, fen, settings, search_info):
+        if self.game_offset is not None:
+            self.finish_game()
+        self.settings = json.dumps(settings if settings is not None else {}).encode()
+        self.fen = fen.encode()
+        self.flags = GameRecordWriter.SEARCH_INFO if search_info else 0
+        self.moves_count = 0
+        self.pending = None
+        self.game_offset = self.file.seek(0, os.SEEK_END)
+        self.file.write(GameRecordWriter.RECORD.pack(0, self.flags, len(self.settings), len(self.fen),
+                                                     GameRecordWriter.UNKNOWN_MOVES))
+        self.file.write(self.settings)
+        self.file.write(self.fen)
+        
+    def __observe(self, chess_board, move):
+        self.add_move(move)
+        
+    # adds a move to the game (the moves of the board given to start_game are added when played)
+    # the last move is only written when the next one is added or the game finishes, so annotate can still
+    # set its search score and nodes
+    def add_move(self, move, score=None, nodes=0):
+        self.__write_pending()
+        self.pending = [move, score, nodes]
+        
+    # sets the search score (from the view of the player who moved, None if unknown) and nodes of the last move
+    def annotate(self, score, nodes):
+        if self.pending is not None:
+            self.pending[1:] = [score, nodes]
+        
+    def __write_pending(self):
+        if self.pending is None:
+            return
+        move, score, nodes = self.pending
+        self.file.write(GameRecordWriter.MOVE.pack(move))
+        if self.flags & GameRecordWriter.SEARCH_INFO:
+            self.file.write(GameRecordWriter.SEARCH.pack(float('nan') if score is None else score, nodes))
+        self.moves_count += 1
+        self.pending = None
+        
+    # ends the game with result ('1-0', '0-1', '1/2-1/2' or '*'), and fills its number of moves and result in
+    def finish_game(self, result='*'):
+        if self.game_offset is None:
+            raise Exception('ERROR: no game is being written')
+        if self.chess_board is not None:
+            self.chess_board.observers.remove(self.__observe)
+            self.chess_board = None
+        self.__write_pending()
+        self.file.write(GameRecordWriter.MOVE.pack(GameRecordWriter.END_OF_MOVES))
+        self.file.seek(self.game_offset)
+        self.file.write(GameRecordWriter.RECORD.pack(GameRecord.RESULTS.index(result), self.flags, len(self.settings),
+                                                     len(self.fen), self.moves_count))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+        self.game_offset = None
+        
+    # writes a whole game (GameRecord)
+    def write_game(self, record):
+        self.__start(record.fen, record.settings, record.scores is not None)
+        for index, move in enumerate(record.moves):
+            if record.scores is not None:
+                self.add_move(move, record.scores[index], record.nodes[index])
+            else:
+                self.add_move(move)
+        self.finish_game(record.result)
+    
+    
+# reads a game record file (see GameRecordWriter) through mmap, a game at a time, so files of any size
+# are read without loading them
+class GameRecordReader():
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < GameRecordWriter.HEADER.size:
+                raise Exception('ERROR: ' + path + ' is not a game record file')
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = GameRecordWriter.HEADER.unpack_from(self.data, 0)
+        if magic != GameRecordWriter.MAGIC or version != GameRecordWriter.VERSION:
+            raise Exception('ERROR: ' + path + ' is not a game record file')
+        
+    def close(self):
+        self.data.close()
+        
+    # yields (offset, result, settings, number of moves) of every game without reading the moves
+    # (those of unfinished games are counted)
+    def scan(self):
+        offset = GameRecordWriter.HEADER.size
+        while offset < len(self.data):
+            result, settings, fen, moves_offset, entry_size, count = self.__header(offset)
+            if count == GameRecordWriter.UNKNOWN_MOVES:
+                count = self.__count_moves(moves_offset, entry_size)
+            yield offset, GameRecord.RESULTS[result], settings, count
+            offset = min(moves_offset + count * entry_size + GameRecordWriter.MOVE.size, len(self.data))
+            
+    # yields every game (GameRecord)
+    def __iter__(self):
+        for offset, result, settings, count in self.scan():
+            yield self.read(offset)
+            
+    # the game (GameRecord) at offset (as given by scan)
+    def read(self, offset):
+        result, settings, fen, offset, entry_size, count = self.__header(offset)
+        if count == GameRecordWriter.UNKNOWN_MOVES:
+            count = self.__count_moves(offset, entry_size)
+        search_info = entry_size > GameRecordWriter.MOVE.size
+        record = GameRecord([], GameRecord.RESULTS[result], settings, fen, [] if search_info else None,
+                            [] if search_info else None)
+        for index in range(count):
+            record.moves.append(GameRecordWriter.MOVE.unpack_from(self.data, offset)[0])
+            if search_info:
+                score, nodes = GameRecordWriter.SEARCH.unpack_from(self.data, offset + GameRecordWriter.MOVE.size)
+                record.scores.append(None if score != score else score) # NaN: unknown
+                record.nodes.append(nodes)
+            offset += entry_size
+        return record
+    
+    # (result, settings, FEN, offset of the moves, size of a move, number of moves) of the game at offset
+    def __header(self, offset):
+        result, flags, settings_length, fen_length, count = GameRecordWriter.RECORD.unpack_from(self.data, offset)
+        offset += GameRecordWriter.RECORD.size
+        settings = json.loads(self.data[offset:offset + settings_length].decode())
+        offset += settings_length
+        fen = self.data[offset:offset + fen_length].decode()
+        offset += fen_length
+        entry_size = GameRecordWriter.MOVE.size
+        if flags & GameRecordWriter.SEARCH_INFO:
+            entry_size += GameRecordWriter.SEARCH.size
+        return result, settings, fen, offset, entry_size, count
+    
+    # (offset, number of moves, end of the last whole move) of the file's last game if it is unfinished, else None
+    def unfinished_game(self):
+        last = None
+        for last in self.scan():
+            pass
+        if last is None:
+            return None
+        result, settings, fen, moves_offset, entry_size, count = self.__header(last[0])
+        if count != GameRecordWriter.UNKNOWN_MOVES:
+            return None
+        return last[0], last[3], moves_offset + last[3] * entry_size
+    
+    # the number of whole moves of an unfinished game, up to END_OF_MOVES or the end of the file
+    def __count_moves(self, offset, entry_size):
+        count = 0
+        while (offset + entry_size <= len(self.data)
+               and GameRecordWriter.MOVE.unpack_from(self.data, offset)[0] != GameRecordWriter.END_OF_MOVES):
+            count += 1
+            offset += entry_size
+        return count
+    
+    
+# writes an action (start, target, promotion) like 'E2E4' or 'E7E8Q'
+def action_name(action):
+    start, target, promotion = action
+    return start + target + (promotion if promotion is not None else '')
+
+# writes a legal move (packed) of chess_board in standard algebraic notation, like Nbd2, exd5, O-O, e8=Q+ or Qh7#
+def move_san(chess_board, move):
+    start, target, promotion = ChessBoard.decode_move(move)
+    piece = chess_board.piece_at(start[0], start[1])
+    target_name = POSITION_NAMES[target[0]][target[1]].lower()
+    capture = chess_board.piece_at(target[0], target[1]) != '.'
+    if piece[1] == 'K' and abs(target[1] - start[1]) == 2:
+        san = 'O-O' if target[1] > start[1] else 'O-O-O'
+    elif piece[1] == 'P':
+        san = (POSITION_NAMES[0][start[1]][0].lower() + 'x' if capture else '') + target_name
+        if promotion is not None:
+            san += '=' + promotion
+    else:
+        # the start's column, row or both tell the move apart from the same piece's moves to the same position:
+        others = [ChessBoard.decode_move(other)[0] for other in chess_board.legal_moves()
+                  if other != move and (other >> 6) & 63 == (move >> 6) & 63
+                  and chess_board.piece_at(*ChessBoard.decode_move(other)[0]) == piece]
+        name = POSITION_NAMES[start[0]][start[1]].lower()
+        if not others:
+            san = piece[1]
+        elif all(other[1] != start[1] for other in others):
+            san = piece[1] + name[0]
+        elif all(other[0] != start[0] for other in others):
+            san = piece[1] + name[1]
+        else:
+            san = piece[1] + name
+        san += ('x' if capture else '') + target_name
+    
+    chess_board.push(move)
+    if chess_board.in_check():
+        san += '+' if chess_board.has_legal_move() else '#'
+    chess_board.pop()
+    return san
+
+# plays moves written like 'E2E4' (or 'E7E8Q' with a promotion, a queen if not given) on chess_board
+def play_moves(chess_board, moves):
+    for move in moves:
+        status = chess_board.play(move[0:2].upper(), move[2:4].upper())
+        if status == GameStatus.AWAITING_PROMOTION:
+            status = chess_board.apply_promotion(move[4:5] if len(move) > 4 else 'Q')
+        if status != GameStatus.VALID_MOVE:
+            raise Exception('ERROR: ' + move + ' can not be played (' + str(status) + ')')
+
+# plays the AI's move
+# the move of the context's opening book is played if the position is in the book, otherwise
+# with a time_limit (seconds) or node_limit, the search deepens iteratively up to max_depth (None for no
+# depth limit) and plays the best move found when the budget runs out
+# otherwise the search is max_depth deep, on the worker processes of parallel (ParallelSearch) if given
+# with the context's analysis cache, a stored result at least max_depth deep is played without searching,
+# and the results of searches are stored
+# returns the action played
+def AI_play(chess_board, max_depth, max_player, context=None, time_limit=None, node_limit=None, parallel=None):
+    action = None
+    if context is not None and context.opening_book is not None:
+        action = context.opening_book.choose(chess_board)
+    cache = context.analysis_cache if context is not None else None
+    if action is None and cache is not None and max_depth is not None:
+        action = cache.decision(chess_board, max_depth, max_player, context)
+        
+    if action is None:
+        nodes = MinMax.nodes
+        if time_limit is not None or node_limit is not None:
+            action = MinMax.iterative_deepening(chess_board, max_player, max_depth, time_limit, node_limit, context)
+        elif parallel is not None:
+            action = parallel.alpha_beta_decision(chess_board, max_depth, max_player, context)
+        else:
+            action = MinMax.alpha_beta_decision(chess_board, max_depth, max_player, context)
+        if cache is not None:
+            # iterative deepening stores the result of every depth it finished
+            limited = time_limit is not None or node_limit is not None
+            cache.store_search(chess_board, context.completed_depth if limited else max_depth, max_player, context,
+                               MinMax.nodes - nodes)
+    start, target, promotion = action
+    status = chess_board.play(start, target)
+    if status == GameStatus.AWAITING_PROMOTION:
+        chess_board.apply_promotion(promotion)
+    return action
+
+# searches the same position with every board backend and prints the speed of each
+# returns {backend name: (chosen action, nodes per second)}
+def compare_backends(chess_board, max_depth, max_player):
+    results = {}
+    for name, board_class in BOARD_BACKENDS.items():
+        MinMax.nodes = 0
+        start_time = time.perf_counter()
+        action = MinMax.alpha_beta_decision(board_class(chess_board), max_depth, max_player)
+        elapsed = time.perf_counter() - start_time
+        
+        results[name] = (action, MinMax.nodes / elapsed if elapsed > 0 else 0)
+        print(name, action, MinMax.nodes, 'nodes', round(results[name][1]), 'nodes/sec')
+        
+    return results
+
+# searches the same position (iterative deepening to max_depth) with no search features, each one alone
+# and all of them, and prints the nodes each needs
+# returns {feature names: (chosen action, nodes)}
+def compare_search_features(chess_board, max_depth, max_player):
+    results = {}
+    for names in [()] + [(name,) for name in SearchFeatures.NAMES] + [SearchFeatures.NAMES]:
+        context = SearchContext(features=SearchFeatures.from_names(names))
+        MinMax.nodes = 0
+        action = MinMax.iterative_deepening(chess_board, max_player, max_depth, context=context)
+        
+        results[names] = (action, MinMax.nodes)
+        print(', '.join(names) if names else 'plain', action, MinMax.nodes, 'nodes')
+        
+    return results
+
+# searches the same position with node- and time-limited searches and then a fixed-depth one on a single context,
+# like an AI switching between budgets, and the fixed-depth search again on a fresh context
+# (the limited searches stay shallower than max_depth, so the table holds no deeper values and both find the same)
+# raises an exception if the values differ, returns (value with the kept context, value with a fresh one)
+def compare_search_budgets(chess_board, max_depth, max_player, node_limit=300):
+    context = SearchContext()
+    MinMax.iterative_deepening(chess_board, max_player, max_depth - 1, node_limit=node_limit, context=context)
+    MinMax.iterative_deepening(chess_board, max_player, max_depth - 1, time_limit=0, context=context)
+    MinMax.alpha_beta_decision(chess_board, max_depth, max_player, context)
+    fresh_context = SearchContext()
+    MinMax.alpha_beta_decision(chess_board, max_depth, max_player, fresh_context)
+    kept, fresh = context.root_best[1], fresh_context.root_best[1]
+    print('after limited searches', kept, 'fresh', fresh)
+    
+    if kept != fresh:
+        raise Exception('ERROR: the search after limited searches found ' + str(kept) + ' instead of ' + str(fresh))
+    return kept, fresh
+
+# searches the same position serially and with a ParallelSearch of the given number of workers
+# prints the time of each and the parallel speedup (the parallel time includes starting the workers)
+# returns (serial action, parallel action, speedup)
+def compare_parallel(chess_board, max_depth, max_player, workers=None):
+    MinMax.nodes = 0
+    start_time = time.perf_counter()
+    serial_action = MinMax.alpha_beta_decision(chess_board, max_depth, max_player, SearchContext())
+    serial_time = time.perf_counter() - start_time
+    print('serial', serial_action, MinMax.nodes, 'nodes', round(serial_time, 3), 'sec')
+    
+    with ParallelSearch(workers) as parallel:
+        parallel_action = parallel.alpha_beta_decision(chess_board, max_depth, max_player)
+    speedup = serial_time / parallel.elapsed if parallel.elapsed > 0 else 0
+    print('parallel', parallel.workers, 'workers', parallel_action, parallel.nodes, 'nodes',
+          round(parallel.elapsed, 3), 'sec', 'speedup', round(speedup, 2))
+    
+    if serial_action != parallel_action:
+        raise Exception('ERROR: parallel search chose ' + str(parallel_action) + ' instead of ' + str(serial_action))
+    return serial_action, parallel_action, speedup
+
+# clear terminal
+def clear_terminal():
+    os.system('cls' if os.name=='nt' else 'clear')
 
 # clears screen and prints chess board
 # returns game status
@@ -600,19 +3435,61 @@ def print_board(chess_board):
         
     return status
 
-def play_two_AIs(chess_board):
-    while True:
-        # the more powerful one, with depth 3 prediction
-        AI_play(chess_board, 3, 'w')
-        status = print_board(chess_board)
-        if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
-            break
+# starts recording the game of chess_board in the game record file at path (None for no record)
+# returns the GameRecordWriter, None without a path
+def start_record(chess_board, path, white, black):
+    if path is None:
+        return None
+    writer = GameRecordWriter(path)
+    writer.start_game(chess_board, {'white': white, 'black': black}, search_info=True)
+    return writer
 
-        # the weaker AI, predicts 2 levels deep
-        AI_play(chess_board, 2, 'b')
-        status = print_board(chess_board)
-        if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
-            break
+# plays the AI's move like AI_play, and records its search score and nodes with writer (if not None)
+def recorded_AI_play(chess_board, max_depth, max_player, context, writer, parallel=None):
+    MinMax.nodes = 0
+    context.root_best = None # stays None for the opening book's moves
+    AI_play(chess_board, max_depth, max_player, context, parallel=parallel)
+    if writer is not None:
+        writer.annotate(context.root_best[1] if context.root_best is not None else None, MinMax.nodes)
+
+# the result of the game of chess_board: '1-0', '0-1', '1/2-1/2', or '*' while it goes on
+def game_result(chess_board):
+    status = chess_board.get_game_status()
+    if status == GameStatus.CHECKMATE:
+        return '0-1' if chess_board.turn == 'w' else '1-0'
+    if status == GameStatus.STALEMATE:
+        return '1/2-1/2'
+    return '*'
+
+# finishes the game's record (if writer is not None) with its result
+def finish_record(chess_board, writer):
+    if writer is not None:
+        writer.finish_game(game_result(chess_board))
+        writer.close()
+
+# by default the more powerful AI (depth 3 prediction) plays white and the weaker one (depth 2) black
+# (see tournament.py for playing many games between other settings without the board printed)
+def play_two_AIs(chess_board, white_depth=3, black_depth=2, record=None, cache=None):
+    # each AI keeps its own search state between moves, the analysis cache (a file) is shared
+    analysis_cache = AnalysisCache(cache) if cache is not None else None
+    white_context = SearchContext(analysis_cache=analysis_cache)
+    black_context = SearchContext(analysis_cache=analysis_cache)
+    writer = start_record(chess_board, record, 'ChessAI depth %d' % white_depth, 'ChessAI depth %d' % black_depth)
+    try:
+        while True:
+            recorded_AI_play(chess_board, white_depth, 'w', white_context, writer)
+            status = print_board(chess_board)
+            if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
+                break
+
+            recorded_AI_play(chess_board, black_depth, 'b', black_context, writer)
+            status = print_board(chess_board)
+            if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
+                break
+    finally:
+        finish_record(chess_board, writer)
+        if analysis_cache is not None:
+            analysis_cache.close()
 
 def user_play(chess_board):
     while True:
@@ -649,58 +3526,123 @@ def two_player_mode(chess_board):
             break
     
     
-def play_with_AI(chess_board, max_player, AI_DEPTH):
-    print_board(chess_board)
-    # if AI is first do the first move
-    if max_player == 'w':
-        print('AI is thinking...')
-        AI_play(chess_board, AI_DEPTH, max_player)
+# with workers > 1, the AI searches on that many processes (see ParallelSearch)
+def play_with_AI(chess_board, max_player, AI_DEPTH, workers=1, opening_book=None, tablebases=None, record=None,
+                 cache=None):
+    # AI's search state, kept between its moves
+    context = SearchContext(opening_book=OpeningBook(opening_book) if opening_book is not None else None,
+                            tablebases=Tablebases(tablebases) if tablebases is not None else None,
+                            analysis_cache=AnalysisCache(cache) if cache is not None else None)
+    parallel = ParallelSearch(workers, tablebases=context.tablebases) if workers > 1 else None
+    AI_name = 'ChessAI depth %d' % AI_DEPTH
+    writer = start_record(chess_board, record, *((AI_name, 'player') if max_player == 'w' else ('player', AI_name)))
+    
+    try:
         print_board(chess_board)
+        # if AI is first do the first move
+        if max_player == 'w':
+            print('AI is thinking...')
+            recorded_AI_play(chess_board, AI_DEPTH, max_player, context, writer, parallel)
+            print_board(chess_board)
+            
+        while True:
+            user_play(chess_board)
+            status = print_board(chess_board)
+            if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
+                break
         
-    while True:
-        user_play(chess_board)
-        status = print_board(chess_board)
-        if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
-            break
-    
-        print('Thinking...')
-        AI_play(chess_board, AI_DEPTH, max_player)
-        status = print_board(chess_board)
-        if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
-            break
+            print('Thinking...')
+            recorded_AI_play(chess_board, AI_DEPTH, max_player, context, writer, parallel)
+            status = print_board(chess_board)
+            if status == GameStatus.CHECKMATE or status == GameStatus.STALEMATE:
+                break
+    finally:
+        finish_record(chess_board, writer)
+        if parallel is not None:
+            parallel.close()
+        if context.opening_book is not None:
+            context.opening_book.close()
+        if context.tablebases is not None:
+            context.tablebases.close()
+        if context.analysis_cache is not None:
+            context.analysis_cache.close()
     
     
-# create chess_board
-chess_board = ChessBoard()
-
-# uncomment to let two AIs play with each other
-# play_two_AIs(chess_board)
+# the defaults of the game's command line options:
+# the board backend used for the game, see BOARD_BACKENDS
+BOARD_BACKEND = 'list'
 
 # the depth of decision tree
 # the more this number, the more powerful the AI becomes
 # but it taked exponentially longer time to play
 AI_DEPTH = 3
 
-while True:
-    players = input('1 player or 2 players? [1, 2]:')
+# the number of processes searching the AI's moves
+AI_WORKERS = 1
+
+# the opening book file (built with opening_book.py) the AI plays its first moves from, None for no book
+OPENING_BOOK = None
+
+# the directory of the endgame tablebases (built with tablebase.py) the AI probes, None for no tablebases
+TABLEBASES = None
+
+# the game record file the games against the AI are appended to, None for no records
+GAME_RECORDS = None
+
+# the analysis cache file the AI reuses the results of earlier searches from (and stores its own in), None for no cache
+ANALYSIS_CACHE = None
+
+
+# the game in the terminal: one player against the AI, two players, or two AIs against each other
+# (see uci.py for playing through a chess GUI)
+def main():
+    parser = argparse.ArgumentParser(description='Plays chess in the terminal against the AI or another player.')
+    parser.add_argument('--players', choices=['0', '1', '2'], help='number of players, 0 lets two AIs play '
+                        '(asked if not given)')
+    parser.add_argument('--color', choices=['w', 'b'], help="the player's color against the AI (asked if not given)")
+    parser.add_argument('--depth', type=int, default=AI_DEPTH, help="the AI's search depth")
+    parser.add_argument('--workers', type=int, default=AI_WORKERS, help="processes searching the AI's moves")
+    parser.add_argument('--backend', default=BOARD_BACKEND, choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--fen', help='position to start from (the initial position if not given)')
+    parser.add_argument('--book', default=OPENING_BOOK, help='opening book file (see opening_book.py)')
+    parser.add_argument('--tablebases', default=TABLEBASES, help='endgame tablebases directory (see tablebase.py)')
+    parser.add_argument('--record', default=GAME_RECORDS, help='game record file the games are appended to '
+                        '(see game_records.py)')
+    parser.add_argument('--cache', default=ANALYSIS_CACHE, help='analysis cache file of the search results '
+                        '(created if missing)')
+    args = parser.parse_args()
+
+    while True:
+        players = args.players if args.players is not None else input('1 player or 2 players? [1, 2]:')
+        # every game starts from a new board
+        chess_board = new_chess_board(args.backend, args.fen)
     
-    if players == '1':
-        while True:
-            color = input('choose your color [b, w]:')
-            if color == 'w':
-                max_player = 'b'
-                break
-            if color == 'b':
-                max_player = 'w'
-                break
-            print('choose again')
+        if players == '0':
+            play_two_AIs(chess_board, args.depth, args.depth, args.record, args.cache)
+            
+        if players == '1':
+            color = args.color
+            while color not in ('w', 'b'):
+                color = input('choose your color [b, w]:')
+                if color not in ('w', 'b'):
+                    print('choose again')
+            max_player = 'b' if color == 'w' else 'w'
             
-        play_with_AI(chess_board, max_player, AI_DEPTH)
+            play_with_AI(chess_board, max_player, args.depth, args.workers, args.book, args.tablebases, args.record,
+                         args.cache)
             
-    if players == '2':
-        two_player_mode(chess_board)
+        if players == '2':
+            two_player_mode(chess_board)
         
-    print('choose again')    
+        if args.players is not None:
+            break
+        print('choose again')    
+
+
+# the game runs only when this file is run as a program
+# (importing it, e.g. by the worker processes of ParallelSearch or the tools, only defines the engine)
+if __name__ == '__main__':
+    main()
 
 
 
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# batch position analyzer: searches every position of an EPD file on worker processes
+# and writes the positions back with the best move and score, in the input's order, as they are analyzed
+# the written operations are bm (best move, written like E2E4), ce (score of the side to move in hundredths
+# of a pawn), acd (depth), acn (nodes) and acs (seconds), the other operations of the input (e.g. id) are kept
+# with --cache, positions found in the analysis cache (ChessAI.AnalysisCache) at least --depth deep are not searched
+# again (acd and acn are those of the stored search), and the results of the searches are stored there
+#
+# example: python3 analyze.py positions.epd --depth 3 --workers 4 --output analyzed.epd
+#          python3 analyze.py positions.epd --depth 4 --cache analysis.db
+
+import argparse
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ChessAI import AnalysisCache, BOARD_BACKENDS, ChessBoard, MinMax, SearchContext, SearchFeatures, action_name, \
+    new_chess_board
+
+# operations written by the analyzer, replaced if the input has them:
+ANALYSIS_OPERATIONS = ('bm', 'ce', 'acd', 'acn', 'acs')
+
+
+# splits an EPD line into the position (its first 4 fields) and the list of its (opcode, operand) operations
+def parse_epd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise Exception('ERROR: invalid EPD, 4 position fields are required: ' + line)
+    operations = re.findall(r'\s*(\w+)\s*((?:"[^"]*"|[^;])*);', fields[4] if len(fields) > 4 else '')
+    return ' '.join(fields[:4]), [(opcode, operand.strip()) for opcode, operand in operations]
+
+# writes an EPD line of the position and operations
+def format_epd(position, operations):
+    return ' '.join([position] + [opcode + (' ' + operand if operand else '') + ';' for opcode, operand in operations])
+
+
+# the analysis caches of a worker process by path, opened by its first position
+_caches = {}
+
+
+# searches a position (the first fields of a FEN record) like AI_play would
+# with time_limit or node_limit the search deepens iteratively up to depth, otherwise it is depth deep
+# with cache (an analysis cache path), a stored result at least depth deep is returned instead, and the result
+# of the search is stored
+# returns (best action or None without legal moves, score of the side to move, depth, nodes, seconds)
+def analyze_position(position, depth, time_limit=None, node_limit=None, features=(), backend='list', cache=None):
+    chess_board = new_chess_board(backend, position)
+    max_player = chess_board.turn
+    context = SearchContext(features=SearchFeatures.from_names(features))
+    MinMax.nodes = 0
+    start_time = time.perf_counter()
+
+    if cache is not None:
+        if cache not in _caches:
+            _caches[cache] = AnalysisCache(cache)
+        cache = _caches[cache]
+        entry = cache.lookup(chess_board, depth, max_player, AnalysisCache.settings(context))
+        if entry is not None:
+            move, score, cached_depth, nodes = entry
+            return ChessBoard.move_to_action(move), score, cached_depth, nodes, time.perf_counter() - start_time
+
+    if time_limit is not None or node_limit is not None:
+        action = MinMax.iterative_deepening(chess_board, max_player, depth, time_limit, node_limit, context)
+        depth = context.completed_depth
+    else:
+        action = MinMax.alpha_beta_decision(chess_board, depth, max_player, context)
+
+    if action is None:
+        score = chess_board.no_moves_utility(max_player)
+        depth = 0
+    elif context.root_best is not None:
+        score = context.root_best[1]
+    else: # the budget ran out before any move was searched
+        score = None
+    if cache is not None:
+        cache.store_search(chess_board, depth, max_player, context, MinMax.nodes)
+    return action, score, depth, MinMax.nodes, time.perf_counter() - start_time
+
+
+# analyzes the EPD lines (an iterable, read as needed) on workers processes and writes the analyzed lines
+# to output in the same order, at most 2 * workers positions are waiting to be written at a time
+# prints positions/sec to report (every report_every positions and at the end), returns the number of positions
+def analyze_epd(lines, output, depth=3, time_limit=None, node_limit=None, features=(), backend='list',
+                workers=None, report=sys.stderr, report_every=100, cache=None):
+    workers = workers if workers is not None else os.cpu_count()
+    start_time = time.perf_counter()
+    analyzed = 0
+
+    pending = deque()
+
+    def report_speed():
+        elapsed = time.perf_counter() - start_time
+        report.write('%d positions, %.1f sec, %.2f positions/sec\n' % (analyzed, elapsed, analyzed / elapsed if elapsed > 0 else 0))
+
+    # waits for the oldest pending position and writes it:
+    def write_next():
+        nonlocal analyzed
+        position, operations, future = pending.popleft()
+        action, score, reached_depth, nodes, seconds = future.result()
+
+        operations = [(opcode, operand) for opcode, operand in operations if opcode not in ANALYSIS_OPERATIONS]
+        if action is not None:
+            operations.append(('bm', action_name(action)))
+        if score is not None:
+            operations.append(('ce', str(round(score * 100))))
+        operations += [('acd', str(reached_depth)), ('acn', str(nodes)), ('acs', '%.3f' % seconds)]
+        output.write(format_epd(position, operations) + '\n')
+        output.flush()
+
+        analyzed += 1
+        if analyzed % report_every == 0:
+            report_speed()
+
+    with ProcessPoolExecutor(workers) as executor:
+        for line in lines:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            position, operations = parse_epd(line)
+            future = executor.submit(analyze_position, position, depth, time_limit, node_limit, tuple(features),
+                                     backend, cache)
+            pending.append((position, operations, future))
+            if len(pending) >= 2 * workers:
+                write_next()
+
+        while pending:
+            write_next()
+
+    report_speed()
+    return analyzed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Searches every position of an EPD file and writes them back '
+                                     'with the best move and score.')
+    parser.add_argument('epd', help="EPD file ('-' for the standard input)")
+    parser.add_argument('--output', help='file to write the analyzed positions to (the standard output if not given)')
+    parser.add_argument('--depth', type=int, default=3, help='search depth (the maximal one with --time or --nodes)')
+    parser.add_argument('--time', type=float, help='seconds per position')
+    parser.add_argument('--nodes', type=int, help='nodes per position')
+    parser.add_argument('--features', default='', help='search features, like pvs+null_move')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of analyzing processes')
+    parser.add_argument('--cache', help='analysis cache file of the search results (created if missing)')
+    parser.add_argument('--report-every', type=int, default=100, help='positions between speed reports')
+    args = parser.parse_args()
+
+    features = [feature for feature in args.features.split('+') if feature]
+    SearchFeatures.from_names(features) # checks the names before starting the workers
+    if args.cache:
+        AnalysisCache(args.cache).close() # creates the cache before the workers open it
+    epd = sys.stdin if args.epd == '-' else open(args.epd)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        analyze_epd(epd, output, args.depth, args.time, args.nodes, features, args.backend, args.workers,
+                    report_every=args.report_every, cache=args.cache)
+    finally:
+        if epd is not sys.stdin:
+            epd.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
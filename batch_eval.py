@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# batch evaluation benchmark: the material and piece-square balances of many positions computed one board at a time
+# (ChessBoard.refresh_evaluation, looping over the pieces in Python) and in batches with NumPy (BatchEvaluator)
+# the positions are the sibling leaves of positions from random games, the batches' balances are checked to be
+# exactly the scalar ones, and the positions/sec of every batch size are printed (with and without encoding
+# the boards as arrays of piece codes)
+#
+# example: python3 batch_eval.py --positions 20000 --batch-sizes 1 16 256 4096
+#          python3 batch_eval.py --backend bitboard --piece-square-coef 0.01
+
+import argparse
+import random
+import time
+
+from ChessAI import BOARD_BACKENDS, BatchEvaluator, HeuristicScores, new_chess_board
+
+
+# count positions: the children of the positions of random games (played with seed), as sibling groups
+def sibling_positions(count, backend='list', seed=0):
+    generator = random.Random(seed)
+    groups = []
+    total = 0
+    while total < count:
+        chess_board = new_chess_board(backend)
+        for ply in range(generator.randrange(10, 80)):
+            moves = chess_board.legal_moves()
+            if len(moves) == 0 or total >= count:
+                break
+            children = []
+            for move in moves[:count - total]:
+                child = type(chess_board)(chess_board)
+                child.push(move)
+                children.append(child)
+            groups.append(children)
+            total += len(children)
+            chess_board.push(generator.choice(moves))
+    return groups
+
+
+# seconds taken by function(), the fastest of repeat runs
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the positions/sec of the scalar and NumPy batch '
+                                     'material and piece-square evaluation, at several batch sizes.')
+    parser.add_argument('--positions', type=int, default=20000, help='positions to evaluate')
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=[1, 8, 32, 128, 1024, 8192],
+                        help='positions per batch')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--piece-square-coef', type=float, default=HeuristicScores.PIECE_SQUARE_COEF,
+                        help='HeuristicScores.PIECE_SQUARE_COEF')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every measure (the fastest is kept)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random games')
+    args = parser.parse_args()
+
+    HeuristicScores.PIECE_SQUARE_COEF = args.piece_square_coef
+    groups = sibling_positions(args.positions, args.backend, args.seed)
+    chess_boards = [child for children in groups for child in children]
+    evaluator = BatchEvaluator()
+
+    # the batches' balances must be the scalar evaluator's, from scratch and as updated by the moves:
+    codes = BatchEvaluator.encode(chess_boards)
+    batch_balances = evaluator.static_balances(codes).tolist()
+    incremental = [chess_board.static_balance() for chess_board in chess_boards]
+    for chess_board in chess_boards:
+        chess_board.refresh_evaluation()
+    scalar = [chess_board.static_balance() for chess_board in chess_boards]
+    if batch_balances != scalar or scalar != incremental:
+        raise Exception('ERROR: the batch balances differ from the scalar ones')
+    print('%d positions (%d sibling groups), balances identical' % (len(chess_boards), len(groups)))
+
+    def evaluate_scalar():
+        for chess_board in chess_boards:
+            chess_board.refresh_evaluation()
+            chess_board.static_balance()
+
+    elapsed = best_time(evaluate_scalar, args.repeat)
+    print('%-22s %12.0f positions/sec' % ('scalar', len(chess_boards) / elapsed))
+
+    for batch_size in args.batch_sizes:
+        batches = [chess_boards[index:index + batch_size] for index in range(0, len(chess_boards), batch_size)]
+        encoded = [BatchEvaluator.encode(batch) for batch in batches]
+
+        def evaluate_encoded():
+            for batch in encoded:
+                evaluator.static_balances(batch)
+
+        def evaluate_boards():
+            for batch in batches:
+                evaluator.static_balances(BatchEvaluator.encode(batch))
+
+        evaluated = best_time(evaluate_encoded, args.repeat)
+        encoded_and_evaluated = best_time(evaluate_boards, args.repeat)
+        print('batch %-16d %12.0f positions/sec, %12.0f with encoding' % (
+            batch_size, len(chess_boards) / evaluated, len(chess_boards) / encoded_and_evaluated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# search benchmark: a fixed set of opening, middlegame and endgame positions searched at fixed depths
+# records the wall time, nodes, nodes/sec, peak memory (RSS) and chosen move of every position
+# the results can be saved as a JSON baseline, and compared with one: the comparison fails when the nodes/sec
+# of a position regress beyond the threshold or a chosen move changes
+#
+# example: python3 benchmark.py --save baseline.json
+#          python3 benchmark.py --compare baseline.json --threshold 0.1
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+from ChessAI import BOARD_BACKENDS, MinMax, SearchContext, SearchFeatures, action_name, new_chess_board
+
+
+# (name, FEN, search depth)
+POSITIONS = [
+    ('opening: initial position', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', 4),
+    ('opening: open game', 'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 1', 4),
+    ('middlegame: italian', 'r2q1rk1/bpp2ppp/p1np1n2/4p3/PPB1P1b1/2PP1N2/3N1PPP/R1BQ1RK1 w - - 0 1', 4),
+    ("middlegame: queen's gambit declined", 'r1bq1rk1/pp1nbppp/2p1p3/3n2B1/2BP4/2N1PN2/PP3PPP/2RQK2R w K - 0 1', 4),
+    ('endgame: rook against pawns', '8/8/p7/8/6k1/6P1/2K5/r7 w - - 0 1', 6),
+    ('endgame: knight and pawns', '5k2/5P2/n6p/7P/p7/2K5/8/8 b - - 0 1', 6),
+]
+
+
+# peak memory (RSS) of this process in kilobytes, None where it can't be measured
+def peak_rss_kilobytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak # bytes on macOS, kilobytes elsewhere
+
+
+# searches a position of POSITIONS (in a fresh process, so its peak RSS is its own)
+# the fastest of repeat searches (each with a new transposition table) is recorded
+def run_position(index, backend, features, repeat):
+    name, fen, depth = POSITIONS[index]
+    chess_board = new_chess_board(backend, fen)
+
+    best = None
+    for i in range(repeat):
+        context = SearchContext(features=SearchFeatures.from_names(features))
+        MinMax.nodes = 0
+        start_time = time.perf_counter()
+        action = MinMax.alpha_beta_decision(chess_board, depth, chess_board.turn, context)
+        elapsed = time.perf_counter() - start_time
+        if best is None or elapsed < best['seconds']:
+            best = {'name': name, 'depth': depth, 'move': action_name(action), 'nodes': MinMax.nodes,
+                    'seconds': elapsed, 'nodes_per_second': MinMax.nodes / elapsed if elapsed > 0 else 0}
+    best['peak_rss_kb'] = peak_rss_kilobytes()
+    return best
+
+
+# runs every position, one after another, and returns the results
+def run_benchmark(backend='list', features=(), repeat=1, output=print):
+    results = []
+    # a new process for every position:
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for index in range(len(POSITIONS)):
+            result = pool.apply(run_position, (index, backend, tuple(features), repeat))
+            results.append(result)
+            output('%-40s depth %d  %-6s %8d nodes %8.3f sec %7d nodes/sec %s' % (
+                result['name'], result['depth'], result['move'], result['nodes'], result['seconds'],
+                result['nodes_per_second'], '%d KB' % result['peak_rss_kb'] if result['peak_rss_kb'] else ''))
+
+    nodes = sum(result['nodes'] for result in results)
+    seconds = sum(result['seconds'] for result in results)
+    return {'backend': backend, 'features': list(features), 'python': platform.python_version(),
+            'positions': results,
+            'total': {'nodes': nodes, 'seconds': seconds, 'nodes_per_second': nodes / seconds if seconds > 0 else 0}}
+
+
+# compares results with a baseline (both as returned by run_benchmark)
+# returns the list of failures: positions whose nodes/sec fell more than threshold (a fraction) below the
+# baseline's, and changed moves (unless allow_move_changes)
+def compare_results(results, baseline, threshold=0.1, allow_move_changes=False, output=print):
+    failures = []
+    for key in ('backend', 'features'):
+        if results[key] != baseline[key]:
+            output('note: %s is %s, the baseline has %s' % (key, results[key], baseline[key]))
+    baseline_positions = {position['name']: position for position in baseline['positions']}
+    for result in results['positions']:
+        base = baseline_positions.get(result['name'])
+        if base is None:
+            output('%-40s not in the baseline' % result['name'])
+            continue
+        if base['depth'] != result['depth']:
+            failures.append(result['name'] + ': searched at depth ' + str(result['depth']) + ' instead of ' +
+                            str(base['depth']))
+            continue
+
+        change = result['nodes_per_second'] / base['nodes_per_second'] - 1 if base['nodes_per_second'] > 0 else 0
+        output('%-40s %+6.1f%% nodes/sec  %+6.1f%% nodes  move %s%s' % (
+            result['name'], 100 * change, 100 * (result['nodes'] / base['nodes'] - 1) if base['nodes'] > 0 else 0,
+            result['move'], '' if result['move'] == base['move'] else ' (was ' + base['move'] + ')'))
+        if change < -threshold:
+            failures.append('%s: %.1f%% slower (%d instead of %d nodes/sec)' % (
+                result['name'], -100 * change, result['nodes_per_second'], base['nodes_per_second']))
+        if result['move'] != base['move'] and not allow_move_changes:
+            failures.append(result['name'] + ': chose ' + result['move'] + ' instead of ' + base['move'])
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Searches a fixed set of positions at fixed depths and records '
+                                     'the time, nodes, nodes/sec, peak memory and chosen move of each.')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--features', default='', help='search features, like pvs+null_move')
+    parser.add_argument('--repeat', type=int, default=1, help='searches of every position, the fastest is recorded')
+    parser.add_argument('--save', help='file to write the results to (a baseline)')
+    parser.add_argument('--compare', help='baseline file to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction of nodes/sec a position may lose against the baseline')
+    parser.add_argument('--allow-move-changes', action='store_true', help="don't fail when a chosen move changes")
+    args = parser.parse_args()
+
+    features = [feature for feature in args.features.split('+') if feature]
+    results = run_benchmark(args.backend, features, args.repeat)
+    total = results['total']
+    print('total: %d nodes, %.3f sec, %d nodes/sec' % (total['nodes'], total['seconds'], total['nodes_per_second']))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print()
+        failures = compare_results(results, baseline, args.threshold, args.allow_move_changes)
+        if failures:
+            print()
+            for failure in failures:
+                print('FAILED:', failure)
+            sys.exit(1)
+        print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
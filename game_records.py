@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# game record files (see ChessAI.GameRecordWriter, written by ChessAI.py --record and tournament.py --record):
+# lists the games of a file (scanning it through mmap, without reading the moves), replays them to check every
+# move and result, and exports them as PGN
+#
+# example: python3 game_records.py games.rec
+#          python3 game_records.py games.rec --replay
+#          python3 game_records.py games.rec --pgn games.pgn --games 1 2
+
+import argparse
+import sys
+import time
+
+from ChessAI import BOARD_BACKENDS, GameRecordReader, game_result
+
+
+# replays every game of reader on a board of backend, checking the moves and the recorded results
+# returns (games, moves, seconds)
+def replay_games(reader, backend='list', output=print):
+    games = moves = 0
+    start_time = time.perf_counter()
+    for number, record in enumerate(reader, 1):
+        for chess_board, move in record.replay(backend):
+            pass
+        result = game_result(chess_board)
+        # games stopped by an adjudication (repetition, move limit) or unfinished end in ongoing positions
+        if result != '*' and result != record.result:
+            output('game %d: recorded result %s, the final position is %s' % (number, record.result, result))
+        games += 1
+        moves += len(record.moves)
+    return games, moves, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lists, replays or exports to PGN the games of a game record file.')
+    parser.add_argument('records', help='game record file')
+    parser.add_argument('--games', type=int, nargs='*', help='numbers of the games to export (all if not given)')
+    parser.add_argument('--pgn', help="PGN file to export the games to ('-' for the standard output)")
+    parser.add_argument('--replay', action='store_true', help='replay every game, checking its moves and result')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    args = parser.parse_args()
+
+    reader = GameRecordReader(args.records)
+    if args.pgn:
+        output = sys.stdout if args.pgn == '-' else open(args.pgn, 'w')
+        for number, (offset, result, settings, count) in enumerate(reader.scan(), 1):
+            if args.games is None or number in args.games:
+                output.write(reader.read(offset).pgn(args.backend) + '\n')
+        if output is not sys.stdout:
+            output.close()
+    elif args.replay:
+        games, moves, seconds = replay_games(reader, args.backend)
+        print('%d games, %d moves replayed in %.2f sec (%.0f moves/sec)' % (games, moves, seconds,
+                                                                           moves / seconds if seconds > 0 else 0))
+    else:
+        games = moves = 0
+        for number, (offset, result, settings, count) in enumerate(reader.scan(), 1):
+            print('%5d %-8s %4d moves  %s - %s' % (number, result, count, settings.get('white', '?'),
+                                                   settings.get('black', '?')))
+            games += 1
+            moves += count
+        print('%d games, %d moves' % (games, moves))
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# game server: hosts many games against the AI at once, a session (with its own board) per connection
+# the sessions talk a line protocol over a local TCP or Unix socket, and are served by one asyncio event loop,
+# which validates and plays the players' moves right away while the AI's searches run on a process pool
+# every session queues its searches (a bounded queue: a client sending searches faster than they run stops
+# being read until there's room), and a search is handed to the pool only when a worker is free, so the
+# sessions' searches take turns instead of piling up in the pool
+# every session measures its commands', queue waits' and searches' latencies, and reports their percentiles
+#
+# protocol (a command per line, the server answers with lines):
+#   new [color w|b] [depth n] [fen <fen>]  starts a game, the player plays color (the AI moves first as white)
+#   move E2E4                              plays the player's move (E7E8N for a promotion, to a queen if not given)
+#                                          answers 'ok E2E4', and later 'ai <move>' with the AI's reply
+#   analyze [depth]                        searches the position without playing, answers 'analysis <move> ...'
+#   fen                                    answers the position as 'fen <FEN>'
+#   stats                                  answers the latency percentiles of the session (milliseconds)
+#   quit                                   ends the session
+# errors are answered as 'ERROR: ...', a finished game as 'result 1-0 checkmate', '0-1 ...' or '1/2-1/2 stalemate'
+# (or 'result * search failed' if the AI's search fails, e.g. its worker process died)
+#
+# example: python3 game_server.py --port 8765 --workers 4 --depth 3
+#          (then e.g. nc localhost 8765, and type new, move E2E4, stats...)
+
+import argparse
+import asyncio
+import collections
+import math
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ChessAI import (AI_DEPTH, AI_play, BOARD_BACKENDS, ChessBoard, GameStatus, MinMax, OpeningBook, SearchContext,
+                     SearchFeatures, Tablebases, TranspositionTable, action_name, new_chess_board, play_moves)
+
+
+# searches a session can have queued before its connection stops being read:
+SESSION_QUEUE_SIZE = 4
+
+# the search state of a worker process, kept between the searches of every session it runs
+_worker_context = None
+
+def _init_worker(transposition_table_megabytes, features, opening_book, tablebases):
+    global _worker_context
+    _worker_context = SearchContext(transposition_table_megabytes, SearchFeatures.from_names(features),
+                                    OpeningBook(opening_book) if opening_book else None,
+                                    Tablebases(tablebases) if tablebases else None)
+
+# plays the AI's move on chess_board (in a worker process), or only searches the position when analyzing
+# returns (action, value for the player to move or None, nodes)
+def _search_job(chess_board, depth, analyze):
+    MinMax.nodes = 0
+    if analyze:
+        action = MinMax.alpha_beta_decision(chess_board, depth, chess_board.turn, _worker_context)
+        return action, _worker_context.root_best[1] if _worker_context.root_best is not None else None, MinMax.nodes
+    return AI_play(chess_board, depth, chess_board.turn, _worker_context), None, MinMax.nodes
+
+
+# the latest latencies (seconds) of each kind, and their percentiles
+class LatencyRecorder():
+    SAMPLES = 10000
+    PERCENTS = (50, 90, 99)
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, kind, seconds):
+        self.samples.setdefault(kind, collections.deque(maxlen=LatencyRecorder.SAMPLES)).append(seconds)
+
+    # {percent: latency} (nearest rank) of the recorded latencies of kind, and 100 for the largest
+    def percentiles(self, kind):
+        ordered = sorted(self.samples.get(kind, ()))
+        if len(ordered) == 0:
+            return None
+        result = {percent: ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+                  for percent in LatencyRecorder.PERCENTS}
+        result[100] = ordered[-1]
+        return result
+
+    # a line per kind: '<kind> n <count> p50 <ms> p90 <ms> p99 <ms> max <ms>'
+    def report_lines(self):
+        lines = []
+        for kind in sorted(self.samples):
+            percentiles = self.percentiles(kind)
+            lines.append('%s n %d %s' % (kind, len(self.samples[kind]), ' '.join(
+                '%s %.2f' % ('max' if percent == 100 else 'p%d' % percent, seconds * 1000)
+                for percent, seconds in percentiles.items())))
+        return lines
+
+
+# a connection's game: the board, the player's color and the AI's queued searches
+class GameSession():
+    def __init__(self, server, number, reader, writer):
+        self.server = server
+        self.number = number
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue(server.queue_size)
+        self.latency = LatencyRecorder()
+        # incremented by every new game, the results of the searches of older games are dropped:
+        self.generation = 0
+        self.new_game('w', server.depth)
+
+    def send(self, line):
+        self.writer.write((line + '\n').encode())
+
+    def new_game(self, color, depth, fen=None):
+        self.generation += 1
+        self.chess_board = new_chess_board(self.server.backend, fen)
+        self.color = color
+        self.depth = depth
+        self.thinking = False # the AI's move is queued or searched
+        self.result = None
+
+    # reads and answers the commands until the connection or the session ends
+    async def run(self):
+        searches = asyncio.create_task(self.__search_loop())
+        self.send('ready session %d' % self.number)
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors='replace').split()
+                if words and words[0].lower() == 'quit':
+                    break
+                start_time = time.perf_counter()
+                job = None
+                try:
+                    job = self.command(words)
+                except Exception as error: # a bad command mustn't end the session
+                    self.send(str(error))
+                self.latency.record('command', time.perf_counter() - start_time)
+                await self.writer.drain()
+                # waits while the session's queue is full, without reading more commands:
+                if job is not None:
+                    await self.queue.put(job)
+        finally:
+            searches.cancel()
+            self.writer.close()
+
+    # answers a command, returns a search job to queue or None
+    def command(self, words):
+        if not words:
+            return None
+        name, words = words[0].lower(), words[1:]
+
+        if name == 'new':
+            settings = {'color': 'w', 'depth': str(self.server.depth)}
+            while words and words[0] != 'fen':
+                if len(words) < 2 or words[0] not in settings:
+                    raise Exception('ERROR: new takes color, depth and fen')
+                settings[words[0]] = words[1]
+                words = words[2:]
+            if settings['color'] not in ('w', 'b'):
+                raise Exception('ERROR: the color must be w or b')
+            self.new_game(settings['color'], int(settings['depth']), ' '.join(words[1:]) if words else None)
+            self.send('ok new')
+            return self.__check_result() or self.__AI_turn()
+
+        if name == 'move':
+            if len(words) != 1:
+                raise Exception('ERROR: move takes a move like E2E4')
+            if self.result is not None:
+                raise Exception('ERROR: the game is over')
+            if self.thinking or self.chess_board.turn != self.color:
+                raise Exception("ERROR: it is the AI's turn")
+            move = words[0].upper()
+            names = {action_name(ChessBoard.move_to_action(legal)) for legal in self.chess_board.legal_moves()}
+            if move not in names and move + 'Q' in names: # a promotion without a piece is to a queen
+                move += 'Q'
+            if move not in names:
+                raise Exception('ERROR: ' + move + ' is not a legal move')
+            play_moves(self.chess_board, [move])
+            self.send('ok ' + move)
+            return self.__check_result() or self.__AI_turn()
+
+        if name == 'analyze':
+            depth = int(words[0]) if words else self.depth
+            return (self.generation, True, type(self.chess_board)(self.chess_board), depth, time.perf_counter())
+
+        if name == 'fen':
+            self.send('fen ' + self.chess_board.to_fen())
+            return None
+
+        if name == 'stats':
+            for line in self.latency.report_lines():
+                self.send('stats ' + line)
+            self.send('stats end')
+            return None
+
+        raise Exception('ERROR: unknown command ' + name)
+
+    # the search job of the AI's move if it's the AI's turn, None otherwise
+    def __AI_turn(self):
+        if self.result is not None or self.chess_board.turn == self.color:
+            return None
+        self.thinking = True
+        return (self.generation, False, type(self.chess_board)(self.chess_board), self.depth, time.perf_counter())
+
+    # sends the result if the game is over (and returns None, the game needs no search)
+    def __check_result(self):
+        status = self.chess_board.get_game_status()
+        if status == GameStatus.CHECKMATE:
+            self.result = ('0-1' if self.chess_board.turn == 'w' else '1-0') + ' checkmate'
+        elif status == GameStatus.STALEMATE:
+            self.result = '1/2-1/2 stalemate'
+        if self.result is not None:
+            self.send('result ' + self.result)
+        return None
+
+    # runs the session's queued searches one at a time, on a free worker of the server's pool
+    async def __search_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            generation, analyze, chess_board, depth, queued_time = await self.queue.get()
+            async with self.server.free_workers:
+                self.latency.record('queue', time.perf_counter() - queued_time)
+                try:
+                    action, value, nodes = await loop.run_in_executor(self.server.pool, _search_job, chess_board,
+                                                                      depth, analyze)
+                except Exception as error: # e.g. a worker process died
+                    action = None
+                    self.send('ERROR: search failed (' + str(error) + ')')
+                    # the AI can't move, so the game ends unfinished and the client can start a new one
+                    if generation == self.generation and not analyze:
+                        self.result = '* search failed'
+                        self.send('result ' + self.result)
+                    await self.writer.drain()
+            if action is None:
+                if generation == self.generation and not analyze:
+                    self.thinking = False
+                continue
+            if generation != self.generation:
+                continue
+            self.latency.record('analyze' if analyze else 'search', time.perf_counter() - queued_time)
+            if analyze:
+                self.send('analysis %s depth %d score %s nodes %d' % (
+                    action_name(action), depth, 'none' if value is None else '%.2f' % value, nodes))
+            else:
+                play_moves(self.chess_board, [action_name(action)])
+                self.thinking = False
+                self.send('ai %s nodes %d' % (action_name(action), nodes))
+                self.__check_result()
+            await self.writer.drain()
+
+
+# the sessions' shared settings, and the process pool searching their moves
+class GameServer():
+    def __init__(self, workers=None, depth=AI_DEPTH, queue_size=SESSION_QUEUE_SIZE, backend='list',
+                 transposition_table_megabytes=TranspositionTable.DEFAULT_MEGABYTES, features=(), opening_book=None,
+                 tablebases=None, log=sys.stderr):
+        self.workers = workers or os.cpu_count()
+        self.depth = depth
+        self.queue_size = queue_size
+        self.backend = backend
+        self.log = log
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(
+            transposition_table_megabytes, tuple(features), opening_book, tablebases))
+        self.free_workers = asyncio.Semaphore(self.workers)
+        self.sessions = 0
+
+    async def handle_connection(self, reader, writer):
+        self.sessions += 1
+        session = GameSession(self, self.sessions, reader, writer)
+        self.log.write('session %d started\n' % session.number)
+        try:
+            await session.run()
+        except ConnectionError:
+            pass
+        self.log.write('session %d ended: %s\n' % (session.number, ', '.join(session.latency.report_lines())))
+
+    # serves connections on host:port, or on the Unix socket at path, until cancelled
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        # the workers are started before listening, so they don't inherit (and keep open) the listening socket:
+        await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(self.pool, os.getpid)
+                               for i in range(self.workers)])
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        self.log.write('serving on %s with %d workers\n' % (path or '%s:%d' % (host, port), self.workers))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves games against the AI to many clients at once, '
+                                     'over a line protocol.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--unix', help='Unix socket path to listen on instead of a port')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='searching processes')
+    parser.add_argument('--depth', type=int, default=AI_DEPTH, help="the AI's default search depth")
+    parser.add_argument('--queue-size', type=int, default=SESSION_QUEUE_SIZE, help='searches a session can queue')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--hash', type=int, default=TranspositionTable.DEFAULT_MEGABYTES,
+                        help='transposition table megabytes of every worker')
+    parser.add_argument('--features', default='', help='search features, like pvs+null_move')
+    parser.add_argument('--book', help='opening book file (see opening_book.py)')
+    parser.add_argument('--tablebases', help='endgame tablebases directory (see tablebase.py)')
+    args = parser.parse_args()
+
+    async def serve():
+        server = GameServer(args.workers, args.depth, args.queue_size, args.backend, args.hash,
+                            [feature for feature in args.features.split('+') if feature], args.book, args.tablebases)
+        await server.serve(args.host, args.port, args.unix)
+
+    # terminating the server stops it like Ctrl-C, shutting the workers down:
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# opening book builder: writes an OpeningBook file (see ChessAI.OpeningBook) of the moves to play in the opening
+# the moves come either from games (a file with a game per line, written as moves like 'E2E4 E7E5 G1F3'),
+# weighted by how often each was played, or from the engine: every position up to --width plies is searched
+# (so the book has an answer to any opening move), and the engine's own lines are followed up to --plies plies
+#
+# example: python3 opening_book.py book.bin --games games.txt --plies 12
+#          python3 opening_book.py book.bin --plies 6 --width 2 --depth 4 --workers 4
+#          python3 opening_book.py book.bin --show --moves E2E4
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from ChessAI import BOARD_BACKENDS, ChessBoard, MinMax, OpeningBook, action_name, new_chess_board, play_moves
+
+
+# {move name like 'E2E4' or 'E7E8Q': packed move} of the legal moves of chess_board
+def legal_move_names(chess_board):
+    return {action_name(ChessBoard.move_to_action(move)): move for move in chess_board.legal_moves()}
+
+
+# counts the moves of the games (lines of move names) played in their first plies
+# returns {Zobrist key: {packed move: times played}}
+def count_game_moves(lines, plies, backend='list'):
+    counts = {}
+    for number, line in enumerate(lines, 1):
+        names = line.split()
+        if len(names) == 0 or line.startswith('#'):
+            continue
+        chess_board = new_chess_board(backend)
+        for name in names[:plies]:
+            moves = legal_move_names(chess_board)
+            name = name.upper()
+            move = moves.get(name, moves.get(name + 'Q')) # a promotion without a piece is to a queen
+            if move is None:
+                raise Exception('ERROR: ' + name + ' is not legal in game ' + str(number))
+            position_counts = counts.setdefault(chess_board.zobrist_key, {})
+            position_counts[move] = position_counts.get(move, 0) + 1
+            chess_board.push(move)
+    return counts
+
+
+# packed move chosen by a depth deep search of chess_board (in a worker process)
+def _engine_move(chess_board, depth):
+    start, target, promotion = MinMax.alpha_beta_decision(chess_board, depth, chess_board.turn)
+    return legal_move_names(chess_board)[action_name((start, target, promotion))]
+
+# searches every position up to width plies from the initial position, and follows the chosen moves up to plies
+# returns {Zobrist key: {packed move: 1}}, the engine's move of every searched position
+def engine_moves(plies, width, depth, workers=None, backend='list', report=sys.stderr):
+    book = {}
+    level = [new_chess_board(backend)]
+    with ProcessPoolExecutor(workers) as executor:
+        for ply in range(plies):
+            # transpositions are searched once:
+            positions = {}
+            for chess_board in level:
+                if chess_board.zobrist_key not in book and len(chess_board.legal_moves()) > 0:
+                    positions[chess_board.zobrist_key] = chess_board
+            chosen = executor.map(_engine_move, positions.values(), [depth] * len(positions))
+
+            level = []
+            for (key, chess_board), move in zip(positions.items(), chosen):
+                book[key] = {move: 1}
+                for child_move in chess_board.legal_moves() if ply < width else [move]:
+                    child = type(chess_board)(chess_board)
+                    child.push(child_move)
+                    level.append(child)
+            report.write('ply %d: %d positions searched, %d in the book\n' % (ply + 1, len(positions), len(book)))
+    return book
+
+
+# flattens {Zobrist key: {packed move: weight}} to the book's (key, move, weight) entries
+def book_entries(moves):
+    return [(key, move, weight) for key, weights in moves.items() for move, weight in weights.items()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds an opening book from games or engine searches, '
+                                     'or shows the book moves of a position.')
+    parser.add_argument('book', help='opening book file')
+    parser.add_argument('--games', help="file with a game per line, written like 'E2E4 E7E5 G1F3' ('-' for the "
+                        'standard input), the book is built from the engine searches if not given')
+    parser.add_argument('--plies', type=int, default=8, help='plies from the initial position kept in the book')
+    parser.add_argument('--width', type=int, default=2, help='plies where every move is searched (engine book)')
+    parser.add_argument('--depth', type=int, default=3, help='search depth (engine book)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='searching processes (engine book)')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--show', action='store_true', help="show the book moves of a position instead of building")
+    parser.add_argument('--fen', help='position to show (the initial position if not given)')
+    parser.add_argument('--moves', nargs='*', default=[], help='moves played before the position to show')
+    args = parser.parse_args()
+
+    if args.show:
+        chess_board = new_chess_board(args.backend, args.fen)
+        play_moves(chess_board, args.moves)
+        book = OpeningBook(args.book)
+        entries = book.entries(chess_board.zobrist_key)
+        total = sum(weight for move, weight in entries)
+        for move, weight in sorted(entries, key=lambda entry: -entry[1]):
+            print('%-6s %5d %5.1f%%' % (action_name(ChessBoard.move_to_action(move)), weight, 100 * weight / total))
+        print('%d moves (%d entries in the book)' % (len(entries), book.size))
+        book.close()
+        return
+
+    if args.games:
+        games = sys.stdin if args.games == '-' else open(args.games)
+        try:
+            moves = count_game_moves(games, args.plies, args.backend)
+        finally:
+            if games is not sys.stdin:
+                games.close()
+    else:
+        moves = engine_moves(args.plies, args.width, args.depth, args.workers, args.backend)
+
+    entries = book_entries(moves)
+    OpeningBook.write(args.book, entries)
+    print('%d positions, %d moves written to %s' % (len(moves), len(entries), args.book))
+
+
+if __name__ == '__main__':
+    main()
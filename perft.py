@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# perft: counts the leaf positions of the move tree to a given depth, to measure and verify the move generator
+# prints the count and nodes/sec of every depth up to the given one and the count under every root move (divide)
+# note the counts follow this engine's rules (no en passant, pawns promote to a knight or a queen only),
+# so they differ from the usual published perft numbers
+#
+# example: python3 perft.py --depth 4 --moves E2E4 E7E5 --hashed --workers 4
+#          python3 perft.py --depth 3 --fen 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1'
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ChessAI import BOARD_BACKENDS, ChessBoard, action_name, new_chess_board, play_moves
+
+
+# number of leaf positions depth plies below chess_board, counted by playing and taking back legal moves
+# with table (a dictionary), the counts of positions (by Zobrist key and depth) are reused for transpositions
+def perft(chess_board, depth, table=None):
+    if depth == 0:
+        return 1
+    moves = chess_board.legal_moves()
+    if depth == 1:
+        return len(moves)
+
+    if table is not None:
+        key = (chess_board.zobrist_key, depth)
+        if key in table:
+            return table[key]
+
+    nodes = 0
+    for move in moves:
+        chess_board.push(move)
+        nodes += perft(chess_board, depth - 1, table)
+        chess_board.pop()
+
+    if table is not None:
+        table[key] = nodes
+    return nodes
+
+# same count as perft, but with a copied board for every move (ChessBoard.forcast_actions)
+def perft_forcast(chess_board, depth):
+    if depth == 0:
+        return 1
+    action_outcomes = chess_board.forcast_actions()
+    if depth == 1:
+        return len(action_outcomes)
+    return sum(perft_forcast(outcome, depth - 1) for action, outcome in action_outcomes)
+
+def _count(chess_board, depth, hashed, forcast):
+    if forcast:
+        return perft_forcast(chess_board, depth)
+    return perft(chess_board, depth, {} if hashed else None)
+
+# counts the leaf positions under a root move (packed) in a worker process
+def _divide_move(chess_board, move, depth, hashed, forcast):
+    chess_board.push(move)
+    return _count(chess_board, depth - 1, hashed, forcast)
+
+
+# returns [(action, leaf positions depth plies below chess_board after it)] for every legal move
+# workers > 1 counts the root moves on that many processes (every worker hashes on its own)
+def divide(chess_board, depth, hashed=False, forcast=False, workers=1):
+    if depth < 1:
+        raise Exception('ERROR: divide needs a depth of at least 1')
+    moves = chess_board.legal_moves()
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_divide_move, chess_board, move, depth, hashed, forcast) for move in moves]
+            counts = [future.result() for future in futures]
+    else:
+        # one table for all root moves, transpositions between their subtrees are reused too
+        table = {} if hashed else None
+        counts = []
+        for move in moves:
+            chess_board.push(move)
+            counts.append(perft_forcast(chess_board, depth - 1) if forcast else perft(chess_board, depth - 1, table))
+            chess_board.pop()
+
+    return [(ChessBoard.move_to_action(move), count) for move, count in zip(moves, counts)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts the leaf positions of the move tree (perft) to test "
+                                     "the move generator's speed and correctness.")
+    parser.add_argument('--depth', type=int, default=3, help='depth to count the leaf positions at')
+    parser.add_argument('--fen', help='position to start from (the initial position if not given)')
+    parser.add_argument('--moves', nargs='*', default=[], help='moves played from the position, like E2E4')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--hashed', action='store_true', help='reuse the counts of transposed positions')
+    parser.add_argument('--forcast', action='store_true', help='count with forcast_actions (a board copy per move)')
+    parser.add_argument('--workers', type=int, default=1, help='processes counting the root moves of the last depth')
+    args = parser.parse_args()
+    if args.workers == 0:
+        args.workers = os.cpu_count()
+
+    chess_board = new_chess_board(args.backend, args.fen)
+    play_moves(chess_board, args.moves)
+    chess_board = type(chess_board)(chess_board)
+
+    # nodes/sec of every depth (the last one counted with divide):
+    for depth in range(1, args.depth):
+        start_time = time.perf_counter()
+        nodes = _count(chess_board, depth, args.hashed, args.forcast)
+        elapsed = time.perf_counter() - start_time
+        print('depth %d: %d nodes, %.3f sec, %d nodes/sec' % (depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0))
+
+    start_time = time.perf_counter()
+    counts = divide(chess_board, args.depth, args.hashed, args.forcast, args.workers)
+    elapsed = time.perf_counter() - start_time
+    nodes = sum(count for action, count in counts)
+    print('depth %d: %d nodes, %.3f sec, %d nodes/sec' % (args.depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0))
+
+    print()
+    for action, count in counts:
+        print(action_name(action) + ':', count)
+    print('moves:', len(counts), 'nodes:', nodes)
+
+
+if __name__ == '__main__':
+    main()
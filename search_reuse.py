@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# search reuse measurement: plays whole games between two AIs that keep their search state between moves
+# (the SearchContext of play_with_AI and play_two_AIs: the transposition table, whose best moves lead the
+# search of the position after the expected reply, and the move ordering's killers and history), and searches
+# every position of the games again with a fresh state, to count the nodes the kept state saves per move
+# games start from random openings and are played on a process pool, like tournament.py's
+#
+# example: python3 search_reuse.py --games 4 --depth 4
+#          python3 search_reuse.py --games 8 --depth 4 --features pvs+null_move --json reuse.json
+
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from ChessAI import AI_play, BOARD_BACKENDS, GameStatus, MinMax, SearchContext, SearchFeatures, new_chess_board
+from tournament import random_opening
+
+
+# plays a game from the opening (packed moves) in a worker process, searching every position twice:
+# with the state kept by the player's earlier searches (whose move is played) and with a fresh state
+# returns the nodes of both searches of every move, and how many chose the same move
+def measure_game(index, opening, depth, features, max_moves, backend='list'):
+    chess_board = new_chess_board(backend)
+    for move in opening:
+        chess_board.push(move)
+    contexts = {color: SearchContext(features=SearchFeatures.from_names(features)) for color in 'wb'}
+    fresh_nodes = []
+    reused_nodes = []
+    same_moves = 0
+    repetitions = {chess_board.zobrist_key: 1}
+
+    while len(reused_nodes) < 2 * max_moves:
+        if chess_board.get_game_status() in (GameStatus.CHECKMATE, GameStatus.STALEMATE):
+            break
+        color = chess_board.turn
+        MinMax.nodes = 0
+        fresh_action = MinMax.alpha_beta_decision(chess_board, depth, color,
+                                                  SearchContext(features=SearchFeatures.from_names(features)))
+        fresh_nodes.append(MinMax.nodes)
+        MinMax.nodes = 0
+        action = AI_play(chess_board, depth, color, contexts[color])
+        reused_nodes.append(MinMax.nodes)
+        same_moves += action == fresh_action
+
+        repetitions[chess_board.zobrist_key] = repetitions.get(chess_board.zobrist_key, 0) + 1
+        if repetitions[chess_board.zobrist_key] >= 3:
+            break
+
+    return {'index': index, 'plies': len(reused_nodes), 'fresh_nodes': fresh_nodes, 'reused_nodes': reused_nodes,
+            'same_moves': same_moves}
+
+
+# the totals of games' measures: nodes per move with a fresh and a kept search state, and the nodes saved
+def summarize(games):
+    plies = sum(game['plies'] for game in games)
+    fresh = sum(sum(game['fresh_nodes']) for game in games)
+    reused = sum(sum(game['reused_nodes']) for game in games)
+    return {'games': len(games), 'moves': plies,
+            'fresh_nodes_per_move': fresh / plies if plies else 0.0,
+            'reused_nodes_per_move': reused / plies if plies else 0.0,
+            'saved_nodes_per_move': (fresh - reused) / plies if plies else 0.0,
+            'saved_fraction': (fresh - reused) / fresh if fresh else 0.0,
+            'same_move_rate': sum(game['same_moves'] for game in games) / plies if plies else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the nodes per move saved over whole games by keeping '
+                                     'the search state between moves.')
+    parser.add_argument('--games', type=int, default=4, help='games to play')
+    parser.add_argument('--depth', type=int, default=3, help='search depth')
+    parser.add_argument('--features', default='', help='search features, like pvs+null_move')
+    parser.add_argument('--max-moves', type=int, default=40, help="moves of each player before a game is stopped")
+    parser.add_argument('--opening-plies', type=int, default=4, help='random moves starting every game')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='games played at a time')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random openings')
+    parser.add_argument('--json', help='file to write every move\'s nodes and the summary to')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    features = [feature for feature in args.features.split('+') if feature]
+    openings = [random_opening(args.opening_plies, rng, args.backend) for i in range(args.games)]
+    games = []
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(measure_game, index, opening, args.depth, features, args.max_moves, args.backend)
+                   for index, opening in enumerate(openings)]
+        for future in futures:
+            game = future.result()
+            games.append(game)
+            fresh, reused = sum(game['fresh_nodes']), sum(game['reused_nodes'])
+            print('game %d: %d moves, %.0f nodes/move fresh, %.0f kept, %.0f saved/move (%.1f%%)' % (
+                game['index'] + 1, game['plies'], fresh / max(game['plies'], 1), reused / max(game['plies'], 1),
+                (fresh - reused) / max(game['plies'], 1), 100 * (fresh - reused) / fresh if fresh else 0.0))
+
+    summary = summarize(games)
+    print('%d moves: %.0f nodes/move fresh, %.0f kept, %.0f saved/move (%.1f%%), same moves %.1f%%' % (
+        summary['moves'], summary['fresh_nodes_per_move'], summary['reused_nodes_per_move'],
+        summary['saved_nodes_per_move'], 100 * summary['saved_fraction'], 100 * summary['same_move_rate']))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'depth': args.depth, 'features': features, 'summary': summary, 'games': games}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
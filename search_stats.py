@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# search statistics: searches a position with a SearchStatistics collector and writes its report as JSON
+# (per ply nodes, leaves, transposition table hits, cutoffs, first-move cutoff rate and branching factors,
+# and with --timers the seconds spent in move generation, king safety, move ordering and evaluation)
+# with --profile the search runs under cProfile instead, and the most expensive functions are printed
+#
+# example: python3 search_stats.py --depth 4 --timers --json stats.json
+#          python3 search_stats.py --fen 'r2q1rk1/bpp2ppp/p1np1n2/4p3/PPB1P1b1/2PP1N2/3N1PPP/R1BQ1RK1 w - - 0 1' --profile
+
+import argparse
+import contextlib
+import cProfile
+import json
+import pstats
+import sys
+
+from ChessAI import (BOARD_BACKENDS, MinMax, SearchContext, SearchFeatures, SearchStatistics, action_name,
+                     new_chess_board, play_moves)
+
+
+# runs function(*args) under cProfile and prints the limit most expensive functions (by sort) to output
+# returns the function's result
+def profile_search(function, *args, sort='cumulative', limit=30, output=sys.stderr):
+    profile = cProfile.Profile()
+    result = profile.runcall(function, *args)
+    pstats.Stats(profile, stream=output).sort_stats(sort).print_stats(limit)
+    return result
+
+
+# searches chess_board like AI_play would (iteratively deepening up to depth with a time or node limit),
+# every iteration when iterative, returns (action, SearchStatistics)
+def collect_statistics(chess_board, depth, time_limit=None, node_limit=None, features=(), iterative=False,
+                       timers=False, profile=False):
+    statistics = SearchStatistics()
+    context = SearchContext(features=SearchFeatures.from_names(features), statistics=statistics)
+    if iterative or time_limit is not None or node_limit is not None:
+        search, args = MinMax.iterative_deepening, (chess_board, chess_board.turn, depth, time_limit, node_limit, context)
+    else:
+        search, args = MinMax.alpha_beta_decision, (chess_board, depth, chess_board.turn, context)
+
+    with statistics.timing(type(chess_board)) if timers else contextlib.nullcontext():
+        if profile:
+            action = profile_search(search, *args)
+        else:
+            action = search(*args)
+    return action, statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Searches a position and reports per ply node, cutoff and '
+                                     'branching factor statistics as JSON.')
+    parser.add_argument('--fen', help='position to search (the initial position if not given)')
+    parser.add_argument('--moves', nargs='*', default=[], help='moves played from the position, like E2E4')
+    parser.add_argument('--depth', type=int, default=4, help='search depth (the maximal one with --time or --nodes)')
+    parser.add_argument('--time', type=float, help='seconds to search for')
+    parser.add_argument('--nodes', type=int, help='nodes to search')
+    parser.add_argument('--iterative', action='store_true', help='search every depth up to --depth')
+    parser.add_argument('--features', default='', help='search features, like pvs+null_move')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--timers', action='store_true', help='time move generation, king safety, ordering and '
+                        'evaluation (slows the search down)')
+    parser.add_argument('--profile', action='store_true', help='run the search under cProfile')
+    parser.add_argument('--json', help='file to write the report to (the standard output if not given)')
+    args = parser.parse_args()
+
+    chess_board = new_chess_board(args.backend, args.fen)
+    play_moves(chess_board, args.moves)
+    features = [feature for feature in args.features.split('+') if feature]
+    action, statistics = collect_statistics(chess_board, args.depth, args.time, args.nodes, features, args.iterative,
+                                            args.timers, args.profile)
+
+    report = statistics.report()
+    report['move'] = action_name(action) if action is not None else None
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+        for record in report['searches']:
+            print('depth %d: %d nodes, %.3f sec, EBF %.2f, first-move cutoffs %s' % (
+                record['depth'], record['nodes'], record['seconds'], record['effective_branching_factor'],
+                '%.1f%%' % (100 * record['first_move_cutoff_rate']) if record['first_move_cutoff_rate'] is not None else '-'))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
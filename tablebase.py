@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# endgame tablebase generator: builds the Tablebases (see ChessAI.Tablebases) of KQK, KRK and KPK by
+# retrograde analysis, starting from the checkmates and going backwards one ply at a time, so every position
+# gets its exact result and distance to mate
+# the search probes the tables at its root and nodes (SearchContext(tablebases=Tablebases(directory)))
+#
+# example: python3 tablebase.py tablebases
+#          python3 tablebase.py tablebases --probe '8/8/8/4k3/8/8/8/4K2Q w - - 0 1'
+
+import argparse
+import os
+import time
+
+from ChessAI import (BISHOP_RAYS, KING_TARGETS, KNIGHT_TARGETS, ROOK_RAYS, ChessBoard, Tablebases, action_name,
+                     new_chess_board)
+
+
+# tables of positions numbered y * 8 + x:
+KING_SQUARES = [[ty * 8 + tx for ty, tx in KING_TARGETS[sq >> 3][sq & 7]] for sq in range(64)]
+KNIGHT_SQUARES = [[ty * 8 + tx for ty, tx in KNIGHT_TARGETS[sq >> 3][sq & 7]] for sq in range(64)]
+RAYS = {'R': [[[ty * 8 + tx for ty, tx in ray] for ray in ROOK_RAYS[sq >> 3][sq & 7]] for sq in range(64)],
+        'B': [[[ty * 8 + tx for ty, tx in ray] for ray in BISHOP_RAYS[sq >> 3][sq & 7]] for sq in range(64)]}
+RAYS['Q'] = [RAYS['R'][sq] + RAYS['B'][sq] for sq in range(64)]
+# positions attacked by a white pawn:
+PAWN_ATTACK_SQUARES = [[(sq >> 3) * 8 + 8 + tx for tx in ((sq & 7) - 1, (sq & 7) + 1) if 0 <= tx < 8]
+                       if sq < 56 else [] for sq in range(64)]
+
+
+# {target: positions between the piece and target} of the targets a sliding piece at sq attacks on an empty board
+def build_lines(piece):
+    lines = []
+    for sq in range(64):
+        targets = {}
+        for ray in RAYS[piece][sq]:
+            for index, target in enumerate(ray):
+                targets[target] = set(ray[:index])
+        lines.append(targets)
+    return lines
+
+LINES = {piece: build_lines(piece) for piece in 'RBQ'}
+
+
+# checks if the white piece at sq attacks target, with the only other piece in the way at blocker
+def attacks(piece, sq, target, blocker):
+    if piece == 'N':
+        return target in KNIGHT_SQUARES[sq]
+    if piece == 'P':
+        return target in PAWN_ATTACK_SQUARES[sq]
+    between = LINES[piece][sq].get(target)
+    return between is not None and blocker not in between
+
+# the positions the white piece at sq could have come from with the kings at white_king and black_king
+# (the moves are reversible except for the pawn's, which only moves forward, two positions from its first row)
+def piece_origins(piece, sq, white_king, black_king):
+    if piece == 'N':
+        return [origin for origin in KNIGHT_SQUARES[sq] if origin != white_king and origin != black_king]
+    if piece == 'P':
+        origins = []
+        if sq >= 16 and sq - 8 not in (white_king, black_king):
+            origins.append(sq - 8)
+            if 24 <= sq < 32 and sq - 16 not in (white_king, black_king):
+                origins.append(sq - 16)
+        return origins
+    origins = []
+    for ray in RAYS[piece][sq]:
+        for origin in ray:
+            if origin == white_king or origin == black_king:
+                break
+            origins.append(origin)
+    return origins
+
+def split_index(index):
+    return index >> 18, (index >> 12) & 63, (index >> 6) & 63, index & 63
+
+
+# builds the table (a bytearray, see Tablebases) of the kings and a white piece ('Q', 'R', 'B', 'N' or 'P')
+# promoted (the table of KQK) is needed for the pawn's promotions, promotions to a knight are draws
+def build_table(piece, promoted=None):
+    size = Tablebases.SIZE
+    table = bytearray(size)
+    # legal positions, and the number of legal moves (left to refute) of black's positions:
+    valid = bytearray(size)
+    moves_left = bytearray(size)
+    lost = [] # black's checkmated positions
+    promotions = {} # {plies: white's positions winning in plies by a promotion}
+
+    for index in range(size):
+        black_to_move, white_king, black_king, sq = split_index(index)
+        if white_king == black_king or sq == white_king or sq == black_king or black_king in KING_SQUARES[white_king]:
+            continue
+        if piece == 'P' and not 8 <= sq < 56:
+            continue
+        in_check = attacks(piece, sq, black_king, white_king)
+        if not black_to_move:
+            if in_check:
+                continue
+            valid[index] = 1
+            if piece == 'P' and sq >= 48 and sq + 8 not in (white_king, black_king):
+                distance = promoted[Tablebases.index('b', white_king, black_king, sq + 8)]
+                if distance > 0:
+                    promotions.setdefault(distance, []).append(index)
+            continue
+
+        valid[index] = 1
+        count = 0
+        for target in KING_SQUARES[black_king]:
+            if target == white_king or target in KING_SQUARES[white_king]:
+                continue
+            # capturing the piece (if the white king doesn't protect it) is a draw, so it is never refuted
+            if target != sq and attacks(piece, sq, target, white_king):
+                continue
+            count += 1
+        moves_left[index] = count
+        if count == 0 and in_check:
+            table[index] = 1 # checkmated: a loss in 0 plies
+            lost.append(index)
+
+    # black's positions lost in plies (even) make white's positions before them won in plies + 1,
+    # and black's positions all of whose moves lead to white's won positions are lost
+    plies = 0
+    frontier = lost
+    while frontier or any(distance > plies for distance in promotions):
+        reached = []
+        if plies % 2 == 0:
+            for index in frontier:
+                black_to_move, white_king, black_king, sq = split_index(index)
+                origins = [Tablebases.index('w', origin, black_king, sq) for origin in KING_SQUARES[white_king]
+                           if origin != black_king and origin != sq]
+                origins += [Tablebases.index('w', white_king, black_king, origin)
+                            for origin in piece_origins(piece, sq, white_king, black_king)]
+                for origin in origins:
+                    if valid[origin] and table[origin] == 0:
+                        table[origin] = plies + 2
+                        reached.append(origin)
+            # promotions to a queen lost for black in plies (the table keeps the distance + 1):
+            for origin in promotions.pop(plies + 1, []):
+                if table[origin] == 0:
+                    table[origin] = plies + 2
+                    reached.append(origin)
+        else:
+            for index in frontier:
+                black_to_move, white_king, black_king, sq = split_index(index)
+                for origin_king in KING_SQUARES[black_king]:
+                    if origin_king == white_king or origin_king == sq:
+                        continue
+                    origin = Tablebases.index('b', white_king, origin_king, sq)
+                    if valid[origin] and table[origin] == 0:
+                        moves_left[origin] -= 1
+                        if moves_left[origin] == 0:
+                            table[origin] = plies + 2
+                            reached.append(origin)
+        frontier = reached
+        plies += 1
+
+    return table
+
+
+# builds the tables of the materials (and the ones they need) and writes them to directory
+# tables already in directory are reused as the ones needed by others
+def build_tablebases(directory, materials=Tablebases.MATERIALS, output=print):
+    os.makedirs(directory, exist_ok=True)
+    built = {}
+
+    def table_of(material):
+        if material not in built:
+            if material not in materials and os.path.exists(Tablebases.path(directory, material)):
+                with open(Tablebases.path(directory, material), 'rb') as file:
+                    built[material] = file.read()[Tablebases.HEADER.size:]
+                return built[material]
+            start_time = time.perf_counter()
+            table = build_table(material[1], table_of('KQK') if material == 'KPK' else None)
+            Tablebases.write(directory, material, table)
+            built[material] = table
+
+            won = sum(1 for distance in table if distance % 2 == 0 and distance > 0) # side to move wins
+            lost = sum(1 for distance in table if distance % 2 == 1)
+            output('%s: %d won, %d lost positions, longest mate %d plies, %.1f sec' % (
+                material, won, lost, max(table) - 1, time.perf_counter() - start_time))
+        return built[material]
+
+    for material in materials:
+        if material not in Tablebases.MATERIALS:
+            raise Exception('ERROR: unknown tablebase material ' + material)
+        table_of(material)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds endgame tablebases (result and distance to mate of every '
+                                     'position) or probes a position.')
+    parser.add_argument('directory', help='directory of the tables')
+    parser.add_argument('--materials', nargs='*', default=list(Tablebases.MATERIALS),
+                        help='material sets to build, of ' + ', '.join(Tablebases.MATERIALS))
+    parser.add_argument('--probe', help='FEN of a position to probe instead of building')
+    args = parser.parse_args()
+
+    if args.probe:
+        tablebases = Tablebases(args.directory)
+        chess_board = new_chess_board('list', args.probe)
+        probe = tablebases.probe(chess_board)
+        if probe is None:
+            print('not in the tablebases')
+            return
+        result, plies = probe
+        print({1: 'win', 0: 'draw', -1: 'loss'}[result] + ('' if plies is None else ', mate in %d plies' % plies))
+        best = tablebases.best_move(chess_board)
+        if best is not None:
+            print('best move:', action_name(ChessBoard.move_to_action(best[0])))
+        tablebases.close()
+        return
+
+    build_tablebases(args.directory, args.materials)
+
+
+if __name__ == '__main__':
+    main()
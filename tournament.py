@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# headless self-play tournament between two engine settings
+# games are played concurrently on a process pool, starting from random openings (each opening is played
+# twice, with colors swapped) and are adjudicated as draws on a move limit or threefold repetition
+# results are printed as games finish, with games/sec, nodes/sec and the Elo difference estimate
+#
+# example: python3 tournament.py --games 20 --first depth=3 --second depth=2,OPPORTUNITIES_COEF=0.1
+
+import argparse
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ChessAI import (AI_play, BOARD_BACKENDS, GameRecord, GameRecordWriter, GameStatus, HeuristicScores, MinMax,
+                     SearchContext, SearchFeatures, new_chess_board)
+
+
+# the settings of a player of the tournament
+# depth is the search depth (None for no depth limit, with a time or node limit),
+# time_limit (seconds per move) and node_limit make the search deepen iteratively until the budget runs out
+# heuristics overrides HeuristicScores attributes (e.g. OPPORTUNITIES_COEF) and piece scores (e.g. Q)
+# features are the names of the enabled SearchFeatures
+class EngineSettings():
+    def __init__(self, name, depth=3, time_limit=None, node_limit=None, heuristics=None, features=()):
+        if depth is None and time_limit is None and node_limit is None:
+            raise Exception('ERROR: engine ' + name + ' needs a depth, time or node limit')
+        self.name = name
+        self.depth = depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.heuristics = heuristics if heuristics is not None else {}
+        self.features = tuple(features)
+
+        for key in self.heuristics:
+            if key not in HeuristicScores.SCORES and not hasattr(HeuristicScores, key):
+                raise Exception('ERROR: unknown heuristic ' + key)
+        SearchFeatures.from_names(self.features) # checks the names
+
+    # parses settings written like 'depth=3,time=0.5,nodes=20000,features=pvs+null_move,OPPORTUNITIES_COEF=0.1,Q=9'
+    @staticmethod
+    def parse(name, spec):
+        settings = {'depth': 3, 'time_limit': None, 'node_limit': None, 'heuristics': {}, 'features': ()}
+        for item in spec.split(','):
+            if item.strip() == '':
+                continue
+            if '=' not in item:
+                raise Exception('ERROR: engine settings must be written as key=value, not ' + item)
+            key, value = [part.strip() for part in item.split('=', 1)]
+            if key == 'depth':
+                settings['depth'] = None if value == 'none' else int(value)
+            elif key == 'time':
+                settings['time_limit'] = float(value)
+            elif key == 'nodes':
+                settings['node_limit'] = int(value)
+            elif key == 'features':
+                settings['features'] = tuple(feature for feature in value.split('+') if feature)
+            else:
+                settings['heuristics'][key] = float(value)
+        return EngineSettings(name, **settings)
+
+    def describe(self):
+        parts = ['depth=' + str(self.depth)]
+        if self.time_limit is not None:
+            parts.append('time=' + str(self.time_limit))
+        if self.node_limit is not None:
+            parts.append('nodes=' + str(self.node_limit))
+        if self.features:
+            parts.append('features=' + '+'.join(self.features))
+        parts += [key + '=' + str(value) for key, value in self.heuristics.items()]
+        return self.name + ' (' + ','.join(parts) + ')'
+
+
+# HeuristicScores as defined in ChessAI, restored before applying an engine's overrides:
+DEFAULT_HEURISTICS = {key: value for key, value in vars(HeuristicScores).items() if key.isupper()}
+
+# sets HeuristicScores to the engine's heuristics
+# the board's incremental evaluation is recomputed, since it depends on the piece scores
+def apply_heuristics(chess_board, engine):
+    for key, value in DEFAULT_HEURISTICS.items():
+        setattr(HeuristicScores, key, value.copy() if isinstance(value, dict) else value)
+    for key, value in engine.heuristics.items():
+        if key in HeuristicScores.SCORES:
+            HeuristicScores.SCORES[key] = value
+        else:
+            setattr(HeuristicScores, key, value)
+    chess_board.refresh_evaluation()
+
+
+# plays random legal moves from the initial position, returns them as packed moves
+# (stops early rather than reaching a position without legal moves)
+def random_opening(plies, rng, backend='list'):
+    chess_board = new_chess_board(backend)
+    opening = []
+    for i in range(plies):
+        moves = chess_board.legal_moves()
+        move = rng.choice(moves)
+        chess_board.push(move)
+        if len(chess_board.legal_moves()) == 0:
+            chess_board.pop()
+            break
+        opening.append(move)
+    return opening
+
+
+# plays a game between white and black (EngineSettings) from the opening (packed moves) in a worker process
+# the game is adjudicated as a draw after max_moves moves of each player or on a threefold repetition
+# returns a dictionary with the result ('1-0', '0-1' or '1/2-1/2'), the reason, the number of plies,
+# the nodes and search seconds of each color, and the game's moves (the opening's too, packed) with the search
+# score and nodes of every move (None and 0 for the opening's)
+def play_game(index, white, black, opening, max_moves, backend='list'):
+    chess_board = new_chess_board(backend)
+    for move in opening:
+        chess_board.push(move)
+    moves = list(opening)
+    chess_board.observers.append(lambda board, move: moves.append(move))
+    move_scores = [None] * len(opening)
+    move_nodes = [0] * len(opening)
+    engines = {'w': white, 'b': black}
+    contexts = {color: SearchContext(features=SearchFeatures.from_names(engine.features))
+                for color, engine in engines.items()}
+    nodes = {'w': 0, 'b': 0}
+    seconds = {'w': 0.0, 'b': 0.0}
+    repetitions = {chess_board.zobrist_key: 1}
+
+    result = None
+    plies = 0
+    while result is None:
+        status = chess_board.get_game_status()
+        if status == GameStatus.CHECKMATE:
+            result = ('0-1' if chess_board.turn == 'w' else '1-0', 'checkmate')
+            break
+        if status == GameStatus.STALEMATE:
+            result = ('1/2-1/2', 'stalemate')
+            break
+        if plies >= 2 * max_moves:
+            result = ('1/2-1/2', 'move limit')
+            break
+
+        color = chess_board.turn
+        engine = engines[color]
+        apply_heuristics(chess_board, engine)
+        MinMax.nodes = 0
+        contexts[color].root_best = None # stays None for moves played without searching
+        start_time = time.perf_counter()
+        AI_play(chess_board, engine.depth, color, contexts[color], engine.time_limit, engine.node_limit)
+        seconds[color] += time.perf_counter() - start_time
+        nodes[color] += MinMax.nodes
+        move_scores.append(contexts[color].root_best[1] if contexts[color].root_best is not None else None)
+        move_nodes.append(MinMax.nodes)
+        plies += 1
+
+        key = chess_board.zobrist_key
+        repetitions[key] = repetitions.get(key, 0) + 1
+        if repetitions[key] >= 3:
+            result = ('1/2-1/2', 'repetition')
+
+    return {'index': index, 'white': white.name, 'black': black.name, 'result': result[0], 'reason': result[1],
+            'plies': plies, 'nodes': nodes, 'seconds': seconds, 'moves': moves, 'move_scores': move_scores,
+            'move_nodes': move_nodes}
+
+
+# estimated Elo difference of a player with the given results and its 95% confidence margin
+# (None for the margin while every game has the same result, where it can't be estimated)
+def elo_difference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, None
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def elo(score):
+        score = min(max(score, 0.001), 0.999)
+        return 400 * math.log10(score / (1 - score))
+
+    if variance == 0:
+        return elo(score), None
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+
+# plays games (rounded up to an even number) between first and second (EngineSettings) on workers processes
+# each random opening of opening_plies plies is played twice, with swapped colors
+# prints every finished game with the running score, and returns the summary
+# with record (a path), the finished games are appended to that game record file
+def run_tournament(first, second, games, workers=None, opening_plies=4, max_moves=150, seed=0, backend='list',
+                   output=print, record=None):
+    if backend not in BOARD_BACKENDS:
+        raise Exception('ERROR: unknown board backend ' + str(backend))
+    rng = random.Random(seed)
+    pairs = (games + 1) // 2
+
+    scores = {first.name: {'wins': 0, 'draws': 0, 'losses': 0}, second.name: {'wins': 0, 'draws': 0, 'losses': 0}}
+    nodes = {first.name: 0, second.name: 0}
+    seconds = {first.name: 0.0, second.name: 0.0}
+    reasons = {}
+    finished = 0
+
+    writer = GameRecordWriter(record) if record is not None else None
+    descriptions = {first.name: first.describe(), second.name: second.describe()}
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        futures = []
+        for pair in range(pairs):
+            opening = random_opening(opening_plies, rng, backend)
+            futures.append(executor.submit(play_game, 2 * pair, first, second, opening, max_moves, backend))
+            futures.append(executor.submit(play_game, 2 * pair + 1, second, first, opening, max_moves, backend))
+
+        for future in as_completed(futures):
+            game = future.result()
+            finished += 1
+
+            white, black = game['white'], game['black']
+            if game['result'] == '1-0':
+                scores[white]['wins'] += 1
+                scores[black]['losses'] += 1
+            elif game['result'] == '0-1':
+                scores[black]['wins'] += 1
+                scores[white]['losses'] += 1
+            else:
+                scores[white]['draws'] += 1
+                scores[black]['draws'] += 1
+            reasons[game['reason']] = reasons.get(game['reason'], 0) + 1
+            if writer is not None:
+                writer.write_game(GameRecord(game['moves'], game['result'], {
+                    'event': 'tournament', 'round': game['index'] + 1, 'white': descriptions[white],
+                    'black': descriptions[black], 'reason': game['reason']}, '', game['move_scores'], game['move_nodes']))
+            for color, name in (('w', white), ('b', black)):
+                nodes[name] += game['nodes'][color]
+                seconds[name] += game['seconds'][color]
+
+            elapsed = time.perf_counter() - start_time
+            score = scores[first.name]
+            elo, margin = elo_difference(score['wins'], score['draws'], score['losses'])
+            output('game %d/%d: %s - %s %s (%s, %d plies) | %s %.1f-%.1f | %.2f games/sec | %d nodes/sec | Elo %+.0f %s'
+                   % (finished, 2 * pairs, white, black, game['result'], game['reason'], game['plies'],
+                      first.name, score['wins'] + score['draws'] / 2, score['losses'] + score['draws'] / 2,
+                      finished / elapsed, sum(nodes.values()) / max(sum(seconds.values()), 1e-9),
+                      elo, '+/- %.0f' % margin if margin is not None else ''))
+
+    if writer is not None:
+        writer.close()
+    elapsed = time.perf_counter() - start_time
+    score = scores[first.name]
+    elo, margin = elo_difference(score['wins'], score['draws'], score['losses'])
+    return {'first': first.describe(), 'second': second.describe(), 'games': finished, 'scores': scores,
+            'reasons': reasons, 'elo': elo, 'elo_margin': margin, 'seconds': elapsed,
+            'games_per_second': finished / elapsed,
+            'nodes_per_second': {name: nodes[name] / seconds[name] if seconds[name] > 0 else 0 for name in nodes}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plays a headless self-play tournament between two engine settings.')
+    parser.add_argument('--games', type=int, default=20, help='number of games (rounded up to an even number)')
+    parser.add_argument('--first', default='depth=3', help="first engine's settings, like depth=3,time=0.5,"
+                        'nodes=20000,features=pvs+null_move,OPPORTUNITIES_COEF=0.1,Q=9')
+    parser.add_argument('--second', default='depth=2', help="second engine's settings")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of game processes')
+    parser.add_argument('--opening-plies', type=int, default=4, help='random plies played before the engines start')
+    parser.add_argument('--max-moves', type=int, default=150, help='moves of each player before a game is drawn')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random openings')
+    parser.add_argument('--backend', default='list', choices=sorted(BOARD_BACKENDS), help='board backend')
+    parser.add_argument('--json', help='file to write the summary to')
+    parser.add_argument('--record', help='game record file the games are appended to (see game_records.py)')
+    args = parser.parse_args()
+
+    first = EngineSettings.parse('first', args.first)
+    second = EngineSettings.parse('second', args.second)
+    print(first.describe(), 'vs', second.describe())
+    summary = run_tournament(first, second, args.games, args.workers, args.opening_plies, args.max_moves,
+                             args.seed, args.backend, record=args.record)
+
+    print('%s: +%d =%d -%d, Elo %+.0f%s, %.2f games/sec' % (
+        first.name, summary['scores'][first.name]['wins'], summary['scores'][first.name]['draws'],
+        summary['scores'][first.name]['losses'], summary['elo'],
+        ' +/- %.0f' % summary['elo_margin'] if summary['elo_margin'] is not None else '', summary['games_per_second']))
+    for name, speed in summary['nodes_per_second'].items():
+        print(name, round(speed), 'nodes/sec')
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
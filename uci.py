@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# UCI engine: plays through chess GUIs and match tools speaking the Universal Chess Interface
+# the board, search state (transposition table, move ordering) and options are kept between commands until
+# ucinewgame, the searches run on a background thread so stop, ponderhit and isready are answered meanwhile
+# with go ponder, the position after the expected reply is searched during the opponent's time, without a time
+# limit, and the search carries on with the move's time budget after ponderhit
+# moves are written in lowercase, like e2e4 or e7e8q, castling as the king's move (e1g1)
+#
+# example: python3 uci.py (the command to give the GUI)
+
+import sys
+import threading
+import time
+
+from ChessAI import (AI_DEPTH, BOARD_BACKENDS, ChessBoard, HeuristicScores, MinMax, OpeningBook, SearchContext,
+                     SearchFeatures, Tablebases, TranspositionTable, action_name, new_chess_board, play_moves)
+
+
+# the search's depth limit when searching until stopped (go infinite):
+UNLIMITED_DEPTH = 100
+# moves to go assumed when the time control doesn't say:
+DEFAULT_MOVES_TO_GO = 30
+# seconds kept aside for every move's communication with the GUI:
+MOVE_OVERHEAD = 0.05
+
+
+# seconds to search a move for, given the parameters of a go command ({name: value}), None for no time limit
+def move_time(params, turn):
+    if 'movetime' in params:
+        return max(params['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+    time_left = params.get('wtime' if turn == 'w' else 'btime')
+    if time_left is None:
+        return None
+    increment = params.get('winc' if turn == 'w' else 'binc', 0)
+    budget = time_left / params.get('movestogo', DEFAULT_MOVES_TO_GO) + increment * 3 / 4
+    return max(min(budget, time_left / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+
+# the engine's state between commands, and the commands
+# output is called with every line written to the GUI (from the command and search threads)
+class UCIEngine():
+    NAME = 'ChessAI'
+    AUTHOR = 'ChessAI authors'
+
+    def __init__(self, output=print):
+        self.output_lock = threading.Lock()
+        self.__output = output
+        self.options = {'Hash': TranspositionTable.DEFAULT_MEGABYTES, 'Depth': AI_DEPTH, 'Backend': 'list',
+                        'Features': '', 'BookFile': '', 'TablebasePath': '', 'Ponder': False}
+        self.book = None
+        self.tablebases = None
+        self.search_thread = None
+        self.new_game()
+
+    def output(self, line):
+        with self.output_lock:
+            self.__output(line)
+
+    # the option commands of the engine's options
+    def option_lines(self):
+        return ['option name Hash type spin default %d min 1 max 4096' % TranspositionTable.DEFAULT_MEGABYTES,
+                'option name Depth type spin default %d min 1 max %d' % (AI_DEPTH, UNLIMITED_DEPTH),
+                'option name Backend type combo default list ' + ' '.join('var ' + name for name in sorted(BOARD_BACKENDS)),
+                'option name Features type string default <empty>',
+                'option name BookFile type string default <empty>',
+                'option name TablebasePath type string default <empty>',
+                'option name Ponder type check default false']
+
+    # forgets the game: a new board and search state
+    def new_game(self):
+        self.stop()
+        self.chess_board = new_chess_board(self.options['Backend'])
+        self.context = SearchContext(self.options['Hash'], SearchFeatures.from_names(
+            [feature for feature in self.options['Features'].split('+') if feature]), self.book, self.tablebases)
+
+    def set_option(self, name, value):
+        if name not in self.options:
+            self.output('info string unknown option ' + name)
+            return
+        self.stop()
+        if name in ('Hash', 'Depth'):
+            value = int(value)
+        elif name == 'Ponder':
+            value = value.lower() == 'true'
+        elif value == '<empty>':
+            value = ''
+        self.options[name] = value
+
+        if name == 'BookFile':
+            if self.book is not None:
+                self.book.close()
+            self.book = OpeningBook(value) if value else None
+        if name == 'TablebasePath':
+            if self.tablebases is not None:
+                self.tablebases.close()
+            self.tablebases = Tablebases(value) if value else None
+        if name in ('Hash', 'Backend', 'Features'):
+            self.new_game()
+        else:
+            self.context.opening_book = self.book
+            self.context.tablebases = self.tablebases
+
+    # position [startpos | fen <fen>] [moves <move>...]
+    def set_position(self, words):
+        self.stop()
+        moves = words[words.index('moves') + 1:] if 'moves' in words else []
+        words = words[:words.index('moves')] if 'moves' in words else words
+        fen = ' '.join(words[1:]) if words and words[0] == 'fen' else None
+        self.chess_board = new_chess_board(self.options['Backend'], fen)
+        play_moves(self.chess_board, [move.upper() for move in moves])
+
+    # go [ponder] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [movetime ms] [depth n] [nodes n] [infinite]
+    def go(self, words):
+        self.stop()
+        params = {}
+        for index, word in enumerate(words):
+            if word in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes'):
+                params[word] = int(words[index + 1])
+        ponder = 'ponder' in words
+        infinite = 'infinite' in words
+
+        # the book's move is played without searching (but not while pondering, the reply may not come)
+        if not ponder and not infinite and self.context.opening_book is not None:
+            action = self.context.opening_book.choose(self.chess_board)
+            if action is not None:
+                self.output('bestmove ' + action_name(action).lower())
+                return
+
+        depth = params.get('depth', UNLIMITED_DEPTH if infinite else self.options['Depth'])
+        time_limit = None if infinite else move_time(params, self.chess_board.turn)
+        # the bestmove is held back until stop (or ponderhit) while pondering or searching infinitely
+        self.waiting = threading.Event()
+        if not (ponder or infinite):
+            self.waiting.set()
+        self.pondering = ponder
+        self.ponder_time = time_limit
+        # prepared before the thread starts, so a stop coming before its search starts still stops it
+        self.context.prepare_search()
+        self.search_thread = threading.Thread(target=self.__search, daemon=True,
+                                              args=(type(self.chess_board)(self.chess_board), depth,
+                                                    None if ponder else time_limit, params.get('nodes')))
+        self.search_thread.start()
+
+    # the opponent played the expected move: the ponder search goes on as a normal search of the move
+    def ponder_hit(self):
+        if self.search_thread is None or not self.pondering:
+            return
+        self.pondering = False
+        if self.ponder_time is not None:
+            self.context.deadline = time.perf_counter() + self.ponder_time
+        # a search that already finished writes its bestmove now:
+        self.waiting.set()
+
+    # stops the running search, which writes its bestmove, and waits for it
+    def stop(self):
+        if self.search_thread is None:
+            return
+        self.context.stop()
+        self.waiting.set()
+        self.search_thread.join()
+        self.search_thread = None
+
+    def __search(self, chess_board, depth, time_limit, node_limit):
+        start_time = time.perf_counter()
+        MinMax.nodes = 0
+        action = MinMax.iterative_deepening(chess_board, chess_board.turn, depth, time_limit, node_limit, self.context)
+        elapsed = time.perf_counter() - start_time
+
+        if action is not None:
+            self.output(self.info_line(chess_board, elapsed))
+        self.waiting.wait()
+        if action is None:
+            self.output('bestmove 0000')
+            return
+        move = self.__ponder_move(chess_board, action)
+        self.output('bestmove ' + action_name(action).lower() + (' ponder ' + move if move else ''))
+
+    # info depth <n> score <cp n | mate n> nodes <n> time <ms> nps <n> of the finished search
+    def info_line(self, chess_board, elapsed):
+        value = self.context.root_best[1] if self.context.root_best is not None else 0
+        if abs(value) >= HeuristicScores.CHECKMATE - 2 * UNLIMITED_DEPTH:
+            # mates found by the search are worth CHECKMATE, the tablebases' ones count their plies
+            plies = HeuristicScores.CHECKMATE - abs(value)
+            score = 'mate %d' % (max((plies + 1) // 2, 1) * (1 if value > 0 else -1))
+        else:
+            score = 'cp %d' % round(value * 100)
+        return 'info depth %d score %s nodes %d time %d nps %d' % (
+            self.context.completed_depth, score, MinMax.nodes, elapsed * 1000,
+            MinMax.nodes / elapsed if elapsed > 0 else 0)
+
+    # the reply expected after action (the best move the search stored for the position), None if unknown
+    def __ponder_move(self, chess_board, action):
+        max_player = chess_board.turn
+        chess_board = type(chess_board)(chess_board)
+        play_moves(chess_board, [action_name(action)])
+        key = SearchContext.position_key(chess_board, max_player)
+        move = self.context.transposition_table.lookup(key, 0, -MinMax.INFINITY, MinMax.INFINITY)[1]
+        if move is None or move not in chess_board.legal_moves():
+            return None
+        return action_name(ChessBoard.move_to_action(move)).lower()
+
+    # runs a command line, returns False for quit
+    def command(self, line):
+        words = line.split()
+        if not words:
+            return True
+        name, words = words[0], words[1:]
+
+        if name == 'uci':
+            self.output('id name ' + UCIEngine.NAME)
+            self.output('id author ' + UCIEngine.AUTHOR)
+            for option in self.option_lines():
+                self.output(option)
+            self.output('uciok')
+        elif name == 'isready':
+            self.output('readyok')
+        elif name == 'setoption' and 'name' in words:
+            value_index = words.index('value') if 'value' in words else len(words)
+            self.set_option(' '.join(words[words.index('name') + 1:value_index]), ' '.join(words[value_index + 1:]))
+        elif name == 'ucinewgame':
+            self.new_game()
+        elif name == 'position':
+            self.set_position(words)
+        elif name == 'go':
+            self.go(words)
+        elif name == 'ponderhit':
+            self.ponder_hit()
+        elif name == 'stop':
+            self.stop()
+        elif name == 'quit':
+            self.stop()
+            return False
+        else:
+            self.output('info string unknown command ' + name)
+        return True
+
+
+def main():
+    def output(line):
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    engine = UCIEngine(output)
+    for line in sys.stdin:
+        try:
+            if not engine.command(line):
+                break
+        except Exception as error: # a bad command mustn't end the engine
+            engine.output('info string ' + str(error))
+    engine.stop()
+
+
+if __name__ == '__main__':
+    main()